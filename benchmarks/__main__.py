@@ -0,0 +1,107 @@
+import sys
+import argparse
+
+from . import baseline, runner
+from .generators import SHAPES, parse_size
+from .operations import OPERATIONS
+
+DEFAULT_SIZES = "1MB,16MB"
+DEFAULT_CODECS = "none,zstd"
+
+def _list(text, choices=None):
+    items = [item.strip() for item in text.split(",") if item.strip()]
+
+    if choices is not None:
+        for item in items:
+            if item not in choices:
+                raise argparse.ArgumentTypeError("unknown %r, expected some of %s" % (item, ", ".join(choices)))
+
+    return items
+
+def _format_row(result, comparison=None):
+    throughput = result["throughput"]
+    memory = result["peak_memory"]
+
+    file_bytes = result["file_bytes"]
+
+    row = "%-40s %10.4fs %10s %10s %10s" % (
+        result["name"],
+        result["seconds"],
+        "%.1fMB/s" % (throughput / (1 << 20)) if throughput is not None else "-",
+        "%.1fMB" % (memory / (1 << 20)) if memory is not None else "-",
+        "%.2fMB" % (file_bytes / (1 << 20)) if file_bytes is not None else "-"
+    )
+
+    if result.get("max_stall") is not None:
+        row += "  stall %.4fs" % result["max_stall"]
+
+    if comparison is not None:
+        row += "  x%.2f time" % comparison["time_ratio"] if comparison["time_ratio"] is not None else "  -"
+
+        if comparison["memory_ratio"] is not None:
+            row += ", x%.2f memory" % comparison["memory_ratio"]
+
+        if comparison["regressions"]:
+            row += "  REGRESSION (%s)" % ", ".join(comparison["regressions"])
+
+    return row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Measure loading, flushing, backing up and decoding Storify databases."
+    )
+
+    parser.add_argument("--shapes", type=lambda text: _list(text, SHAPES), default=list(SHAPES),
+                        help="data shapes, from %s (default: all)" % ", ".join(SHAPES))
+    parser.add_argument("--sizes", type=lambda text: [parse_size(size) for size in _list(text)],
+                        default=DEFAULT_SIZES, help="data sizes, like 1MB,64MB,1GB (default: %s)" % DEFAULT_SIZES)
+    parser.add_argument("--codecs", type=_list, default=DEFAULT_CODECS,
+                        help="compression codecs (default: %s)" % DEFAULT_CODECS)
+    parser.add_argument("--operations", type=lambda text: _list(text, OPERATIONS), default=list(OPERATIONS),
+                        help="operations, from %s (default: all)" % ", ".join(OPERATIONS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of each benchmark (default: 3)")
+    parser.add_argument("--no-memory", action="store_true", help="don't measure peak memory, which takes an extra run")
+    parser.add_argument("--directory", help="where to write database files (default: a temporary directory)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by an earlier --output")
+    parser.add_argument("--threshold", type=float, default=baseline.DEFAULT_THRESHOLD,
+                        help="slowdown or memory growth counted as a regression (default: %.2f)" % baseline.DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    previous = None
+
+    if args.baseline:
+        meta, previous = baseline.load(args.baseline)
+        print("Comparing with %s (Python %s, %s)" % (args.baseline, meta.get("python"), meta.get("platform")))
+
+    print("%-40s %11s %10s %10s %10s" % ("benchmark", "median", "throughput", "peak mem", "file"))
+
+    def progress(result):
+        comparison = baseline.compare([result], previous, args.threshold) if previous is not None else []
+        print(_format_row(result, comparison[0] if comparison else None), flush=True)
+
+    results = runner.run(
+        args.shapes, args.sizes, args.codecs, args.operations,
+        repeat=args.repeat, memory=not args.no_memory, directory=args.directory, progress=progress
+    )
+
+    if args.output:
+        baseline.save(args.output, results, runner.metadata())
+        print("Wrote %d results to %s" % (len(results), args.output))
+
+    if previous is not None:
+        regressions = [comparison for comparison in baseline.compare(results, previous, args.threshold)
+                       if comparison["regressions"]]
+
+        if regressions:
+            print("%d regression(s) against the baseline" % len(regressions))
+            return 1
+
+        print("No regressions against the baseline")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import json
+
+# A result is a regression when it's this much slower, or uses this much more memory, than the baseline
+DEFAULT_THRESHOLD = 0.15
+
+# Differences smaller than these are noise, however large they are relative to the baseline
+MIN_SECONDS = 0.002
+MIN_MEMORY = 256 * 1024
+
+def save(path, results, meta):
+    """Write results to a JSON file, which can be used as a baseline later.
+
+    :param path: Path of the file
+    :type path: str
+    :param results: The results
+    :type results: list
+    :param meta: Description of the machine and versions, from :func:`benchmarks.runner.metadata`
+    :type meta: dict
+    """
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=1)
+        f.write("\n")
+
+def load(path):
+    """Read results written by :func:`save`.
+
+    :param path: Path of the file
+    :type path: str
+    :return: The metadata and the results
+    :rtype: tuple
+    """
+    with open(path) as f:
+        document = json.load(f)
+
+    return document.get("meta", {}), document["results"]
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare results with a baseline, by result name.
+
+    Times are compared by the fastest run, which varies the least between runs on a busy machine.
+
+    :param results: The new results
+    :type results: list
+    :param baseline: Results to compare with
+    :type baseline: list
+    :param threshold: Fraction by which time or peak memory may grow before it's a regression
+    :type threshold: float
+    :default threshold: 0.15
+    :return: One comparison per result that's in the baseline: ``name``, the ``time_ratio`` and
+        ``memory_ratio`` (new divided by old, None if not measured), and ``regressions``, a list
+        naming what got worse (``"time"``, ``"memory"``)
+    :rtype: list
+    """
+    previous = {result["name"]: result for result in baseline}
+    comparisons = []
+
+    for result in results:
+        old = previous.get(result["name"])
+
+        if old is None:
+            continue
+
+        regressions = []
+        time_ratio = _ratio(result["min_seconds"], old["min_seconds"])
+        memory_ratio = _ratio(result.get("peak_memory"), old.get("peak_memory"))
+
+        if time_ratio is not None and time_ratio > 1 + threshold \
+                and result["min_seconds"] - old["min_seconds"] > MIN_SECONDS:
+            regressions.append("time")
+
+        if memory_ratio is not None and memory_ratio > 1 + threshold \
+                and result["peak_memory"] - old["peak_memory"] > MIN_MEMORY:
+            regressions.append("memory")
+
+        comparisons.append({
+            "name": result["name"],
+            "time_ratio": time_ratio,
+            "memory_ratio": memory_ratio,
+            "regressions": regressions
+        })
+
+    return comparisons
+
+def _ratio(new, old):
+    if new is None or not old:
+        return None
+
+    return new / old
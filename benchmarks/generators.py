@@ -0,0 +1,171 @@
+import random
+import msgpack
+
+from storify.model import Model, SlotModel
+
+# Every generator is seeded, so the same shape and size always produce the same data
+SEED = 1234
+
+NAMES = ["Greg", "John", "Jane", "Bob", "Alice", "Tom", "Jerry", "SpongeBob", "Patrick", "Squidward"]
+FOODS = ["Pizza", "Burger", "Salad", "Ice Cream", "Sushi"]
+
+# Size of each value of the "blobs" shape
+BLOB_SIZE = 1024 * 1024
+
+class Person(Model):
+    """The model of ``examples/people.py``, with its random fields passed in instead."""
+
+    def __init__(self, name=None, age=0, food=None):
+        self.name = name
+        self.age = age
+        self.food = food
+
+class SlotPerson(SlotModel):
+    """The same model as :class:`Person`, with declared fields."""
+
+    name: str
+    age: int = 0
+    food: str
+
+def _person(rng, model):
+    return model(name=rng.choice(NAMES), age=rng.randrange(1, 100), food=rng.choice(FOODS))
+
+def _fill(size, make):
+    # Make values until their packed size reaches ``size``, estimating from the first few
+    sample = [make(i) for i in range(64)]
+    packed = len(msgpack.packb(sample, default=_encode_sample))
+    count = max(1, size * len(sample) // max(packed, 1))
+
+    return sample[:count] + [make(i) for i in range(len(sample), count)]
+
+def _encode_sample(value):
+    # Only used to estimate sizes; databases encode models themselves
+    if isinstance(value, Model):
+        return {value._keyname(): value._to_dict()}
+
+    return value
+
+def flat(size):
+    """A dict of ``size`` bytes of short scalar values under top-level keys.
+
+    :param size: Approximate size of the packed data, in bytes
+    :type size: int
+    :rtype: dict
+    """
+    rng = random.Random(SEED)
+
+    def make(i):
+        kind = i % 4
+
+        if kind == 0:
+            value = rng.randrange(1 << 40)
+        elif kind == 1:
+            value = rng.random()
+        elif kind == 2:
+            value = rng.choice(NAMES) * rng.randrange(1, 4)
+        else:
+            value = rng.random() < 0.5
+
+        return "key%08d" % i, value
+
+    return dict(_fill(size, make))
+
+def nested(size):
+    """A dict of ``size`` bytes of deeply nested dicts and lists.
+
+    :param size: Approximate size of the packed data, in bytes
+    :type size: int
+    :rtype: dict
+    """
+    rng = random.Random(SEED)
+
+    def tree(depth):
+        if depth == 0:
+            return [rng.randrange(1000), rng.choice(NAMES), rng.random()]
+
+        return {"level%d_%d" % (depth, i): tree(depth - 1) for i in range(3)}
+
+    def make(i):
+        return "doc%06d" % i, {"id": i, "tags": [rng.choice(FOODS) for _ in range(3)], "tree": tree(5)}
+
+    return dict(_fill(size, make))
+
+def models(size):
+    """A list of ``size`` bytes of :class:`Person` models, as in ``examples/people.py``.
+
+    :param size: Approximate size of the packed data, in bytes
+    :type size: int
+    :rtype: dict
+    """
+    rng = random.Random(SEED)
+
+    return {"people": _fill(size, lambda i: _person(rng, Person))}
+
+def slots(size):
+    """A list of ``size`` bytes of :class:`SlotPerson` models.
+
+    :param size: Approximate size of the packed data, in bytes
+    :type size: int
+    :rtype: dict
+    """
+    rng = random.Random(SEED)
+
+    return {"people": _fill(size, lambda i: _person(rng, SlotPerson))}
+
+def blobs(size):
+    """Binary values of 1 MiB (or ``size``, if smaller) adding up to ``size`` bytes.
+
+    Half of each blob is random and half repeats, so compression has something to do.
+
+    :param size: Approximate size of the packed data, in bytes
+    :type size: int
+    :rtype: dict
+    """
+    rng = random.Random(SEED)
+    blob_size = min(size, BLOB_SIZE)
+    count = max(1, size // blob_size)
+
+    return {
+        "blob%06d" % i: rng.randbytes(blob_size // 2) + bytes([i % 256]) * (blob_size - blob_size // 2)
+        for i in range(count)
+    }
+
+SHAPES = {
+    "flat": flat,
+    "nested": nested,
+    "models": models,
+    "slots": slots,
+    "blobs": blobs
+}
+
+# Models the generated data uses, to register with the databases that hold it
+MODELS = [Person, SlotPerson]
+
+def parse_size(text):
+    """Parse a size like ``"512KB"``, ``"16MB"`` or ``"1GB"``, in powers of 1024.
+
+    :param text: The size
+    :type text: str
+    :rtype: int
+    :raises ValueError: If the size can't be parsed
+    """
+    text = text.strip().upper()
+
+    for suffix, factor in (("KB", 1 << 10), ("MB", 1 << 20), ("GB", 1 << 30), ("B", 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+
+    return int(text)
+
+def format_size(size):
+    """Format a size in bytes the way :func:`parse_size` reads it.
+
+    :param size: Size in bytes
+    :type size: int
+    :rtype: str
+    """
+    for suffix, factor in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if size >= factor and size % factor == 0:
+            return "%d%s" % (size // factor, suffix)
+
+    return "%dB" % size
@@ -0,0 +1,64 @@
+import gc
+import time
+import statistics
+import tracemalloc
+
+def measure(run, setup=None, teardown=None, repeat=3, memory=True):
+    """Time a function, and measure the memory it allocates at its peak.
+
+    ``setup`` is called before every run, and isn't timed; whatever it returns is passed
+    to ``run`` and ``teardown``. Runs are timed without tracing memory, which slows Python
+    down a lot, and then ``run`` is called once more with tracemalloc on for the peak.
+    Only memory allocated through Python is seen, so a forked child process isn't counted.
+
+    :param run: The function to measure, called with the result of ``setup``
+    :type run: callable
+    :param setup: Prepares each run
+    :type setup: callable
+    :param teardown: Cleans up after each run, called with the result of ``setup``
+    :type teardown: callable
+    :param repeat: Number of timed runs
+    :type repeat: int
+    :default repeat: 3
+    :param memory: Whether to measure peak memory
+    :type memory: bool
+    :default memory: True
+    :return: ``seconds`` (median), ``min_seconds``, ``max_seconds`` and ``peak_memory`` in bytes (None if not measured)
+    :rtype: dict
+    """
+    times = []
+
+    for i in range(repeat + (1 if memory else 0)):
+        state = setup() if setup is not None else None
+        tracing = memory and i == repeat
+
+        # Garbage from earlier runs shouldn't be collected on this one's time
+        gc.collect()
+
+        try:
+            if tracing:
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+
+            started = time.perf_counter()
+            run(state)
+            elapsed = time.perf_counter() - started
+
+            if tracing:
+                peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+            else:
+                times.append(elapsed)
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+            if teardown is not None:
+                teardown(state)
+
+    return {
+        "seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "max_seconds": max(times),
+        "peak_memory": peak_memory if memory else None
+    }
@@ -0,0 +1,429 @@
+import os
+import time
+import shutil
+import logging
+import tracemalloc
+import msgpack
+
+from storify.logger import Logger
+from storify.database import Database
+from storify.database.backups import Backups
+from storify.model import Model
+from storify.tracking import TrackedDict, TrackedList, adopt
+
+from .generators import MODELS
+
+class Environment:
+    def __init__(self, directory, shape, size, data):
+        """Initialize the Environment instance.
+
+        The data of one shape and size, and a directory to write it to with each codec.
+
+        :param directory: Directory for the database files, which is emptied as needed
+        :type directory: str
+        :param shape: Name of the data's shape
+        :type shape: str
+        :param size: Size the data was generated for, in bytes
+        :type size: int
+        :param data: The data
+        :type data: dict
+        """
+        self.directory = directory
+        self.shape = shape
+        self.size = size
+        self.data = data
+        self.log = Logger(level=logging.ERROR)
+
+        self._data_bytes = None
+        self._written = {}
+
+    @property
+    def data_bytes(self):
+        """Get the size of the data packed with msgpack, uncompressed, in bytes.
+
+        :rtype: int
+        """
+        if self._data_bytes is None:
+            db = self.database("size")
+            packer = msgpack.Packer(default=db.encode_type)
+
+            # One value at a time, so the whole packed data is never in memory at once
+            self._data_bytes = len(packer.pack_map_header(len(self.data))) + sum(
+                len(packer.pack(key)) + len(packer.pack(value)) for key, value in self.data.items())
+
+        return self._data_bytes
+
+    def database(self, name, codec="none", **options):
+        """Open a database in the directory, holding the data if its file doesn't exist yet.
+
+        :param name: Name of the database
+        :type name: str
+        :param codec: Compression codec to write it with
+        :type codec: str
+        :param options: Other keyword arguments for the Database
+        :rtype: Database
+        """
+        return Database(name=name, root=self.directory, log=self.log, rootdata=dict(self.data),
+                        models=MODELS, compression=codec, **options)
+
+    def path(self, name):
+        """Get the path of a database's file.
+
+        :param name: Name of the database
+        :type name: str
+        :rtype: str
+        """
+        return os.path.join(self.directory, "%s.mpack" % name)
+
+    def remove(self, name):
+        """Remove a database's file and its backups.
+
+        :param name: Name of the database
+        :type name: str
+        """
+        if os.path.exists(self.path(name)):
+            os.remove(self.path(name))
+
+        shutil.rmtree(os.path.join(self.directory, ".backups", name), ignore_errors=True)
+
+    def written(self, codec, model_encoding="dict"):
+        """Get a database whose file holds the data, written with ``codec``.
+
+        :param codec: Compression codec
+        :type codec: str
+        :param model_encoding: How models are encoded in the file
+        :type model_encoding: str
+        :default model_encoding: "dict"
+        :rtype: Database
+        """
+        key = (codec, model_encoding)
+
+        if key not in self._written:
+            db = self._written[key] = self.database("written-%s-%s" % key, codec, model_encoding=model_encoding)
+            db.flush(force=True)
+
+        return self._written[key]
+
+    @property
+    def has_models(self):
+        """Whether the data holds lists of models.
+
+        :rtype: bool
+        """
+        return any(isinstance(value, list) and value and isinstance(value[0], Model) for value in self.data.values())
+
+class Operation:
+    """A benchmarked operation. Subclasses set ``name`` and implement :meth:`setup` and :meth:`run`."""
+
+    name = None
+
+    # Whether the codec changes the result; operations that don't are only run once per shape and size
+    uses_codec = True
+
+    def applies_to(self, env):
+        """Whether the operation makes sense for the environment's data.
+
+        :param env: The environment
+        :type env: Environment
+        :rtype: bool
+        """
+        return True
+
+    def setup(self, env, codec):
+        """Prepare one run. Not timed.
+
+        :param env: The environment
+        :type env: Environment
+        :param codec: Compression codec
+        :type codec: str
+        :return: State passed to :meth:`run` and :meth:`teardown`
+        """
+        return None
+
+    def run(self, state):
+        """Do the operation once. Timed."""
+        raise NotImplementedError
+
+    def teardown(self, state):
+        """Clean up after a run. Not timed."""
+        pass
+
+    def file_bytes(self, env, codec):
+        """Get the size of the file the operation works on, in bytes.
+
+        :rtype: int
+        """
+        return os.path.getsize(env.written(codec).path)
+
+    def metrics(self):
+        """Get measurements of the runs other than time and memory, added to the result.
+
+        Called once after all runs of a benchmark.
+
+        :rtype: dict
+        """
+        return {}
+
+class Flush(Operation):
+    """``Database.flush()`` of the whole data to a new file: serializing, compressing and writing it."""
+
+    name = "flush"
+    serializer = "thread"
+    model_encoding = "dict"
+
+    def setup(self, env, codec):
+        name = "%s-%s" % (self.name, codec)
+
+        # Without an existing file there's nothing to back up, so only the write is measured
+        env.remove(name)
+
+        return env, name, env.database(name, codec, serializer=self.serializer, model_encoding=self.model_encoding)
+
+    def run(self, state):
+        env, name, db = state
+        db.flush(force=True)
+
+    def teardown(self, state):
+        env, name, db = state
+        env.remove(name)
+
+class ForkedFlush(Flush):
+    """``Database.flush()`` with ``serializer="fork"``. The child's memory isn't counted."""
+
+    name = "flush_fork"
+    serializer = "fork"
+
+    def applies_to(self, env):
+        return hasattr(os, "fork")
+
+class ExtFlush(Flush):
+    """``Database.flush()`` with ``model_encoding="ext"``, which packs models as msgpack ext types."""
+
+    name = "flush_ext"
+    model_encoding = "ext"
+
+    def applies_to(self, env):
+        return env.has_models
+
+    def file_bytes(self, env, codec):
+        return os.path.getsize(env.written(codec, self.model_encoding).path)
+
+class FlushStall(Flush):
+    """``Database.flush_async()`` while the main thread keeps running, like an application serving
+    requests during a flush. Records the longest the main thread went without running, which is
+    how long the flush held the GIL at once."""
+
+    name = "flush_stall"
+
+    def __init__(self):
+        self._stalls = []
+
+    def run(self, state):
+        env, name, db = state
+        future = db.flush_async(force=True)
+
+        stall = 0
+        last = time.perf_counter()
+
+        while not future.done():
+            now = time.perf_counter()
+            stall = max(stall, now - last)
+            last = now
+
+        future.result()
+
+        # The run with tracemalloc on is much slower, so its stall isn't comparable
+        if not tracemalloc.is_tracing():
+            self._stalls.append(stall)
+
+    def metrics(self):
+        stalls, self._stalls = self._stalls, []
+
+        return {"max_stall": max(stalls) if stalls else None}
+
+class ForkedFlushStall(FlushStall):
+    """:class:`FlushStall` with ``serializer="fork"``, which packs the data in a child process."""
+
+    name = "flush_stall_fork"
+    serializer = "fork"
+
+    def applies_to(self, env):
+        return hasattr(os, "fork")
+
+class Unpack(Operation):
+    """``Database.unpack()`` of a whole file: reading, decompressing and decoding it."""
+
+    name = "unpack"
+    lazy = False
+    model_encoding = "dict"
+
+    def setup(self, env, codec):
+        db = env.written(codec, self.model_encoding)
+        db.lazy = self.lazy
+
+        return db
+
+    def run(self, db):
+        db.unpack(db.path)
+
+class LazyUnpack(Unpack):
+    """``Database.unpack()`` with ``lazy=True``, which only indexes the top-level keys."""
+
+    name = "unpack_lazy"
+    lazy = True
+
+class ExtUnpack(Unpack):
+    """``Database.unpack()`` of a file written with ``model_encoding="ext"``."""
+
+    name = "unpack_ext"
+    model_encoding = "ext"
+
+    def applies_to(self, env):
+        return env.has_models
+
+    def file_bytes(self, env, codec):
+        return os.path.getsize(env.written(codec, self.model_encoding).path)
+
+def _legacy_decode_type(models, data):
+    # decode_type() of Storify before single-pass decoding: models are looked up one by one
+    model_class = next((cls for cls in models if cls._keyname() in data), None)
+
+    if model_class is None:
+        return data
+
+    return model_class()._from_dict(data[model_class._keyname()])
+
+def _legacy_walk(data):
+    # The second pass of unpack() before single-pass decoding, which rebuilt every dict and list
+    # as a tracked container and turned bytes into str
+    if isinstance(data, dict):
+        walked = TrackedDict()
+
+        for key in data:
+            value = _legacy_walk(data[key])
+
+            if isinstance(key, bytes):
+                key = key.decode("utf8")
+
+            if key in walked and isinstance(value, (str, bytes, list, dict)) and len(value) < 1:
+                continue
+
+            dict.__setitem__(walked, key, value)
+
+        adopt(walked, walked.values())
+
+        return walked
+
+    if isinstance(data, list):
+        walked = TrackedList(_legacy_walk(item) for item in data)
+        adopt(walked, walked)
+
+        return walked
+
+    if isinstance(data, Model):
+        data._storify_adopt()
+
+        return data
+
+    if isinstance(data, bytes):
+        try:
+            return data.decode("utf8")
+        except UnicodeDecodeError:
+            return data
+
+    return data
+
+class LegacyUnpack(Unpack):
+    """How ``Database.unpack()`` decoded files before single-pass decoding: ``msgpack.unpackb``
+    with an ``object_hook``, then a second walk that rebuilds the result as tracked containers.
+    Compare with ``unpack``.
+    Only plain files, which the old code could read, so it doesn't use the codec."""
+
+    name = "unpack_legacy"
+    uses_codec = False
+
+    def run(self, db):
+        with open(db.path, "rb") as f:
+            data = msgpack.unpackb(f.read(), object_hook=lambda value: _legacy_decode_type(MODELS, value))
+
+        _legacy_walk(data)
+
+class Backup(Operation):
+    """``Backups.backup()`` of a file into an empty backup directory."""
+
+    name = "backup"
+
+    def setup(self, env, codec):
+        db = env.written(codec)
+        shutil.rmtree(os.path.join(env.directory, ".backups", db.name), ignore_errors=True)
+
+        # A new Backups instance, so nothing is remembered from earlier runs
+        db.backups = Backups(db, max_backups=1000)
+
+        return db
+
+    def run(self, db):
+        db.backups.backup()
+
+class RepeatedBackup(Backup):
+    """``Backups.backup()`` of a file that was already backed up, whose chunks are all stored."""
+
+    name = "backup_repeat"
+
+    def setup(self, env, codec):
+        db = super().setup(env, codec)
+        db.backups.backup()
+
+        return db
+
+class DecodeType(Operation):
+    """``Database.decode_type()`` of every model in a list, from the dicts they're stored as."""
+
+    name = "decode_type"
+    uses_codec = False
+
+    def applies_to(self, env):
+        return env.has_models
+
+    def setup(self, env, codec):
+        db = env.database("decode")
+        encoded = [db.encode_type(row) for value in env.data.values() if isinstance(value, list) for row in value]
+
+        return db, encoded
+
+    def run(self, state):
+        db, encoded = state
+
+        for value in encoded:
+            db.decode_type(value)
+
+    def file_bytes(self, env, codec):
+        return None
+
+class EncodeType(Operation):
+    """``Database.encode_type()`` of every model in a list, into the dicts they're stored as."""
+
+    name = "encode_type"
+    uses_codec = False
+
+    def applies_to(self, env):
+        return env.has_models
+
+    def setup(self, env, codec):
+        db = env.database("encode")
+        models = [row for value in env.data.values() if isinstance(value, list) for row in value]
+
+        return db, models
+
+    def run(self, state):
+        db, models = state
+
+        for model in models:
+            db.encode_type(model)
+
+    def file_bytes(self, env, codec):
+        return None
+
+OPERATIONS = {operation.name: operation for operation in (
+    Flush(), ForkedFlush(), ExtFlush(), FlushStall(), ForkedFlushStall(),
+    Unpack(), LazyUnpack(), ExtUnpack(), LegacyUnpack(), Backup(), RepeatedBackup(), EncodeType(), DecodeType())}
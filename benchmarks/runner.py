@@ -0,0 +1,127 @@
+import gc
+import sys
+import time
+import shutil
+import platform
+import tempfile
+
+from storify.database.codecs import CODECS
+
+from .generators import SHAPES, format_size
+from .operations import OPERATIONS, Environment
+from .measure import measure
+
+# Version of the results format, bumped when fields change meaning
+FORMAT = 1
+
+def result_name(operation, shape, size, codec):
+    """Get the name a result is compared with the baseline by.
+
+    :rtype: str
+    """
+    return "%s/%s/%s/%s" % (operation, shape, format_size(size), codec)
+
+def metadata():
+    """Describe the machine and versions the benchmarks ran with.
+
+    :rtype: dict
+    """
+    import msgpack
+
+    return {
+        "format": FORMAT,
+        "created": time.time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "msgpack": ".".join(str(part) for part in msgpack.version),
+        "codecs": sorted(CODECS)
+    }
+
+def run(shapes, sizes, codecs, operations, repeat=3, memory=True, directory=None, progress=None):
+    """Run the benchmarks for every combination of shape, size, codec and operation.
+
+    Data is generated once per shape and size. Operations that don't depend on the codec
+    run once, with the ``"none"`` codec. Codecs whose package isn't installed are skipped.
+
+    :param shapes: Names of data shapes, from :data:`benchmarks.generators.SHAPES`
+    :type shapes: list
+    :param sizes: Sizes of the data, in bytes
+    :type sizes: list
+    :param codecs: Names of compression codecs
+    :type codecs: list
+    :param operations: Names of operations, from :data:`benchmarks.operations.OPERATIONS`
+    :type operations: list
+    :param repeat: Number of timed runs of each benchmark
+    :type repeat: int
+    :default repeat: 3
+    :param memory: Whether to measure peak memory, which takes one more run
+    :type memory: bool
+    :default memory: True
+    :param directory: Where to write database files, defaults to a temporary directory
+    :type directory: str
+    :param progress: Called with each result as it's produced
+    :type progress: callable
+    :return: The results
+    :rtype: list
+    """
+    available = [codec for codec in codecs if codec in CODECS]
+
+    for codec in codecs:
+        if codec not in CODECS:
+            print("Skipping codec %r, which isn't available" % codec, file=sys.stderr)
+
+    results = []
+
+    for shape in shapes:
+        for size in sizes:
+            work = tempfile.mkdtemp(prefix="storify-bench-", dir=directory)
+
+            try:
+                env = Environment(work, shape, size, SHAPES[shape](size))
+
+                for name in operations:
+                    operation = OPERATIONS[name]
+
+                    if not operation.applies_to(env):
+                        continue
+
+                    for codec in (available if operation.uses_codec else ["none"]):
+                        result = _run_one(env, operation, codec, repeat, memory)
+                        results.append(result)
+
+                        if progress is not None:
+                            progress(result)
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+
+                # Free the data before generating the next
+                env = None
+                gc.collect()
+
+    return results
+
+def _run_one(env, operation, codec, repeat, memory):
+    measured = measure(
+        operation.run,
+        setup=lambda: operation.setup(env, codec),
+        teardown=operation.teardown,
+        repeat=repeat,
+        memory=memory
+    )
+
+    data_bytes = env.data_bytes
+
+    return dict(
+        name=result_name(operation.name, env.shape, env.size, codec),
+        operation=operation.name,
+        shape=env.shape,
+        size=env.size,
+        codec=codec,
+        data_bytes=data_bytes,
+        file_bytes=operation.file_bytes(env, codec),
+        throughput=data_bytes / measured["seconds"] if measured["seconds"] > 0 else None,
+        **measured,
+        **operation.metrics()
+    )
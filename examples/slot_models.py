@@ -0,0 +1,41 @@
+from storify import Storify
+from storify.model import SlotModel
+
+import random
+
+# This code shows a SlotModel: a model whose fields are declared with class annotations
+# and stored in __slots__ instead of a per-instance __dict__, which makes large
+# collections of small models use less memory and encode faster.
+# A value assigned in the class body is the field's default, and only declared
+# fields can be set.
+
+class Car(SlotModel):
+    name: str
+    color: str
+    year: int = 2024
+    owners: list = []
+
+def main():
+    storify = Storify(models=[Car])
+    db = storify.get_db(name="slot_car_db")
+
+    if "cars" not in db:
+        db["cars"] = []
+
+    car = Car(
+        name=random.choice(["Tesla", "Toyota", "Ford", "Chevy", "Volvo"]),
+        color=random.choice(["Red", "Blue", "Green", "Yellow", "Black", "White"]),
+    )
+
+    db["cars"].append(car)
+
+    # Changes to stored models, including their lists, are tracked
+    db["cars"][-1].owners.append("Greg")
+
+    for car in db["cars"]:
+        print(car)
+
+    db.flush()
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name='storify',
     version='0.0.11',
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     include_package_data=True,
     license='MIT',
     description='A lightweight database system for Python',
@@ -25,4 +25,8 @@ setup(
     install_requires=[
         'msgpack',
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+    },
 )
\ No newline at end of file
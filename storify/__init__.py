@@ -1,13 +1,22 @@
 import os
 import time
 import copy
+import shutil
+import operator
+import atexit
 import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from .logger import Logger
 from .database import Database
+from .scheduler import Scheduler
+from .model import ModelRegistry
 
 class Storify:
-    def __init__(self, root="data", save_interval=60, log=None, verbose=False, models=[]):
+    def __init__(self, root="data", save_interval=60, log=None, verbose=False, models=[], db_options=None, autosave=False,
+                 flush_workers=1, max_open=None, max_memory=None):
         """Initialize the Storify instance.
 
         :param root: The root directory where databases will be stored
@@ -22,69 +31,242 @@ class Storify:
         :type log: DummyLogger
         :default log: None
 
-        :param models: A list of model classes to be used with the Storify instance
-        :type models: list
+        :param models: Model classes to be used with the Storify instance. They're kept in
+            ``self.models``, a :class:`~storify.model.ModelRegistry` that more can be added to
+            with ``register()`` or ``append()``.
+        :type models: list or ModelRegistry
         :default models: []
+        :raises ModelRegistrationError: If two models share the same keyname
+
+        :param db_options: Default keyword arguments for every Database opened by this instance, such as ``journal=True``
+        :type db_options: dict
+        :default db_options: None
+
+        :param autosave: Flush databases on a background thread every save_interval, instead of relying on tick()
+        :type autosave: bool
+        :default autosave: False
+
+        :param flush_workers: Number of databases flush() and close() write at the same time
+        :type flush_workers: int
+        :default flush_workers: 1
+
+        :param max_open: Maximum number of databases to keep open. Opening another one closes the least recently used.
+        :type max_open: int
+        :default max_open: None
+
+        :param max_memory: Approximate memory budget in bytes for the data of open databases. When it's
+            exceeded, the least recently used databases are flushed and unloaded until the rest fit.
+            Unloaded databases are read from disk again on next access.
+        :type max_memory: int
+        :default max_memory: None
         """
         self.root = root
         self.save_interval = save_interval
         self.log = log if log is not None else Logger(level=logging.DEBUG if verbose else logging.INFO)
-        self.models = models
+        self.models = ModelRegistry(models)
+        self.db_options = db_options or {}
+        self.flush_workers = flush_workers
+        self.max_open = max_open
+        self.max_memory = max_memory
 
-        self.databases = []
+        # Open databases by name. Closed databases remove themselves.
+        self.databases = {}
+        self._registry_lock = threading.RLock()
 
         if not os.path.exists(self.root):
             os.mkdir(self.root)
 
         if not os.path.exists(os.path.join(self.root, ".backups")):
             os.mkdir(os.path.join(self.root, ".backups"))
+
+        # Databases opened after a check wait for the next one, so short intervals check more often
+        self.scheduler = Scheduler(self, resolution=min(1.0, save_interval))
+
+        if autosave:
+            self.start_autosave()
+
+    def start_autosave(self):
+        """Start flushing databases on a background thread.
+
+        Each database is flushed once per its own save_interval, falling back to the
+        Storify save_interval. Databases are flushed, and autosave is stopped, when
+        close() is called or the interpreter exits.
+        """
+        self.scheduler.start()
+        atexit.register(self.close)
+
+    def stop_autosave(self):
+        """Stop the background autosave thread, waiting for a flush in progress to finish."""
+        self.scheduler.stop()
+        atexit.unregister(self.close)
+
+    def close(self, workers=None, deadline=None):
+        """Stop autosave and close all open databases, flushing any changes to disk.
+
+        :param workers: Number of databases to flush at the same time, defaults to ``flush_workers``
+        :type workers: int
+        :default workers: None
+        :param deadline: Time in seconds to spend flushing, see :meth:`flush`. Databases that
+            weren't flushed in time are left open.
+        :type deadline: float
+        :default deadline: None
+        :return: The report of :meth:`flush`
+        :rtype: dict
+        """
+        self.stop_autosave()
+
+        report = self.flush(workers, deadline)
+
+        for db in self.active_databases():
+            if report.get(self._report_name(db), {}).get("status") in ("timeout", "not_started"):
+                continue
+
+            try:
+                db.close()
+            except Exception:
+                self.log.traceback(f"Failed to close db `{db.name}`")
+
+        return report
  
     def get_db(self,
                name,
-               root={}):
+               root={},
+               **options):
         """Get or create a database instance.
 
+        If the database is already open, the open instance is returned, and ``root`` and
+        ``options`` are ignored. Opening a database beyond ``max_open`` closes the least
+        recently used one.
+
         :param name: Name of the database
         :type name: str
         :param root: Initial root data structure for new database
         :type root: dict
         :default root: {}
+        :param options: Keyword arguments for the Database, overriding ``db_options``
         :return: Database instance
         :rtype: Database
         """
-        # Check if database is already loaded
-        try:
-            self.get_loaded_db(name)
-            raise ValueError(f"Database '{name}' is already loaded.")
-        except ValueError:
-            pass
-        
-        _root = copy.deepcopy(root)
+        with self._registry_lock:
+            db = self.databases.get(name)
 
-        db = Database(
-            name=name,
-            root=self.root,
-            log=self.log,
-            rootdata=_root,
-            models=self.models
-        )
-        self.databases.append(db)
+            if db is not None:
+                db._access()
+                return db
+
+            _root = copy.deepcopy(root)
+
+            db = Database(
+                name=name,
+                root=self.root,
+                log=self.log,
+                rootdata=_root,
+                models=self.models,
+                **dict(self.db_options, **options)
+            )
+            db.close_callbacks.append(self._forget)
+
+            self.databases[name] = db
+            self._evict()
+
+        self._enforce_memory(keep=db)
 
         return db
 
+    def _forget(self, db):
+        with self._registry_lock:
+            if self.databases.get(db.name) is db:
+                del self.databases[db.name]
+
+    def _evict(self):
+        # Close the least recently used databases beyond max_open. Called with the registry lock held,
+        # so a database can't be opened again while it's being closed.
+        if self.max_open is None:
+            return
+
+        while len(self.databases) > self.max_open:
+            db = min(self.databases.values(), key=operator.attrgetter("last_used"))
+            self.log.debug(f"Closing least recently used db `{db.name}`")
+
+            try:
+                db.close()
+            except Exception:
+                self.log.traceback(f"Failed to close db `{db.name}`")
+            finally:
+                self._forget(db)
+
+    def _enforce_memory(self, keep=None):
+        # Unload the least recently used databases while the open ones use more than max_memory
+        if self.max_memory is None:
+            return
+
+        databases = self.active_databases()
+        usage = {db: db.memory_usage() for db in databases}
+        total = sum(usage.values())
+
+        for db in databases:
+            if total <= self.max_memory:
+                break
+
+            if db is keep or not usage[db]:
+                continue
+
+            self.log.debug(f"Unloading db `{db.name}` to stay within max_memory")
+
+            try:
+                if db.unload():
+                    total -= usage[db]
+            except Exception:
+                self.log.traceback(f"Failed to unload db `{db.name}`")
+
+    def memory_usage(self):
+        """Estimate the memory held by the data of all open databases, in bytes.
+
+        :rtype: int
+        """
+        return sum(db.memory_usage() for db in self.active_databases())
+
     def get_loaded_db(self, name):
         """Get a currently loaded database instance by name.
 
         :param name: Name of the database to get
         :type name: str
-        :return: Database instance if found, None otherwise
-        :rtype: Database or None
+        :return: Database instance
+        :rtype: Database
+        :raises ValueError: If the database isn't loaded
         """
-        for db in self.databases:
-            if db.name == name and not db.defunct:
-                return db
-        raise ValueError(f"Database '{name}' is not currently loaded.")
+        with self._registry_lock:
+            db = self.databases.get(name)
+
+            if db is None:
+                raise ValueError(f"Database '{name}' is not currently loaded.")
+
+            db._access()
+
+        return db
     
+    def register_model(self, model):
+        """Register a model class with this Storify instance and all of its databases.
+
+        Can be used as a class decorator.
+
+        :param model: The model class to register
+        :type model: type
+        :return: The model class
+        :rtype: type
+        :raises ModelRegistrationError: If another model is already registered with the same keyname
+        """
+        return self.models.register(model)
+
+    def active_databases(self):
+        """Get all databases that are currently open.
+
+        :return: List of open Database instances, from least to most recently used
+        :rtype: list
+        """
+        with self._registry_lock:
+            return sorted(self.databases.values(), key=operator.attrgetter("last_used"))
+
     def get_db_by_path(self, path):
         """Get a database instance directly by its path, unmanaged by the root Storify path.
 
@@ -96,7 +278,8 @@ class Storify:
         return Database(
             path=path, 
             log=self.log,
-            models=self.models
+            models=self.models,
+            **self.db_options
         )
 
     def db_exists(self, name):
@@ -107,9 +290,10 @@ class Storify:
         :return: True if database exists, False otherwise
         :rtype: bool
         """
-        return os.path.exists(
-            os.path.join(self.root, name + ".mpack")
-        )
+        path = os.path.join(self.root, name)
+
+        # Sharded databases are a directory with a manifest instead of a single file
+        return os.path.exists(path + ".mpack") or os.path.exists(os.path.join(path, "manifest"))
 
     def rename_db(self, old_name, new_name):
         """Rename a database file.
@@ -124,8 +308,17 @@ class Storify:
         old_path = os.path.join(self.root, old_name + ".mpack")
         new_path = os.path.join(self.root, new_name + ".mpack")
 
+        if os.path.isdir(os.path.join(self.root, old_name)):
+            os.rename(os.path.join(self.root, old_name), os.path.join(self.root, new_name))
+
+            if not os.path.exists(old_path):
+                return
+
         os.rename(old_path, new_path)
 
+        if os.path.exists(old_path + ".wal"):
+            os.rename(old_path + ".wal", new_path + ".wal")
+
     def remove_db(self, name):
         """Remove a database file.
 
@@ -136,34 +329,142 @@ class Storify:
         """
         path = os.path.join(self.root, name + ".mpack")
 
+        if os.path.isdir(os.path.join(self.root, name)):
+            shutil.rmtree(os.path.join(self.root, name))
+
+            if not os.path.exists(path):
+                return
+
         os.remove(path)
 
+        if os.path.exists(path + ".wal"):
+            os.remove(path + ".wal")
+
     def tick(self, force=False):
         """Tick all open databases.
 
         Flushes databases to disk if they haven't been flushed recently based on save_interval.
+        Databases that haven't changed since their last flush are skipped. Databases opened
+        with ``access="reader"`` are reloaded if another process has changed them.
 
         :param force: Force flush all databases regardless of last flush time
         :type force: bool
         :default force: False
         """
-        # Filter out defunct databases
-        active_dbs = [db for db in self.databases if not db.defunct]
+        for db in self.active_databases():
+            # Databases opened with access="reader" pick up what other processes wrote
+            db.refresh()
 
-        for db in active_dbs:
             if force:
                 db.flush()
             else:
-                # Saves on a regular interval based off of self.save_interval
-                if time.time() - db.last_flush > self.save_interval:
+                # Saves on a regular interval based off of self.save_interval, unless the db has its own
+                save_interval = db.save_interval if db.save_interval is not None else self.save_interval
+
+                if time.time() - db.last_flush > save_interval:
                     db.flush()
 
-    def flush(self):
+        self._enforce_memory()
+
+    def flush(self, workers=None, deadline=None):
         """Flush all open databases to disk immediately.
 
-        Forces an immediate flush of all active databases by calling tick with force=True.
+        Databases are flushed on ``workers`` threads at once, those with the most changes
+        first, then the largest. Unchanged databases are skipped.
+
+        :param workers: Number of databases to flush at the same time, defaults to ``flush_workers``
+        :type workers: int
+        :default workers: None
+        :param deadline: Maximum time in seconds to wait. Flushes that haven't started by then
+            are cancelled, and flushes still running are left to finish in the background.
+        :type deadline: float
+        :default deadline: None
+        :return: Mapping of database name to its result: ``status`` (``"flushed"``, ``"clean"``,
+            ``"failed"``, ``"timeout"`` if it was still running at the deadline, or ``"not_started"``),
+            the number of ``changes`` that were pending, the flush ``duration`` in seconds, and the ``error``, if any
+        :rtype: dict
+        """
+        databases = sorted(self.active_databases(), key=self._flush_priority, reverse=True)
+        report = {}
+        futures = {}
+
+        executor = ThreadPoolExecutor(max_workers=workers or self.flush_workers, thread_name_prefix="storify-flush-all")
+
+        try:
+            for db in databases:
+                result = report[self._report_name(db)] = {
+                    "status": "clean",
+                    "changes": db.pending_changes,
+                    "duration": None,
+                    "error": None
+                }
+
+                if db.dirty:
+                    futures[executor.submit(self._timed_flush, db)] = result
+
+            done, not_done = wait(futures, timeout=deadline)
+
+            for future in not_done:
+                futures[future]["status"] = "not_started" if future.cancel() else "timeout"
+
+            for future in done:
+                result = futures[future]
+
+                if future.exception() is not None:
+                    result["status"] = "failed"
+                    result["error"] = repr(future.exception())
+                else:
+                    written, result["duration"] = future.result()
+                    result["status"] = "flushed" if written else "failed"
+        finally:
+            executor.shutdown(wait=False)
+
+        for name, result in report.items():
+            if result["status"] not in ("flushed", "clean"):
+                self.log.warning(f"Flush of db `{name}` {result['status'].replace('_', ' ')}")
+
+        return report
+
+    def _timed_flush(self, db):
+        started = time.perf_counter()
+        written = db.flush()
+
+        return written, time.perf_counter() - started
+
+    def _flush_priority(self, db):
+        try:
+            size = os.path.getsize(db.path)
+        except OSError:
+            size = 0
+
+        return db.pending_changes, size
+
+    def _report_name(self, db):
+        return db.name if db.name is not None else db.path
+
+    def stats(self):
+        """Get flush and memory statistics for all open databases.
+
+        :return: Mapping of database name to its statistics. Durations are in seconds, and
+            ``memory`` is the estimate of :meth:`Database.memory_usage` in bytes.
+        :rtype: dict
         """
-        self.tick(force=True)
+        stats = {}
+
+        for db in self.active_databases():
+            stats[db.name] = {
+                "dirty": db.dirty,
+                "last_flush": db.last_flush,
+                "flush_count": db.flush_count,
+                "skipped_flushes": db.skipped_flushes,
+                "last_flush_duration": db.last_flush_duration,
+                "max_flush_duration": db.max_flush_duration,
+                "avg_flush_duration": db.total_flush_duration / db.flush_count if db.flush_count else None,
+                "unloaded": db.unloaded,
+                "memory": db.memory_usage(),
+            }
+
+        return stats
 
     def __getitem__(self, name):
         """Get a database by name.
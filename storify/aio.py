@@ -0,0 +1,297 @@
+import time
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import Storify
+from .exceptions import DatabaseNotLoadedError
+
+class AsyncDatabase:
+    def __init__(self, db, storify):
+        """Initialize the AsyncDatabase instance.
+
+        Wraps a Database for use from asyncio code. Loading, flushing and closing run
+        on the AsyncStorify's executor, so they don't block the event loop. Flushes of
+        the same database wait for each other; flushes of different databases run in
+        parallel.
+
+        Reading and writing values works the same as on a Database, as long as they're in
+        memory; reading from disk would block the event loop, so it raises
+        DatabaseNotLoadedError instead. Use :meth:`get` for values that haven't been decoded
+        yet (with ``lazy=True``), and :meth:`ensure_loaded` for databases that were unloaded
+        to stay within ``max_memory`` or have shards that haven't been read. Attributes that
+        aren't wrapped are passed through to the Database.
+
+        :param db: The database to wrap
+        :type db: Database
+        :param storify: The AsyncStorify instance the database belongs to
+        :type storify: AsyncStorify
+        """
+        self.db = db
+        self.storify = storify
+
+        self._flush_lock = asyncio.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    async def _run(self, func, *args):
+        return await self.storify._run(func, *args)
+
+    async def flush(self, force=False):
+        """Flush the database to disk on the executor.
+
+        :param force: Write the database even if it hasn't changed
+        :type force: bool
+        :default force: False
+        """
+        async with self._flush_lock:
+            await self._run(self.db.flush, force)
+
+    async def refresh(self):
+        """Reload the database on the executor if another process has written to it
+        (with ``access="reader"``), see :meth:`Database.refresh`.
+
+        :return: Whether the database was reloaded
+        :rtype: bool
+        """
+        return await self._run(self.db.refresh)
+
+    async def ensure_loaded(self):
+        """Read the database back from disk on the executor if it was unloaded, and read
+        any shards that haven't been read yet. Lazily loaded values are still decoded on
+        first access, with :meth:`get`.
+        """
+        await self._run(self._ensure_loaded)
+
+    def _ensure_loaded(self):
+        # Counting the keys reloads the database and reads every shard
+        len(self.db)
+
+    def _check_loaded(self, key=None, decoded=True):
+        if not self.db._in_memory(key, decoded):
+            what = "db" if key is None else f"key {key!r} of db"
+
+            raise DatabaseNotLoadedError(
+                f"The {what} `{self.db.name}` isn't in memory, and reading it would block the event loop. "
+                f"Use `await db.get(key)` or `await db.ensure_loaded()` first."
+            )
+
+    async def get(self, key, default=None):
+        """Get a value, decoding it on the executor if it hasn't been read yet (with ``lazy=True``).
+
+        :param key: The top-level key
+        :param default: Value to return if the key doesn't exist
+        :return: The value
+        """
+        return await self._run(functools.partial(self._get, key, default))
+
+    def _get(self, key, default):
+        if key not in self.db:
+            return default
+
+        return self.db[key]
+
+    async def close(self):
+        """Flush and close the database."""
+        async with self._flush_lock:
+            await self._run(self.db.close)
+
+    async def destroy(self):
+        """Close the database and delete its file. Backups are preserved."""
+        async with self._flush_lock:
+            await self._run(self.db.destroy)
+
+    def __getitem__(self, key):
+        self._check_loaded(key)
+        return self.db[key]
+
+    def __setitem__(self, key, value):
+        self._check_loaded(key, decoded=False)
+        self.db[key] = value
+
+    def __delitem__(self, key):
+        self._check_loaded(key, decoded=False)
+        del self.db[key]
+
+    def __contains__(self, key):
+        self._check_loaded(key, decoded=False)
+        return key in self.db
+
+    def __iter__(self):
+        self._check_loaded()
+        return iter(self.db)
+
+    def __len__(self):
+        self._check_loaded()
+        return len(self.db)
+
+class AsyncStorify:
+    def __init__(self, *args, executor=None, **kwargs):
+        """Initialize the AsyncStorify instance.
+
+        An asyncio interface to Storify. Takes the same arguments as :class:`Storify`,
+        except that autosave runs as a task on the event loop rather than on a thread.
+
+        :param executor: Executor to load and flush databases on, defaults to a thread pool owned by this instance
+        :type executor: concurrent.futures.Executor
+        :default executor: None
+        """
+        self.autosave = kwargs.pop("autosave", False)
+        self.storify = Storify(*args, **kwargs)
+
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(thread_name_prefix="storify-aio")
+
+        # Wrappers of open databases, by Database. Closed databases remove themselves.
+        self.databases = {}
+        self._autosave_task = None
+
+    def __getattr__(self, name):
+        return getattr(self.storify, name)
+
+    async def __aenter__(self):
+        if self.autosave:
+            self.start_autosave()
+
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _wrap(self, db):
+        # Each database gets one wrapper, so its flushes share one lock
+        if db not in self.databases:
+            self.databases[db] = AsyncDatabase(db, self)
+            db.close_callbacks.append(self._forget)
+
+        return self.databases[db]
+
+    def _forget(self, db):
+        self.databases.pop(db, None)
+
+    async def get_db(self, name, root={}, **options):
+        """Get or create a database, loading it on the executor.
+
+        :param name: Name of the database
+        :type name: str
+        :param root: Initial root data structure for new database
+        :type root: dict
+        :default root: {}
+        :param options: Keyword arguments for the Database, overriding ``db_options``
+        :return: The database
+        :rtype: AsyncDatabase
+        """
+        db = await self._run(functools.partial(self.storify.get_db, name, root, **options))
+
+        return self._wrap(db)
+
+    async def get_db_by_path(self, path):
+        """Get a database by its path, unmanaged by the root Storify path, loading it on the executor.
+
+        :param path: Path to the database file
+        :type path: str
+        :return: The database
+        :rtype: AsyncDatabase
+        """
+        return self._wrap(await self._run(self.storify.get_db_by_path, path))
+
+    def active_databases(self):
+        """Get all databases that are currently open.
+
+        :return: List of open AsyncDatabase instances
+        :rtype: list
+        """
+        return [db for db in list(self.databases.values()) if not db.defunct]
+
+    async def tick(self, force=False):
+        """Flush all databases that are due, in parallel, like :meth:`Storify.tick`.
+
+        Databases opened with ``access="reader"`` are reloaded if another process has
+        changed them, and databases are unloaded to stay within ``max_memory``. All of
+        it runs on the executor.
+
+        :param force: Flush every database regardless of last flush time
+        :type force: bool
+        :default force: False
+        """
+        ticks = []
+
+        for db in self.active_databases():
+            save_interval = db.save_interval if db.save_interval is not None else self.storify.save_interval
+            ticks.append(self._tick(db, force or time.time() - db.last_flush > save_interval))
+
+        # Databases are flushed independently; one failing doesn't stop the others
+        for result in await asyncio.gather(*ticks, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.storify.log.error(f"Flush failed: {result!r}")
+
+        # Data grows between calls to get_db(), so the memory budget is checked here too
+        await self._run(self.storify._enforce_memory)
+
+    async def _tick(self, db, flush):
+        if flush:
+            await db.flush()
+
+        await db.refresh()
+
+    async def flush(self):
+        """Flush all open databases to disk, in parallel."""
+        await self.tick(force=True)
+
+    def start_autosave(self, resolution=1.0):
+        """Start flushing databases from a task on the running event loop.
+
+        Each database is flushed once per its own save_interval, falling back to the
+        Storify save_interval. Call :meth:`close` or :meth:`stop_autosave` to stop it.
+
+        :param resolution: Time in seconds between checks for databases that are due
+        :type resolution: float
+        :default resolution: 1.0
+        """
+        if self._autosave_task is None or self._autosave_task.done():
+            self._autosave_task = asyncio.get_running_loop().create_task(self._autosave(resolution))
+
+    async def stop_autosave(self):
+        """Stop the autosave task. A flush in progress still finishes, and close() waits for it."""
+        task = self._autosave_task
+        self._autosave_task = None
+
+        if task is None:
+            return
+
+        task.cancel()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _autosave(self, resolution):
+        while True:
+            try:
+                # Shielded, so stopping autosave lets a flush in progress finish
+                await asyncio.shield(self.tick())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.storify.log.traceback("Autosave failed")
+
+            await asyncio.sleep(resolution)
+
+    async def close(self):
+        """Stop autosave and close all open databases, flushing any changes to disk."""
+        await self.stop_autosave()
+
+        results = await asyncio.gather(*[db.close() for db in self.active_databases()], return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                self.storify.log.error(f"Failed to close db: {result!r}")
+
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
@@ -2,13 +2,52 @@ import msgpack
 import os
 import time
 import shutil
+import contextlib
+import functools
+import itertools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from ..exceptions import *
 from .backups import Backups
-from ..model import Model
+from .journal import Journal, Changes
+from .snapshot import Snapshot
+from .shards import Shards
+from .lazy import LazyValue, map_file, index_map, iter_container
+from .memory import estimate_size, DEFAULT_SAMPLE
+from .indexes import Indexes, INDEX_TYPES, INDEX_HASH
+from .query import Query
+from .transaction import Transaction
+from .codecs import get_codec, CODEC_NONE
+from .storage import atomic_write, check_durability, DURABILITY_NONE
+from .forked import ForkedWrite, can_fork, SERIALIZERS, SERIALIZER_THREAD, SERIALIZER_FORK
+from .locking import FileLock, file_signature, can_lock, ACCESS_MODES, ACCESS_PRIVATE, ACCESS_WRITER, ACCESS_READER
+from .fileformat import (pack_header, read_header, read_file_header, ModelSchema, EXT_MODEL,
+                         MODEL_ENCODINGS, MODEL_ENCODING_DICT, MODEL_ENCODING_EXT)
+from ..model import Model, ModelRegistry
+from ..tracking import Trackable, TrackedDict, TrackedList, Binding, adopt, track
+
+# Shared by all databases for flush_async()
+_flush_executor = None
+
+def _get_flush_executor():
+    global _flush_executor
+
+    if _flush_executor is None:
+        _flush_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="storify-flush")
+
+    return _flush_executor
+
+# Orders accesses to all databases, for Storify's max_open and max_memory
+_uses = itertools.count()
 
 class Database:
-    def __init__(self, name=None, path=None, root=None, log=None, rootdata={}, models=[]):
+    def __init__(self, name=None, path=None, root=None, log=None, rootdata={}, models=[],
+                 journal=False, journal_max_size=16 * 1024 * 1024, save_interval=None,
+                 durability=DURABILITY_NONE, model_encoding=MODEL_ENCODING_DICT, shards=None,
+                 lazy=False, backup_options=None, compression=CODEC_NONE, serializer=SERIALIZER_THREAD,
+                 indexes=None, access=ACCESS_PRIVATE):
         if name is None and path is None and root is None:
             raise ValueError("At least 'path', or 'name' and 'root' must be provided.")
         
@@ -18,15 +57,143 @@ class Database:
         self.data = rootdata
         self.backups = None
         self.log = log
-        self.models = models
+
+        # A registry passed in is shared, so models registered with Storify later are known here too
+        self.models = models if isinstance(models, ModelRegistry) else ModelRegistry(models)
+
+        # How hard flushes try to get data onto the disk: "none", "flush" or "fsync"
+        check_durability(durability)
+        self.durability = durability
+
+        # How models are written: "dict" (readable by any version) or "ext" (compact, with a schema in the file header)
+        if model_encoding not in MODEL_ENCODINGS:
+            raise ValueError("Unknown model encoding %r, expected one of %s" % (model_encoding, ", ".join(MODEL_ENCODINGS)))
+
+        self.model_encoding = model_encoding
+
+        # How files are compressed: "none", "zlib", "lzma", "zstd" or "lz4". Files are read whatever they were written with.
+        self.codec = get_codec(compression)
+        self.compression = self.codec.name
+
+        # Where snapshots are serialized: "thread" (in this process) or "fork" (in a child process, POSIX only)
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown serializer %r, expected one of %s" % (serializer, ", ".join(SERIALIZERS)))
+
+        if serializer == SERIALIZER_FORK and not can_fork():
+            self.log.warning(f"Can't fork on this platform; db `{name}` will be serialized on a thread")
+            serializer = SERIALIZER_THREAD
+
+        self.serializer = serializer
+
+        # Memory-map the file and decode top-level values on first access, instead of all at once
+        self.lazy = lazy
+        self._file_schemas = {}
 
         self.last_flush = time.time()
         self.destroyed = False
         self.defunct = False
 
-        self.backups = Backups(self)
+        # Set while the data has been freed by unload(); it's read from disk again on next access
+        self.unloaded = False
+
+        # When the database was last accessed, relative to the others
+        self.last_used = next(_uses)
+
+        # Generation and result of the last memory_usage() estimate
+        self._memory_usage = None
+
+        # Called with the database once it has been closed, e.g. to remove it from a registry of open databases
+        self.close_callbacks = []
+
+        # Overrides Storify's save_interval for this database when set
+        self.save_interval = save_interval
+
+        # Flush latency, in seconds
+        self.flush_count = 0
+        self.last_flush_duration = None
+        self.max_flush_duration = 0.0
+        self.total_flush_duration = 0.0
+
+        # Serializes flushes from the autosave thread and the caller
+        self._flush_lock = threading.RLock()
+
+        # Guards changes to the data against snapshots taken by a flush
+        self._lock = threading.RLock()
+        self._snapshot = None
+
+        # The innermost open transaction, which holds the lock
+        self._transaction = None
+
+        # Bumped on every change; compared against the generation of the last flush
+        self.generation = 0
+        self.skipped_flushes = 0
+        self._flushed_generation = 0
+        self._dirty_keys = set()
+
+        # Keyword arguments for Backups, such as max_backups and max_age
+        self.backups = Backups(self, **(backup_options or {}))
+
+        # Changes are appended to the journal between full snapshots when journaling is enabled.
+        # An existing journal is always replayed on load, even with journaling disabled.
+        self.journaled = journal
+        self.journal = Journal(self, max_size=journal_max_size)
 
-        self.load()
+        # Changes to tracked values are recorded as they're made, so the journal holds only what changed
+        self._changes = Changes(self) if journal else None
+
+        # Top-level keys are spread over several files when sharded, which are loaded on first access
+        self.shards = None
+
+        if shards is not None:
+            if journal:
+                raise ValueError("Journal mode can't be used with a sharded database")
+
+            self.shards = Shards(self, shards)
+
+        # Whether other processes use the files too: "private" (no), "writer" (this process
+        # is the only one writing them) or "reader" (this process only reads them)
+        if access not in ACCESS_MODES:
+            raise ValueError("Unknown access mode %r, expected one of %s" % (access, ", ".join(ACCESS_MODES)))
+
+        if access != ACCESS_PRIVATE and shards is not None:
+            raise ValueError("Access mode %r can't be used with a sharded database" % access)
+
+        self.access = access
+
+        # Loads hold this lock shared and writes hold it alone, so other processes never read a half-written state
+        self._file_lock = None
+        self._writer_fd = None
+
+        if access != ACCESS_PRIVATE:
+            if can_lock():
+                self._file_lock = FileLock(self.path + ".lock")
+            else:
+                self.log.warning(f"File locking isn't available on this platform; db `{name}` isn't protected from other processes")
+
+        if access == ACCESS_WRITER:
+            # Identifies this writer in the stamp of the files it writes
+            self._stamp_token = os.urandom(8).hex()
+
+            if self._file_lock is not None:
+                self._writer_fd = FileLock(self.path + ".writer").claim()
+
+        # What the files looked like when a reader last loaded them, to tell when they change
+        self._signature = None
+        self._stamp = None
+
+        # Indexes over top-level collections of models, by key. Kept in memory and rebuilt after loading.
+        # The indexes option declares them up front, as {key: {field: "hash" or "sorted"}}.
+        self.indexes = {}
+
+        for key, fields in (indexes or {}).items():
+            for field, kind in fields.items():
+                self.create_index(key, field, kind)
+
+        try:
+            self.load()
+        except:
+            self._release_writer()
+            raise
 
     @property
     def path(self):
@@ -35,6 +202,91 @@ class Database:
 
         return os.path.join(self.root, "%s.mpack" % self.name)
 
+    @property
+    def pending_changes(self):
+        """Get the number of changes made since the database was last flushed.
+
+        :rtype: int
+        """
+        return self.generation - self._flushed_generation
+
+    @property
+    def dirty(self):
+        """Whether the database has changed since it was last flushed.
+
+        :return: True if there are changes that have not been written to disk
+        :rtype: bool
+        """
+        return self.generation != self._flushed_generation
+
+    def mark_dirty(self):
+        """Mark the database as changed.
+
+        Changes made through the database, and through the dicts, lists and models
+        returned by it, are tracked automatically. Call this after modifying data
+        in a way that can't be tracked, such as through ``db.data`` directly.
+        """
+        self._check_writable()
+
+        self._access()
+
+        self._touch()
+        self._invalidate_indexes()
+
+    def _touch(self, key=None, replace=False, recorded=False):
+        # A key of None means the whole database changed. Unless the change is recorded
+        # for the journal by the tracked value making it, the key is journaled whole.
+        with self._lock:
+            # Keep the old value for a flush in progress, unless it's being replaced outright
+            if self._snapshot is not None and key is not None and not replace:
+                self._snapshot.preserve(key)
+
+            # Keep the value from before the transaction, in case it's rolled back
+            if self._transaction is not None and self._transaction.thread == threading.get_ident():
+                self._transaction.record(key, replace)
+
+            self.generation += 1
+            self._dirty_keys.add(key)
+
+            if self._changes is not None and not recorded:
+                self._changes.whole.add(key)
+
+    def _begin_change(self, key):
+        # Called by tracked values before they change; the lock is held until _end_change
+        self._check_writable()
+
+        if self.defunct:
+            raise DatabaseClosedError(f"db `{self.name}` is closed")
+
+        self.last_used = next(_uses)
+        self._lock.acquire()
+
+        try:
+            self._touch(key, recorded=True)
+        except:
+            self._lock.release()
+            raise
+
+    def _end_change(self, key):
+        self._lock.release()
+
+    def _bind(self, key, value):
+        # Connect a top-level value to this database, so changes to it are tracked
+        if isinstance(value, Trackable):
+            if type(value._storify_parent) is not Binding:
+                object.__setattr__(value, "_storify_parent", Binding(self, key))
+                value._storify_adopt()
+        elif type(value) in (dict, list):
+            with self._lock:
+                value = self.data[key] = track(value, Binding(self, key))
+
+        return value
+
+    def _release(self, value):
+        # A value removed from the top level no longer reports changes to this database
+        if isinstance(value, Trackable):
+            object.__setattr__(value, "_storify_parent", None)
+
     def load(self, path=None):
         """
         Load the database from a file.
@@ -46,127 +298,979 @@ class Database:
         Typically, you don't need to call this yourself. This method attempts to load the database from the specified file. 
         If the main file is corrupted, it tries to load from available backups. If all attempts fail, it raises a DatabaseLoadError.
         """
+        if self.shards is not None:
+            self.shards.open(self.data)
+            self._flushed_generation = self.generation
+
+            if self.shards.loaded:
+                # A new database; the first flush must write every shard
+                self._touch()
+
+            return
+
         if not path:
             path = self.path
 
-        if os.path.exists(path):
+        with self._file_locked():
+            # Taken first; the files can't change while the lock is held
+            signature = self._file_signature(path)
 
-            try:
-                self.data = self.unpack(path)
-            except:
-                self.log.traceback("Database '%s' corrupted, reading from backup" % self.name)
+            self._load(path)
 
-                # Read from backups
-                for backup_id in self.backups.list:
-                    backup_path = self.backups.get_path_of_backup(backup_id)
+            if self.access == ACCESS_READER:
+                self._signature = signature
+                self._stamp = self._read_stamp(path)
 
-                    try:
-                        self.log.warning("Reading from backup '%s'" % backup_id)
-                        self.data = self.unpack(backup_path)
+                # Readers never write, so whatever loading found to save is left to the writer
+                self._flushed_generation = self.generation
+                self._dirty_keys.clear()
 
-                        self.log.warning("Successfully loaded backup '%s'" % backup_id)
-                        return
-                    except:
-                        self.log.error("Failed to read backup")
-                        continue
+                if self._changes is not None:
+                    self._changes.clear()
 
+    def _load(self, path):
+        if not os.path.exists(path):
+            # Nothing on disk yet, so the first flush must write the file
+            self._touch()
+            self._replay_journal(path, self.data)
+            return
+
+        try:
+            data = self.unpack(path)
+            self._flushed_generation = self.generation
+            self._dirty_keys.clear()
+
+            if self._changes is not None:
+                self._changes.clear()
+        except:
+            self.log.traceback("Database '%s' corrupted, reading from backup" % self.name)
+
+            # Read from backups, including any that were still being stored in the background
+            self.backups.process_pending()
+
+            for backup_id in self.backups.list:
+                try:
+                    self.log.warning("Reading from backup '%s'" % backup_id)
+
+                    with self.backups.open(backup_id) as backup_path:
+                        data = self.unpack(backup_path)
+
+                    # The main file is still corrupted, so it needs to be rewritten
+                    self._touch()
+
+                    self.log.warning("Successfully loaded backup '%s'" % backup_id)
+                    break
+                except:
+                    self.log.error("Failed to read backup")
+                    continue
+
+            else:
                 self.log.error("Failed to load database, throwing DatabaseLoadError")
                 raise DatabaseLoadError("Could not load db:%s" % self.name)
-          
+
+        # Replayed before the data is swapped in, so readers on other threads never see it half-replayed
+        self._replay_journal(path, data)
+        self.data = data
+
+    def unload(self):
+        """Flush the database and free the memory held by its data.
+
+        The data is read from disk again the next time it's accessed through the database.
+        ``db.data`` is None until then. Values read from the database before it was unloaded
+        are no longer tracked, so changes made to them afterwards are lost.
+
+        :return: Whether the database was unloaded. It stays loaded if it couldn't be flushed,
+            or changed while it was being flushed.
+        :rtype: bool
+        """
+        with self._flush_lock:
+            if self.destroyed or self.defunct:
+                return False
+
+            if self.unloaded:
+                return True
+
+            if not self.flush():
+                return False
+
+            with self._lock:
+                if self.dirty:
+                    return False
+
+                for value in (self.data.values() if isinstance(self.data, dict) else self.data):
+                    self._release(value)
+
+                self.data = None
+                self.unloaded = True
+                self._invalidate_indexes()
+                self._memory_usage = None
+                self._file_schemas = {}
+
+                if self.shards is not None:
+                    self.shards = Shards(self, self.shards.count)
+
+        self.log.debug(f"Unloaded db `{self.name}`")
+        return True
+
+    def _access(self):
+        # Called on every access, so databases that are in use aren't the ones closed or unloaded
+        self.last_used = next(_uses)
+
+        if self.unloaded or self.defunct:
+            self._reload()
+
+    def _in_memory(self, key=None, decoded=True):
+        # Whether key, or every key if None, can be used without reading from disk.
+        # With decoded=False, only the key has to be known, not its value.
+        if self.unloaded:
+            return False
+
+        if self.shards is not None:
+            if key is None:
+                return len(self.shards.loaded) == self.shards.count
+
+            if type(key) in (str, bytes) and self.shards.index_of(key) not in self.shards.loaded:
+                return False
+
+        if key is None or not decoded or not isinstance(self.data, dict):
+            return True
+
+        return type(self.data.get(key)) is not LazyValue
+
+    def _reload(self):
+        # Read an unloaded database back from disk
+        with self._lock:
+            if self.defunct:
+                raise DatabaseClosedError(f"db `{self.name}` is closed")
+
+            if not self.unloaded:
+                return
+
+            self.log.debug(f"Reloading db `{self.name}`")
+
+            self.load()
+            self.unloaded = False
+
+            self._invalidate_indexes()
+
+    def refresh(self):
+        """Reload the database if another process has written to it since it was loaded.
+
+        Only does anything with ``access="reader"``. Checking is cheap: the file and its journal
+        are only stat'ed, and when they changed, the stamp in the file's header tells whether
+        the data did too. Storify calls this for open databases on every tick.
+
+        Values read from the database before it was reloaded keep the old data.
+
+        :return: Whether the database was reloaded
+        :rtype: bool
+        """
+        if self.access != ACCESS_READER:
+            return False
+
+        with self._flush_lock:
+            if self.destroyed or self.defunct or self.unloaded:
+                return False
+
+            signature = self._file_signature(self.path)
+
+            if signature == self._signature:
+                return False
+
+            # A file rewritten without new changes, such as by a forced flush, keeps its stamp
+            if self._stamp is not None and signature[1] == self._signature[1] \
+                    and self._read_stamp(self.path) == self._stamp:
+                self._signature = signature
+                return False
+
+            with self._lock:
+                old = self.data
+
+                self.load()
+
+                for value in (old.values() if isinstance(old, dict) else old):
+                    self._release(value)
+
+                self._invalidate_indexes()
+                self._memory_usage = None
+
+        self.log.debug(f"Reloaded db `{self.name}`, which another process changed")
+        return True
+
+    def _file_locked(self, exclusive=False):
+        # Hold the lock on the files against other processes sharing them
+        if self._file_lock is None:
+            return contextlib.nullcontext()
+
+        return self._file_lock.exclusive() if exclusive else self._file_lock.shared()
+
+    def _file_signature(self, path):
+        # Changes whenever the file is replaced or the journal is appended to
+        return file_signature(path), file_signature(self.journal.path)
+
+    def _read_stamp(self, path):
+        # The writer and generation a file was written by, if it was written by a writer
+        try:
+            header = read_file_header(path)
+        except (OSError, ValueError):
+            return None
+
+        return header.get("stamp") if header is not None else None
+
+    def _check_writable(self):
+        if self.access == ACCESS_READER:
+            raise DatabaseReadOnlyError(f"db `{self.name}` was opened with access=\"reader\" and can't be changed")
+
+    def _release_writer(self):
+        # Let another process become the writer
+        if self._writer_fd is not None:
+            os.close(self._writer_fd)
+            self._writer_fd = None
+
+    def transaction(self):
+        """Group changes so they're saved together, and undone together if anything fails.
+
+        Use as ``with db.transaction(): ...``. Other threads' writes and flushes wait until
+        the block is over, so no flush writes it half-applied: the next one writes all of it,
+        as a single journal record when journaling. Reads through the database from other
+        threads wait too. If the block raises, every top-level key it changed is put back the
+        way it was, and the exception propagates. Values read during a rolled back block are
+        no longer tracked, so read them again afterwards. Changes made to ``db.data`` directly
+        aren't undone.
+
+        Flushing from inside the block is deferred until it's over. Transactions can be nested.
+
+        :return: The transaction, a context manager
+        :rtype: Transaction
+        """
+        self._check_writable()
+
+        self._access()
+
+        return Transaction(self)
+
+    def update_many(self, values):
+        """Store several values in one transaction.
+
+        Cheaper than storing them one at a time, since the bookkeeping for each change is
+        done once for the whole batch, and a flush can't save some of them without the
+        others. If storing one fails, none are stored.
+
+        :param values: Top-level keys and their values
+        :type values: dict or iterable of (key, value) pairs
+        :raises ValueError: If a key isn't str or bytes
+        """
+        if hasattr(values, "items"):
+            values = values.items()
+
+        with self.transaction() as transaction:
+            data = self.data
+            keys = set()
+
+            for key, value in values:
+                if not (type(key) in (str, bytes)):
+                    raise ValueError("Expected str or bytes, got %s" % type(key))
+
+                if self.shards is not None:
+                    self.shards.keys[self.shards.load_key(key)].add(key)
+
+                transaction.record(key, replace=True)
+
+                if key in data:
+                    self._release(data[key])
+
+                data[key] = track(value, Binding(self, key))
+                keys.add(key)
+
+            # Values are replaced outright, so a flush in progress doesn't need the old ones
+            self.generation += len(keys)
+            self._dirty_keys |= keys
+
+            if self._changes is not None:
+                self._changes.whole |= keys
+
+            for key in keys.intersection(self.indexes):
+                self._invalidate_indexes(key)
+
+    def _wait_for_transaction(self):
+        # Readers on other threads wait for an open transaction, so they don't see it half-applied
+        transaction = self._transaction
+
+        if transaction is not None and transaction.thread != threading.get_ident():
+            with self._lock:
+                pass
+
+    def create_index(self, key, field, kind=INDEX_HASH):
+        """Index the models and dicts in a top-level collection by one of their fields.
+
+        The collection is the list or dict of rows stored under ``key``. The index is built
+        the first time it's used, and kept up to date as rows are added to or removed from
+        the collection, and as the indexed field is assigned or removed. Changes made inside the field's
+        value, like appending to a list, aren't seen. Indexes aren't saved; create them
+        again after opening the database.
+
+        :param key: Top-level key of the collection
+        :type key: str
+        :param field: Name of the field to index
+        :type field: str
+        :param kind: ``"hash"`` for equality lookups, or ``"sorted"`` for equality and range lookups
+        :type kind: str
+        :default kind: "hash"
+        :return: The index, or the existing one if the field is already indexed the same way
+        :rtype: Index
+        :raises ValueError: If the index type is unknown
+        """
+        if kind not in INDEX_TYPES:
+            raise ValueError("Unknown index type %r, expected one of %s" % (kind, ", ".join(INDEX_TYPES)))
+
+        with self._lock:
+            indexes = self.indexes.get(key)
+
+            if indexes is None:
+                indexes = self.indexes[key] = Indexes(self, key)
+
+            index = indexes.get(field)
+
+            if type(index) is INDEX_TYPES[kind]:
+                return index
+
+            return indexes.add(field, kind)
+
+    def drop_index(self, key, field):
+        """Remove the index on a field of a top-level collection, if there is one.
+
+        :param key: Top-level key of the collection
+        :type key: str
+        :param field: Name of the indexed field
+        :type field: str
+        """
+        with self._lock:
+            indexes = self.indexes.get(key)
+
+            if indexes is None:
+                return
+
+            indexes.fields.pop(field, None)
+
+            if not indexes.fields:
+                del self.indexes[key]
+
+    def query(self, key=None):
+        """Start a query over a collection, or over the top-level values of the database.
+
+        ``db.query("books").where(year__gt=1950).only("title").limit(100)``
+
+        :param key: Top-level key of a list or dict of models or dicts, or None for the whole database
+        :type key: str
+        :return: A query, run by iterating over it
+        :rtype: Query
+        """
+        return Query(self, key)
+
+    def _iter_collection(self, key):
+        # Rows of the collection under key, for a query
+        self._access()
+
+        with self._lock:
+            if self.shards is not None:
+                self.shards.load_key(key)
+
+            value = self.data.get(key) if isinstance(self.data, dict) else None
+
+            if type(value) is LazyValue:
+                rows = None
+            elif isinstance(value, (list, dict)):
+                # A copy, so writers can carry on while the rows are being read
+                value = self._bind(key, value)
+                rows = list(value.values() if isinstance(value, dict) else value)
+            else:
+                return iter(())
+
+        if rows is not None:
+            return iter(rows)
+
+        # Not decoded yet; decode it a row at a time instead of all at once
+        options = self._unpack_options(False, value.schema, value.legacy)
+
+        return (row for i, row in iter_container(value.buffer, value.start, value.end, options))
+
+    def _iter_values(self):
+        # Top-level values of the database, for a query
+        self._access()
+
+        if self.shards is None:
+            with self._lock:
+                items = list(self.data.items()) if isinstance(self.data, dict) else list(enumerate(self.data))
+
+            for key, value in items:
+                yield self._query_value(key, value)
+
+            return
+
+        for index in range(self.shards.count):
+            with self._lock:
+                loaded = index in self.shards.loaded
+
+                if loaded:
+                    items = [(key, self.data[key]) for key in self.shards.keys[index] if key in self.data]
+
+            if loaded:
+                for key, value in items:
+                    yield self._query_value(key, value)
+            elif os.path.exists(self.shards.path(index)):
+                # Shards that haven't been read are streamed, and not kept
+                for key, value in self._iter_file(self.shards.path(index)):
+                    yield value
+
+    def _query_value(self, key, value):
+        # Values that haven't been decoded are decoded for the query, but not kept
+        if type(value) is LazyValue:
+            return self._decode_lazy(value)
+
+        if isinstance(self.data, dict):
+            return self._bind(key, value)
+
+        return value
+
+    def _iter_file(self, path):
+        # Decode the top-level entries of a file one at a time
+        buffer = map_file(path)
+
+        if buffer is None:
+            return
+
+        header, offset = read_header(buffer)
+        schema = None
+
+        if header is not None:
+            schema = ModelSchema(self.models, header.get("schema", ()))
+
+            if header.get("codec", CODEC_NONE) != CODEC_NONE:
+                buffer = get_codec(header["codec"]).decompress(memoryview(buffer)[offset:])
+                offset = 0
+
+        yield from iter_container(buffer, offset, len(buffer), self._unpack_options(False, schema, header is None))
+
+    def _invalidate_indexes(self, key=None):
+        # Rebuild the indexes of one collection, or of all of them, on next use
+        for indexes in (self.indexes.values() if key is None else [self.indexes.get(key)]):
+            if indexes is not None:
+                indexes.invalidate()
+
+    def memory_usage(self, sample=DEFAULT_SAMPLE):
+        """Estimate the memory held by the database's data, in bytes.
+
+        Large containers are sized from a sample of their items, see :func:`estimate_size`.
+        The estimate is kept until the database changes.
+
+        :param sample: Maximum number of items of each container to measure
+        :type sample: int
+        :default sample: 64
+        :return: Estimated size in bytes, 0 if the database is unloaded or closed
+        :rtype: int
+        """
+        with self._lock:
+            if self.data is None:
+                return 0
+
+            if self._memory_usage is not None and self._memory_usage[0] == (self.generation, sample):
+                return self._memory_usage[1]
+
+            size = estimate_size(self.data, sample)
+            self._memory_usage = ((self.generation, sample), size)
+
+        return size
+
+    def _replay_journal(self, path, data):
+        if path != self.path or not os.path.exists(self.journal.path):
+            return
+
+        # Journal records are decoded like the file they follow
+        records = self.journal.replay(data, legacy=os.path.exists(path) and read_file_header(path) is None)
+        self.log.debug(f"Replayed {records} journal record(s) for db `{self.name}`")
+
+        if not self.journaled:
+            # Fold the journal into a snapshot on the next flush
+            self._touch()
+
     def encode_type(self, data):
-        if isinstance(data, dict):
-            return {walk(key): walk(value) for key, value in data.items()}
-        elif isinstance(data, list):
-            return [walk(item) for item in data]
-        elif isinstance(data, (str, int, float, bool, type(None))):
-            return data
-        elif isinstance(data, Model):
-            return {data._keyname(): data._to_dict()}  # Serialize Model instances
-        elif isinstance(data, type) and issubclass(data, Model):
-            return {data._keyname(): data._to_dict()}  # Serialize subclassed Model instances
+        # Called by msgpack for objects it can't serialize natively
+        if isinstance(data, Model):
+            return {self.models.keyname(type(data)): data._to_dict()}  # Serialize Model instances
         
         return data
     
     def decode_type(self, data):
         if isinstance(data, dict):
-            model_class = next((cls for cls in self.models if cls._keyname() in data), None)
+            model_class = self.models.lookup(data)
 
             if model_class is None:
                 return data
 
-            try:
-                return model_class()._from_dict(data[model_class._keyname()])
-            except Exception as e:
-                self.log.traceback(f"Failed to decode model: {data} with error: {str(e)}")
-                return data
+            return self._decode_model(model_class, data[self.models.keyname(model_class)], data)
         
         return data
-    
+
+    def _decode_model(self, model_class, payload, data=None):
+        try:
+            model = model_class()._from_dict(payload)
+        except Exception as e:
+            if data is None:
+                # Models that can't be decoded are kept as the dict they were stored as
+                data = TrackedDict({self.models.keyname(model_class): payload})
+                adopt(data, (payload,))
+
+            self.log.traceback(f"Failed to decode model: {data} with error: {str(e)}")
+            return data
+
+        # Nested values were decoded as children of the payload dict; hand them to the model
+        plain = False
+
+        for value in model._storify_children():
+            if isinstance(value, Trackable):
+                object.__setattr__(value, "_storify_parent", model)
+            elif type(value) in (dict, list):
+                plain = True
+
+        # A custom _from_dict may have built its own containers, which need to be tracked too
+        if plain:
+            model._storify_adopt()
+
+        return model
+
+    def _decode_map(self, decode_bytes, pairs):
+        # Called by msgpack for every map, children first. Fixes bytes > str in the same pass.
+        if len(pairs) == 1:
+            # Encoded models are looked up before anything is built for their {keyname: payload} wrapper
+            keyname, payload = pairs[0]
+            model_class = self.models.get(keyname)
+
+            if model_class is not None and not (decode_bytes and type(payload) is bytes):
+                return self._decode_model(model_class, payload)
+
+        data = TrackedDict(pairs)
+
+        # Duplicate or bytes keys, which only legacy files have, are merged one by one
+        if len(data) != len(pairs):
+            return self._merge_map(decode_bytes, pairs)
+
+        for key, value in dict.items(data):
+            if type(key) is bytes:
+                return self._merge_map(decode_bytes, pairs)
+
+            if isinstance(value, Trackable):
+                object.__setattr__(value, "_storify_parent", data)
+            elif decode_bytes and type(value) is bytes:
+                try:
+                    dict.__setitem__(data, key, value.decode("utf8"))
+                except:
+                    pass
+
+        return data
+
+    def _merge_map(self, decode_bytes, pairs):
+        data = TrackedDict()
+
+        for key, value in pairs:
+            if isinstance(key, bytes):
+                key = key.decode("utf8")
+
+            if decode_bytes and isinstance(value, bytes):
+                try:
+                    value = value.decode("utf8")
+                except:
+                    pass
+
+            if key in data:
+                if isinstance(value, (str, bytes, list, dict)):
+                    if len(value) < 1:
+                        self.log.warning("Skipping conflicting key %s because it's empty" % key)
+                        continue
+
+            if isinstance(value, Trackable):
+                object.__setattr__(value, "_storify_parent", data)
+
+            dict.__setitem__(data, key, value)
+
+        return self.decode_type(data)
+
+    def _decode_list(self, decode_bytes, items):
+        # Called by msgpack for every array, children first
+        if decode_bytes:
+            for i, item in enumerate(items):
+                if isinstance(item, bytes):
+                    try:
+                        items[i] = item.decode("utf8")
+                    except:
+                        pass
+
+        data = TrackedList(items)
+        adopt(data, items)
+
+        return data
+
+    def _decode_ext(self, options, schema, code, data):
+        # Called by msgpack for every ExtType
+        if code != EXT_MODEL or schema is None:
+            return msgpack.ExtType(code, data)
+
+        values = msgpack.unpackb(data, **options)
+        keyname, fields = schema.layouts[values[0]]
+
+        payload = TrackedDict(zip(fields, values[1:]))
+        encoded = TrackedDict({keyname: payload})
+        payload._storify_parent = encoded
+
+        model_class = self.models.get(keyname)
+
+        if model_class is None:
+            # Unknown models are kept as dicts, in the same shape as the dict encoding
+            adopt(payload, payload.values())
+            return encoded
+
+        return self._decode_model(model_class, payload, encoded)
+
+    def _unpack_options(self, raw=False, schema=None, legacy=False):
+        """Get the keyword arguments for msgpack.unpackb/Unpacker to decode data of this database.
+
+        Values are decoded into tracked containers and registered models in a single pass.
+        With ``raw=True``, for legacy files with non-UTF-8 strings, or ``legacy=True``, bytes
+        are converted to str wherever they can be decoded.
+
+        :param raw: Whether to read msgpack strings as bytes
+        :type raw: bool
+        :param schema: Schema from the file header, for models stored with the ``"ext"`` encoding
+        :type schema: ModelSchema
+        :param legacy: Whether the data comes from a file without a header, which earlier
+            versions read with bytes converted to str
+        :type legacy: bool
+        :rtype: dict
+        """
+        options = {
+            "object_pairs_hook": functools.partial(self._decode_map, raw or legacy),
+            "list_hook": functools.partial(self._decode_list, raw or legacy),
+            "raw": raw
+        }
+
+        # Model payloads are nested msgpack documents, decoded with the same options
+        options["ext_hook"] = functools.partial(self._decode_ext, options, schema)
+
+        return options
+
     def unpack(self, path, raw=False):
+        if self.lazy and not raw:
+            data = self._unpack_lazy(path)
+
+            if data is not None:
+                return data
+
+        with open(path, "rb") as f:
+            buffer = f.read()
+
+        header, offset = read_header(buffer)
+        schema = None
+
+        if header is not None:
+            schema = ModelSchema(self.models, header.get("schema", ()))
+            buffer = memoryview(buffer)[offset:]
+
+            if header.get("codec", CODEC_NONE) != CODEC_NONE:
+                buffer = get_codec(header["codec"]).decompress(buffer)
+
         try:
-            with open(path, "rb") as f:
-                blob = msgpack.unpackb(
-                    f.read(),
-                    object_hook=self.decode_type,
-                    raw=raw
-                )
+            blob = msgpack.unpackb(
+                buffer,
+                **self._unpack_options(raw, schema, legacy=header is None)
+            )
         except UnicodeDecodeError:
+            if raw:
+                raise
+
             self.log.error("Failed to read database due to a UnicodeDecodeError. Attempting to read the database again with raw=True. Please ensure the database file is not corrupted or in an unsupported format.")
             return self.unpack(path, raw=True)
 
-        # Walk the blob, fix bytes > str
-        def walk(b):
-            if isinstance(b, dict):
-                new_dict = {}
+        # The top level is a plain container; its values are bound to the database on access
+        if isinstance(blob, dict):
+            return dict(blob)
 
-                for key in b:
-                    value = walk(b[key])
+        if isinstance(blob, list):
+            return list(blob)
 
-                    if isinstance(key, bytes):
-                        key = key.decode("utf8")
+        if isinstance(blob, bytes):
+            try:
+                return blob.decode("utf8")
+            except:
+                pass
 
-                    if key in new_dict:
-                        if isinstance(value, (str, bytes, list, dict)):
-                            if len(value) < 1:
-                                print("Skipping conflicting key %s because it's empty" % key)
-                                continue
+        return blob
+    
+    def _unpack_lazy(self, path):
+        # Index the top-level keys of a memory-mapped file, leaving the values encoded
+        buffer = map_file(path)
 
-                    new_dict[key] = value
+        if buffer is None:
+            return None
 
-                return new_dict
+        header, offset = read_header(buffer)
+        schema = None
 
-            elif isinstance(b, list):
-                return [walk(item) for item in b]
+        if header is not None:
+            schema = ModelSchema(self.models, header.get("schema", ()))
 
-            elif isinstance(b, bytes):
-                try:
-                    return b.decode("utf8")
-                except:
-                    return b
+            if header.get("codec", CODEC_NONE) != CODEC_NONE:
+                # Compressed values can't be read in place
+                self.log.debug(f"Can't load compressed db `{self.name}` lazily, reading all of it")
+                return None
 
-            else:
-                return b
+        try:
+            data = index_map(buffer, offset, schema, legacy=header is None)
+        except Exception:
+            # Not a map, a legacy file with non-UTF-8 keys, or corrupted; read it the normal way
+            self.log.debug(f"Can't load db `{self.name}` lazily, reading all of it")
+            return None
 
-        return walk(blob)
-    
-    def flush(self):
+        self._file_schemas[path] = schema
+
+        return data
+
+    def _decode_lazy(self, value):
+        blob = value.raw()
+
+        try:
+            decoded = msgpack.unpackb(blob, **self._unpack_options(False, value.schema, value.legacy))
+        except UnicodeDecodeError:
+            decoded = msgpack.unpackb(blob, **self._unpack_options(True, value.schema))
+
+        # Containers convert their own items; a top-level value that's bytes is converted here
+        if value.legacy and isinstance(decoded, bytes):
+            try:
+                return decoded.decode("utf8")
+            except:
+                pass
+
+        return decoded
+
+    def flush(self, force=False):
         """Flush the database to disk.
 
         Writes all pending changes in the database to disk storage. Creates a temporary file,
-        writes the data, and then safely moves it to the final location. Before writing, creates
-        a backup of the existing database file if one exists.
+        writes the data, syncs it according to ``durability``, and then atomically replaces the
+        final file with it. Before writing, creates a backup of the existing database file if one exists.
 
         If the database has been marked as destroyed or defunct, returns without performing
-        any operations.
+        any operations. If nothing has changed since the last flush, the flush is skipped
+        and counted in ``skipped_flushes``.
+
+        :param force: Write the database even if it hasn't changed
+        :type force: bool
+        :default force: False
+        :return: Whether every change made before the call is now on disk, including
+            changes written by a flush that was already in progress
+        :rtype: bool
 
         :raises IOError: If there is an error writing the data to disk, typically due to insufficient storage space
         """
-        if self.destroyed or self.defunct:
-            return
+        generation = self.generation
+
+        # The transaction's changes are flushed together once it's over
+        if self._transaction is not None and self._transaction.thread == threading.get_ident():
+            self.log.debug(f"Deferring flush of db `{self.name}` until its transaction is over")
+            return False
+
+        with self._flush_lock:
+            if self.destroyed or self.defunct:
+                return False
+
+            # Readers never change the data, so there's nothing of theirs to write
+            if self.access == ACCESS_READER:
+                return True
+
+            # Everything was written before the data was unloaded
+            if self.unloaded:
+                return True
+
+            if not force and not self.dirty:
+                self.skipped_flushes += 1
+                self.log.debug(f"Skipping flush of unchanged db `{self.name}`")
+                return self._flushed_generation >= generation
+
+            started = time.perf_counter()
 
+            try:
+                self._flush(force)
+
+                # Write errors are logged rather than raised, and leave the database dirty
+                return self._flushed_generation >= generation
+            finally:
+                duration = time.perf_counter() - started
+
+                self.flush_count += 1
+                self.last_flush_duration = duration
+                self.max_flush_duration = max(self.max_flush_duration, duration)
+                self.total_flush_duration += duration
+
+    def _flush(self, force):
+        if self.shards is not None:
+            return self._flush_shards(force)
+
+        final_path = self.path
+
+        # Take a point-in-time snapshot. Writers can keep going while it's being serialized.
+        with self._lock:
+            generation = self.generation
+            keys = self._dirty_keys
+            self._dirty_keys = set()
+
+            # Only the changes are journaled, until the journal grows large enough for a snapshot
+            journal = self._changes is not None and not force and None not in keys \
+                and os.path.exists(final_path) and not self.journal.full
+
+            # Journal records always use the dict encoding, since they have no header for a schema
+            forked = None
+
+            if journal:
+                schema = None
+                entries, whole = self._changes.take(keys)
+                self._snapshot = snapshot = Snapshot(self, whole)
+            else:
+                # The snapshot holds every change made so far
+                if self._changes is not None:
+                    self._changes.clear()
+
+                schema = self._new_schema(final_path)
+                snapshot = Snapshot(self, schema=schema)
+                forked = self._fork_write(final_path, snapshot, schema)
+
+                # A forked child has its own copy of the data, so writers don't need to preserve values for it
+                if forked is None:
+                    self._snapshot = snapshot
+
+        try:
+            if journal:
+                self._write_journal(snapshot, entries, whole, keys, generation)
+            else:
+                self._write_snapshot(snapshot, keys, generation, schema, forked)
+        except BaseException:
+            self._unflushed(keys)
+            raise
+        finally:
+            # Only left running if something failed before the write was waited for
+            if forked is not None:
+                forked.cancel()
+
+            with self._lock:
+                self._snapshot = None
+
+    def _flush_shards(self, force):
+        with self._lock:
+            generation = self.generation
+            keys = self._dirty_keys
+            self._dirty_keys = set()
+
+            # Shards that haven't been loaded can't have changed
+            if force or None in keys:
+                indices = set(self.shards.loaded)
+            else:
+                indices = set(self.shards.index_of(key) for key in keys)
+
+        try:
+            self.log.warning(f"Syncing {len(indices)} shard(s) to disk for db `{self.name}`")
+
+            for index in sorted(indices):
+                schema = self._new_schema(self.shards.path(index))
+                self.shards.write(index, schema)
+                self._written_schema(self.shards.path(index), schema)
+
+            self.last_flush = time.time()
+            self._flushed_generation = generation
+        except IOError:
+            self.log.traceback(
+                "An error occurred while attempting to write data to disk. "
+                "This may be due to insufficient storage space. Please ensure "
+                "there is adequate space available before retrying the operation."
+            )
+
+            self._unflushed(keys)
+        except BaseException:
+            self._unflushed(keys)
+            raise
+
+    def _fork_write(self, path, snapshot, schema=None):
+        # Start writing a snapshot from a child process, or return None to write it on this thread.
+        # Called with the lock held, so the child gets a consistent copy of the data.
+        if self.serializer != SERIALIZER_FORK:
+            return None
+
+        try:
+            return ForkedWrite(path, functools.partial(self._serialize, snapshot, schema), self.durability)
+        except OSError:
+            self.log.traceback(f"Could not fork to write db `{self.name}`, writing it on this thread instead")
+            return None
+
+    def _new_schema(self, path):
+        # Get the schema to write models with, or None for the dict encoding
+        if self.model_encoding != MODEL_ENCODING_EXT:
+            return None
+
+        # Undecoded values of a lazily loaded file are copied as they are, so keep the file's layouts
+        previous = self._file_schemas.get(path)
+
+        return ModelSchema(self.models, previous.layouts if previous is not None else ())
+
+    def _written_schema(self, path, schema):
+        # Undecoded values now refer to layouts of the file that was just written
+        if schema is not None and path in self._file_schemas:
+            self._file_schemas[path] = schema
+
+    def _serialize(self, snapshot, schema=None):
+        # Get the chunks of a file holding the snapshot
+        chunks = snapshot.chunks()
+        header = {}
+
+        if schema is not None:
+            # The schema is only complete once every model has been packed, and goes in front of the body
+            chunks = list(chunks)
+            header["schema"] = schema.to_header()
+
+        if self.codec.name != CODEC_NONE:
+            header["codec"] = self.codec.name
+            chunks = self.codec.compress_chunks(chunks)
+
+        if self.access == ACCESS_WRITER:
+            # Lets readers tell whether a rewritten file holds new data
+            header["stamp"] = [self._stamp_token, snapshot.generation]
+
+        # Files without a schema, compression or stamp are plain msgpack, readable by any version
+        if header:
+            chunks = itertools.chain([pack_header(header)], chunks)
+
+        return chunks
+
+    def _unflushed(self, keys):
+        # Leave the keys of a failed flush to the next one, which writes them whole
+        with self._lock:
+            self._dirty_keys |= keys
+
+            if self._changes is not None:
+                self._changes.whole |= keys
+
+    def _write_journal(self, snapshot, entries, whole, keys, generation):
+        try:
+            self.log.debug(f"Journaling {len(entries)} change(s) and {len(whole)} whole key(s) for db `{self.name}`")
+
+            with self._file_locked(exclusive=True):
+                self.journal.append(snapshot, entries, whole)
+
+            self.last_flush = time.time()
+            self._flushed_generation = generation
+        except IOError:
+            self.log.traceback(f"An error occurred while attempting to write the journal for db `{self.name}`.")
+
+            self._unflushed(keys)
+
+    def _write_snapshot(self, snapshot, keys, generation, schema=None, forked=None):
         # Save code here
         final_path = self.path
-        tmp_path = self.path + ".tmp"
 
         # Backup before flushing
         if os.path.exists(final_path):
@@ -174,20 +1278,23 @@ class Database:
             self.backups.backup()
 
         try:
-            with open(tmp_path, "wb") as f:
-                self.log.warning(f"Syncing data to disk for db `{self.name}`")
+            self.log.warning(f"Syncing data to disk for db `{self.name}`")
 
-                blob = msgpack.packb(
-                    self.data,
-                    default=self.encode_type
-                )
+            # Readers in other processes wait, so they never see the new file with the old journal
+            with self._file_locked(exclusive=True):
+                # The old file stays in place until the new one has been completely written
+                if forked is not None:
+                    forked.wait()
+                else:
+                    atomic_write(final_path, self._serialize(snapshot, schema), self.durability)
 
-                f.write(blob)
+                # The snapshot now contains everything in the journal
+                self.journal.reset()
 
-            shutil.copy(tmp_path, final_path)
-            os.remove(tmp_path)
+            self._written_schema(final_path, schema)
 
             self.last_flush = time.time()
+            self._flushed_generation = generation
         except IOError:
             self.log.traceback(
                 "An error occurred while attempting to write data to disk. "
@@ -195,14 +1302,23 @@ class Database:
                 "there is adequate space available before retrying the operation."
             )
 
-            self.log.debug(f"tmp_path: {tmp_path}")
             self.log.debug(f"final_path: {final_path}")
 
-            # Try to clean up
-            try:
-                os.remove(tmp_path)
-            except:
-                pass
+            self._unflushed(keys)
+
+    def flush_async(self, force=False):
+        """Flush the database on a worker thread.
+
+        The snapshot is taken when the worker starts. Changes made while it is being
+        written are kept in memory and picked up by the next flush.
+
+        :param force: Write the database even if it hasn't changed
+        :type force: bool
+        :default force: False
+        :return: Future that completes when the flush is done
+        :rtype: concurrent.futures.Future
+        """
+        return _get_flush_executor().submit(self.flush, force)
 
     def close(self):
         """
@@ -212,9 +1328,15 @@ class Database:
         the database can no longer be used.
         """
         self.flush()
+        self.backups.wait()
 
         self.data = None
         self.defunct = True
+        self._invalidate_indexes()
+        self._release_writer()
+
+        for callback in self.close_callbacks:
+            callback(self)
 
     def destroy(self):
         """
@@ -222,7 +1344,10 @@ class Database:
         
         Deletes the database file from disk. This operation cannot be undone,
         but backups are preserved.
+
+        :raises DatabaseReadOnlyError: If the database was opened with ``access="reader"``
         """
+        self._check_writable()
         self.close()
 
         path = os.path.join(self.root, "%s.mpack" % self.name)
@@ -232,11 +1357,28 @@ class Database:
                 path
             )
 
+        if self.shards is not None and os.path.exists(self.shards.directory):
+            shutil.rmtree(self.shards.directory)
+
+        self.journal.reset()
+
     def append(self, *args, **kwargs):
-        self.data.append(*args, **kwargs)
+        self._check_writable()
+
+        self._access()
+
+        with self._lock:
+            self._touch()
+            self.data.append(*args, **kwargs)
 
     def remove(self, **kwargs):
-        self.data.remove(**kwargs)
+        self._check_writable()
+
+        self._access()
+
+        with self._lock:
+            self._touch()
+            self.data.remove(**kwargs)
 
     def pop(self, i):
         return
@@ -244,29 +1386,116 @@ class Database:
     def __getitem__(self, index):
         if not (type(index) in (str, bytes)):
             raise ValueError("Expected str or bytes, got %s" % type(index))
-        
+
+        if self._transaction is not None:
+            self._wait_for_transaction()
+
+        self._access()
+
+        if self.shards is not None:
+            with self._lock:
+                self.shards.load_key(index)
+
         val = self.data[index]
 
+        if type(val) is LazyValue:
+            with self._lock:
+                val = self.data[index]
+
+                # Decoded once, then kept like any other value
+                if type(val) is LazyValue:
+                    val = self.data[index] = self._decode_lazy(val)
+
+        val = self._bind(index, val)
+
         # TODO: Recursively fix any unneccessarily bytes types
 
         return val
 
     def __setitem__(self, index, value):
+        """Store a value in the database.
+
+        Dicts and lists are stored as tracked copies, so later changes must be
+        made through the value returned by ``db[index]`` to be noticed. Changes
+        to the original object aren't saved; see CHANGELOG.md.
+        """
         if not (type(index) in (str, bytes)):
             raise ValueError("Expected str or bytes, got %s" % type(index))
 
-        self.data[index] = value
-        return self.data[index]
+        self._check_writable()
+
+        self._access()
+
+        with self._lock:
+            if self.shards is not None:
+                self.shards.keys[self.shards.load_key(index)].add(index)
+
+            self._touch(index, replace=True)
+
+            if index in self.data:
+                self._release(self.data[index])
+
+            self.data[index] = track(value, Binding(self, index))
+            self._invalidate_indexes(index)
+
+            return self.data[index]
 
     def __delitem__(self, index):
         if not (type(index) in (str, bytes)):
             raise ValueError("Expected str or bytes, got %s" % type(index))
 
-        del self.data[index]
+        self._check_writable()
+
+        self._access()
+
+        with self._lock:
+            if self.shards is not None:
+                shard = self.shards.load_key(index)
+
+            value = self.data[index]
+
+            self._touch(index, replace=True)
+
+            del self.data[index]
+            self._release(value)
+            self._invalidate_indexes(index)
+
+            if self.shards is not None:
+                self.shards.keys[shard].discard(index)
+
+    def __contains__(self, index):
+        if self._transaction is not None:
+            self._wait_for_transaction()
+
+        self._access()
+
+        if self.shards is not None and type(index) in (str, bytes):
+            with self._lock:
+                self.shards.load_key(index)
+
+        return index in self.data
 
     def __iter__(self):
+        if self._transaction is not None:
+            self._wait_for_transaction()
+
+        self._access()
+
+        if self.shards is not None:
+            with self._lock:
+                self.shards.load_all()
+
         for i in self.data:
             yield i
 
     def __len__(self):
+        if self._transaction is not None:
+            self._wait_for_transaction()
+
+        self._access()
+
+        if self.shards is not None:
+            with self._lock:
+                self.shards.load_all()
+
         return len(self.data)
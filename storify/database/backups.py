@@ -1,50 +1,675 @@
+import io
 import os
-import shutil
+import time
+import zlib
+import hashlib
+import mmap
+import threading
+import contextlib
+import msgpack
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ..exceptions import BackupError
+from .fileformat import MAGIC, pack_header, read_header
+from .lazy import map_file
+from .codecs import get_codec, get_codec_by_id, CODEC_NONE
+from .storage import atomic_write, DURABILITY_NONE
+
+# Chunks are at least MIN_CHUNK bytes, unless the file ends first, and at most MAX_CHUNK bytes
+MIN_CHUNK = 4 * 1024
+MAX_CHUNK = 1024 * 1024
+
+# A chunk ends after a top-level entry whose key hashes to 0 under this mask, so 1 in 16 entries on average
+BOUNDARY_MASK = 0xf
+
+def split_chunks(buffer):
+    """Find the chunk boundaries of a database file.
+
+    Chunks end after top-level entries picked by a hash of their key, so that a
+    change to one value only changes the chunk it's in, and inserting or removing
+    an entry doesn't shift the chunks after it. Files that aren't a top-level map
+    are split into fixed-size chunks.
+
+    :param buffer: The contents of the file
+    :type buffer: bytes or mmap.mmap
+    :return: List of ``(start, end)`` offsets
+    :rtype: list
+    """
+    size = len(buffer)
+    bounds = []
+
+    try:
+        header, offset = read_header(buffer)
+
+        if isinstance(buffer, bytes):
+            stream = io.BytesIO(buffer)
+        else:
+            stream = buffer
+
+        stream.seek(offset)
+        unpacker = msgpack.Unpacker(stream, max_buffer_size=max(size, MAX_CHUNK))
+
+        start = 0
+
+        for i in range(unpacker.read_map_header()):
+            key_start = offset + unpacker.tell()
+            unpacker.skip()
+            key_end = offset + unpacker.tell()
+            unpacker.skip()
+            end = offset + unpacker.tell()
+
+            length = end - start
+
+            if length >= MAX_CHUNK or (length >= MIN_CHUNK and not zlib.crc32(buffer[key_start:key_end]) & BOUNDARY_MASK):
+                bounds.append(end)
+                start = end
+
+        if offset + unpacker.tell() != size:
+            raise ValueError("Trailing data after the top-level map")
+    except Exception:
+        bounds = []
+
+    if not bounds or bounds[-1] != size:
+        bounds.append(size)
+
+    # Entries too big for one chunk are split into fixed-size pieces
+    chunks = []
+    start = 0
+
+    for end in bounds:
+        while end - start > MAX_CHUNK:
+            chunks.append((start, start + MAX_CHUNK))
+            start += MAX_CHUNK
+
+        chunks.append((start, end))
+        start = end
+
+    return chunks
+
+# Shared by all databases for background backups
+_backup_executor = None
+
+def _get_backup_executor():
+    global _backup_executor
+
+    if _backup_executor is None:
+        _backup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="storify-backup")
+
+    return _backup_executor
 
 class Backups:
-    def __init__(self, db):
+    def __init__(self, db, max_backups=5, max_age=None, max_total_size=None, index_file=False, background=False):
         """Initialize the Backups instance.
 
+        Backups are stored as content-addressed chunks in ``.backups/<name>/chunks/``,
+        shared between backups, and a small manifest per backup that lists its chunks.
+        Creating a backup only writes the chunks that no other backup has, so a flush
+        that changes a few values of a large database adds little to the backup directory.
+
+        Chunks are compressed with the database's codec. Backups of a compressed
+        database are split into chunks before compression, so they are deduplicated just
+        as well, and restore as the equivalent uncompressed database file.
+
+        Full-copy backups made by older versions are still listed and restored.
+
+        The backups are tracked in an in-memory index, which is kept up to date as backups
+        are created and removed, and only rebuilt when the backup directory's mtime shows
+        that something else changed it.
+
         :param db: Database instance to manage backups for
         :type db: Database
+        :param max_backups: Number of backups to keep
+        :type max_backups: int
+        :default max_backups: 5
+        :param max_age: Remove backups older than this many seconds
+        :type max_age: float
+        :default max_age: None
+        :param max_total_size: Remove the oldest backups once they take more than this many bytes on disk
+        :type max_total_size: int
+        :default max_total_size: None
+        :param index_file: Keep a copy of the index in ``.backups/<name>.index``, so it doesn't have to be rebuilt on startup
+        :type index_file: bool
+        :default index_file: False
+        :param background: Store backups on a worker thread, so that they don't hold up flushes
+        :type background: bool
+        :default background: False
         """
         self.db = db
         self.root = db.root
         self.name = db.name
 
-        self.max_backups = 5
+        # The newest backup is always kept, whatever these are set to
+        self.max_backups = max_backups
+        self.max_age = max_age
+        self.max_total_size = max_total_size
+
+        self.index_file = index_file
+        self.background = background
+
+        # Details of the most recent backup() and restore(), for reporting
+        self.last_backup = None
+        self.last_restore = None
+
+        # Backup ID > entry, and the mtime of the backup directory it reflects
+        self._index = None
+        self._index_mtime = None
+        self._lock = threading.RLock()
+
+        # Backup ID > creation time of files linked for background backups, and the highest ID handed out.
+        # Pending files are in a subdirectory, so that linking them doesn't change the backup directory's mtime.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._last_id = None
+        self._future = None
 
     def backup(self):
         """Create a backup of the database.
 
-        Creates a new backup file with an incremented ID and removes oldest backups
-        if the maximum number of backups is exceeded.
+        Creates a new backup with an incremented ID and removes the oldest backups
+        once there are more than ``max_backups``, they're older than ``max_age``, or
+        they take more than ``max_total_size`` bytes.
+
+        In background mode, the database file is only hard-linked into the backup
+        directory here, which is cheap and keeps the file's current contents after the
+        flush replaces it. Storing it as chunks and pruning happen on a worker thread.
         """
-        backup_id = self.latest + 1
+        if self.background:
+            try:
+                self._link()
+            except OSError:
+                # No hard links on this filesystem
+                self.db.log.debug(f"Can't link db `{self.name}` for a background backup, backing up now")
+            else:
+                self._future = _get_backup_executor().submit(self.process_pending)
+                return
 
-        shutil.copy(
-            self.db_path,
-            os.path.join(self.backup_path, str(backup_id))
-        )
+        with self._lock:
+            self.process_pending()
 
-        backups = self.list
-        backups.reverse()
+            self._store(self.db_path, self._allocate_id(), time.time())
+            self.prune()
+
+    def _allocate_id(self):
+        if self._last_id is None:
+            self._refresh()
+
+        with self._pending_lock:
+            self._last_id += 1
+
+            return self._last_id
+
+    def _link(self):
+        os.makedirs(self.pending_path, exist_ok=True)
+
+        backup_id = self._allocate_id()
+
+        # Linked and registered together, so _find_pending never sees a half-registered file
+        with self._pending_lock:
+            os.link(self.db_path, os.path.join(self.pending_path, str(backup_id)))
+            self._pending[backup_id] = time.time()
+
+    def process_pending(self):
+        """Store the database files that were linked for background backups, and prune.
+
+        Runs on the worker thread in background mode. Call it (or :meth:`wait`) to finish
+        pending backups right away.
+        """
+        with self._lock:
+            # The first refresh also finds files left pending by a previous run
+            self._refresh()
+            processed = False
+
+            while True:
+                with self._pending_lock:
+                    if not self._pending:
+                        break
+
+                    backup_id = min(self._pending)
+                    created = self._pending[backup_id]
+
+                path = os.path.join(self.pending_path, str(backup_id))
+
+                try:
+                    self._store(path, backup_id, created)
+                    os.remove(path)
+                except Exception:
+                    # The link stays in place, and is retried by the next backup
+                    self.db.log.traceback(f"Background backup '{backup_id}' of db `{self.name}` failed")
+                    break
+
+                with self._pending_lock:
+                    del self._pending[backup_id]
+
+                processed = True
+
+            if processed:
+                self.prune()
+
+    def wait(self):
+        """Wait for background backups to be stored."""
+        self.process_pending()
+
+    def _store(self, source, backup_id, created):
+        # Store a database file as backup_id
+        with self._lock:
+            started = time.perf_counter()
+
+            if not os.path.isdir(self.chunk_path):
+                os.makedirs(self.chunk_path, exist_ok=True)
+                self._updated()
+
+            # Chunks used by other backups are known to exist without checking the disk
+            known = {}
+
+            for entry in self._refresh().values():
+                if entry["chunks"] is not None:
+                    known.update(entry["chunks"])
+
+            buffer = self._read_source(source)
+            size = len(buffer) if buffer is not None else 0
+            codec = self.db.codec
+
+            chunks = {}
+            digests = []
+            new_chunks = 0
+            new_bytes = 0
+
+            try:
+                for start, end in split_chunks(buffer) if buffer is not None else ():
+                    chunk = buffer[start:end]
+                    digest = hashlib.sha256(chunk).digest()
+
+                    path = self.get_path_of_chunk(digest)
+
+                    if digest in known:
+                        chunks[digest] = known[digest]
+                    elif os.path.exists(path):
+                        chunks[digest] = os.path.getsize(path)
+                    else:
+                        # Chunks start with the ID of the codec they're compressed with
+                        stored = bytes((codec.id,)) + codec.compress(chunk)
+                        atomic_write(path, [stored], self.db.durability)
+
+                        chunks[digest] = len(stored)
+                        new_chunks += 1
+                        new_bytes += len(stored)
+
+                    digests.append(digest)
+            finally:
+                if isinstance(buffer, mmap.mmap):
+                    buffer.close()
+
+            manifest = pack_header({
+                "chunks": digests,
+                "sizes": [chunks[digest] for digest in digests],
+                "size": size,
+                "created": created
+            })
+
+            path = self.get_path_of_backup(backup_id)
+            atomic_write(path, [manifest], self.db.durability)
+
+            self._index[backup_id] = self._entry(os.stat(path), created, size, chunks)
+            self._updated()
+
+            self.last_backup = {
+                "id": backup_id,
+                "size": size,
+                "chunks": len(digests),
+                "new_chunks": new_chunks,
+                "new_bytes": new_bytes,
+                "duration": time.perf_counter() - started,
+            }
+
+    def _read_source(self, source):
+        # Get the contents of a database file to back up. Compressed files are backed up
+        # uncompressed, so that they can be split into chunks; the chunks are compressed instead.
+        buffer = map_file(source)
+
+        if buffer is None:
+            return None
+
+        header, offset = read_header(buffer)
+
+        if header is None or header.get("codec", CODEC_NONE) == CODEC_NONE:
+            return buffer
+
+        try:
+            body = get_codec(header["codec"]).decompress(buffer[offset:])
+        finally:
+            buffer.close()
+
+        del header["codec"]
+        header.pop("version", None)
+
+        return (pack_header(header) if header else b"") + body
+
+    def prune(self):
+        """Remove the backups that are past ``max_backups``, ``max_age`` or ``max_total_size``.
+
+        Backups are removed oldest first, along with the chunks that only they used.
+
+        :return: IDs of the removed backups
+        :rtype: list[int]
+        """
+        with self._lock:
+            index = self._refresh()
+            backups = sorted(index, reverse=True)
+
+            now = time.time()
+            used = {}
+            stored = 0
+
+            for position, backup_id in enumerate(backups):
+                entry = index[backup_id]
+                chunks = entry["chunks"] or {}
+
+                stored += entry["file_size"] + sum(size for digest, size in chunks.items() if digest not in used)
+
+                # Everything from the first backup that's past a limit is removed
+                if position > 0 and (position >= self.max_backups
+                                     or (self.max_age is not None and now - entry["created"] > self.max_age)
+                                     or (self.max_total_size is not None and stored > self.max_total_size)):
+                    break
+
+                used.update(chunks)
+            else:
+                return []
+
+            removed = backups[position:]
+            unused = set()
+
+            for backup_id in removed:
+                unused.update(index[backup_id]["chunks"] or ())
+
+                try:
+                    os.remove(self.get_path_of_backup(backup_id))
+                except FileNotFoundError:
+                    pass
+
+                del index[backup_id]
+
+            for digest in unused.difference(used):
+                try:
+                    os.remove(self.get_path_of_chunk(digest))
+                except FileNotFoundError:
+                    pass
+
+            self._updated()
+
+            return removed
+
+    def collect_chunks(self):
+        """Remove chunks that aren't used by any backup, such as ones left behind by a crash.
+
+        :return: Number of chunks removed
+        :rtype: int
+        """
+        with self._lock:
+            used = set()
+
+            for entry in self._refresh().values():
+                if entry["chunks"] is not None:
+                    used.update(digest.hex() for digest in entry["chunks"])
+
+            removed = 0
+
+            for name in os.listdir(self.chunk_path):
+                if name not in used:
+                    os.remove(os.path.join(self.chunk_path, name))
+                    removed += 1
+
+            return removed
+
+    def _entry(self, stat, created, size, chunks):
+        # An index entry. "stat" tells whether the backup file was changed behind our back.
+        return {
+            "stat": [stat.st_size, stat.st_mtime_ns],
+            "created": created,
+            "size": size,
+            "file_size": stat.st_size,
+            "chunks": chunks,
+        }
+
+    def _read_entry(self, backup_id, stat):
+        manifest = self.read_manifest(backup_id)
+
+        if manifest is None:
+            # A full copy of the database
+            return self._entry(stat, stat.st_mtime, stat.st_size, None)
+
+        sizes = manifest.get("sizes")
+
+        if sizes is None:
+            sizes = [self._chunk_size(digest) for digest in manifest["chunks"]]
+
+        return self._entry(stat, manifest["created"], manifest["size"], dict(zip(manifest["chunks"], sizes)))
+
+    def _chunk_size(self, digest):
+        try:
+            return os.path.getsize(self.get_path_of_chunk(digest))
+        except OSError:
+            return 0
+
+    def _refresh(self):
+        # Get the index, rebuilding it if the backup directory was changed by something else
+        with self._lock:
+            try:
+                mtime = os.stat(self.backup_path).st_mtime_ns
+            except FileNotFoundError:
+                os.makedirs(self.backup_path)
+                mtime = os.stat(self.backup_path).st_mtime_ns
+
+            if self._index is not None and mtime == self._index_mtime:
+                return self._index
+
+            if self._index is None and self.index_file:
+                self._read_index_file()
+
+                if self._index is not None and mtime == self._index_mtime:
+                    return self._index
+
+            previous = self._index or {}
+            index = {}
+
+            for name in os.listdir(self.backup_path):
+                if not name.isdigit():
+                    continue
+
+                backup_id = int(name)
+
+                try:
+                    stat = os.stat(self.get_path_of_backup(backup_id))
+                except FileNotFoundError:
+                    continue
+
+                entry = previous.get(backup_id)
+
+                # Backup files aren't changed once written, so only new ones need to be read
+                if entry is None or entry["stat"] != [stat.st_size, stat.st_mtime_ns]:
+                    try:
+                        entry = self._read_entry(backup_id, stat)
+                    except FileNotFoundError:
+                        continue
+                    except Exception:
+                        self.db.log.traceback("Can't read backup '%s' of db `%s`" % (backup_id, self.name))
+                        entry = self._entry(stat, stat.st_mtime, stat.st_size, None)
 
-        while len(backups) > self.max_backups:
+                index[backup_id] = entry
+
+            self._index = index
+            self._index_mtime = mtime
+            self._write_index_file()
+
+            self._find_pending()
+
+            return index
+
+    def _find_pending(self):
+        # Pick up files that were linked for background backups that never got stored, e.g. because of a crash
+        with self._pending_lock:
+            try:
+                names = os.listdir(self.pending_path)
+            except FileNotFoundError:
+                names = []
+
+            self._last_id = max(self._last_id or 0, max(self._index, default=0))
+
+            for name in names:
+                if name.isdigit() and int(name) not in self._pending:
+                    self._pending[int(name)] = os.stat(os.path.join(self.pending_path, name)).st_ctime
+                    self._last_id = max(self._last_id or 0, int(name))
+
+    def _updated(self):
+        # Our own changes to the directory don't make the index stale
+        self._index_mtime = os.stat(self.backup_path).st_mtime_ns
+        self._write_index_file()
+
+    def _read_index_file(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                saved = msgpack.unpackb(f.read(), strict_map_key=False)
+
+            self._index = saved["backups"]
+            self._index_mtime = saved["mtime"]
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self.db.log.warning("Ignoring damaged backup index of db `%s`" % self.name)
+
+    def _write_index_file(self):
+        if not self.index_file:
+            return
+
+        blob = msgpack.packb({"mtime": self._index_mtime, "backups": self._index})
+
+        try:
+            # Only a cache, so there's no need to sync it
+            atomic_write(self.index_path, [blob], DURABILITY_NONE)
+        except OSError:
+            self.db.log.traceback("Can't write backup index of db `%s`" % self.name)
+
+    def stats(self):
+        """Get the disk usage of the backups.
+
+        :return: Number of ``backups``, their total ``size`` as database files, the number of
+            ``chunks`` and the bytes ``stored`` on disk, including manifests and full copies
+        :rtype: dict
+        """
+        index = self._refresh()
+
+        size = 0
+        stored = 0
+        chunks = {}
+
+        for entry in index.values():
+            size += entry["size"]
+            stored += entry["file_size"]
+            chunks.update(entry["chunks"] or {})
+
+        return {
+            "backups": len(index),
+            "size": size,
+            "chunks": len(chunks),
+            "stored": stored + sum(chunks.values()),
+        }
+
+    def read_manifest(self, backup_id):
+        """Read the manifest of a backup.
+
+        :param backup_id: ID of the backup
+        :type backup_id: int
+        :return: The manifest, or None if the backup is a full copy of the database
+        :rtype: dict
+        """
+        with open(self.get_path_of_backup(backup_id), "rb") as f:
+            # Don't read all of a full copy just to find out that it is one
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
 
-            os.remove(
-                os.path.join(
-                    self.root,
-                    ".backups",
-                    self.name,
-                    str(backups[0])
-                    )
-                )
+            f.seek(0)
+            header, offset = read_header(f.read())
 
-            del backups[0]
+        if header is None or "chunks" not in header:
+            return None
 
-    # def restore(self, backup_id):
-    #     path = self.get_path_of_backup(backup_id)
+        return header
+
+    def read_chunk(self, digest):
+        """Read a chunk, checking that it's intact.
+
+        :param digest: SHA-256 digest of the chunk
+        :type digest: bytes
+        :rtype: bytes
+        :raises BackupError: If the chunk is missing or damaged
+        """
+        try:
+            with open(self.get_path_of_chunk(digest), "rb") as f:
+                stored = f.read()
+        except OSError:
+            raise BackupError("Backup chunk %s of db:%s is missing" % (digest.hex(), self.name))
+
+        try:
+            chunk = get_codec_by_id(stored[0]).decompress(memoryview(stored)[1:])
+        except Exception:
+            raise BackupError("Backup chunk %s of db:%s is damaged or uses an unavailable codec" % (digest.hex(), self.name))
+
+        if hashlib.sha256(chunk).digest() != digest:
+            raise BackupError("Backup chunk %s of db:%s is damaged" % (digest.hex(), self.name))
+
+        return chunk
+
+    def restore(self, backup_id, path):
+        """Rebuild a backup as a database file.
+
+        :param backup_id: ID of the backup
+        :type backup_id: int
+        :param path: Path to write the database file to
+        :type path: str
+        :return: Details of the restore: ``id``, ``size`` in bytes, and ``duration`` in seconds
+        :rtype: dict
+        :raises BackupError: If a chunk of the backup is missing or damaged
+        """
+        started = time.perf_counter()
+        manifest = self.read_manifest(backup_id)
+
+        if manifest is None:
+            with open(self.get_path_of_backup(backup_id), "rb") as f:
+                atomic_write(path, iter(lambda: f.read(MAX_CHUNK), b""), self.db.durability)
+        else:
+            atomic_write(path, (self.read_chunk(digest) for digest in manifest["chunks"]), self.db.durability)
+
+        self.last_restore = {
+            "id": backup_id,
+            "size": os.path.getsize(path),
+            "duration": time.perf_counter() - started,
+        }
+
+        self.db.log.info("Restored backup '%s' of db `%s` (%d bytes) in %.3fs" % (
+            backup_id, self.name, self.last_restore["size"], self.last_restore["duration"]))
+
+        return self.last_restore
+
+    @contextlib.contextmanager
+    def open(self, backup_id):
+        """Get a readable database file of a backup, for as long as the context lasts.
+
+        :param backup_id: ID of the backup
+        :type backup_id: int
+        :return: Context manager giving the path of the file
+        """
+        if self.read_manifest(backup_id) is None:
+            yield self.get_path_of_backup(backup_id)
+            return
+
+        path = os.path.join(self.backup_path, "%d.restore" % backup_id)
+        self.restore(backup_id, path)
+
+        try:
+            yield path
+        finally:
+            os.remove(path)
 
     @property
     def db_path(self):
@@ -53,7 +678,7 @@ class Backups:
         :return: Full path to the database file
         :rtype: str
         """
-        return os.path.join(self.root, "%s.mpack" % self.name)
+        return self.db.path
 
     @property
     def backup_path(self):
@@ -62,8 +687,40 @@ class Backups:
         :return: Full path to the backup directory
         :rtype: str
         """
+        if self.root is None:
+            # A database opened by path keeps its backups next to it
+            directory, filename = os.path.split(self.db.path)
+            return os.path.join(directory, ".backups", os.path.splitext(filename)[0])
+
         return os.path.join(self.root, ".backups", self.name)
 
+    @property
+    def chunk_path(self):
+        """Get the path to the directory of chunks shared by the backups.
+
+        :return: Full path to the chunk directory
+        :rtype: str
+        """
+        return os.path.join(self.backup_path, "chunks")
+
+    @property
+    def pending_path(self):
+        """Get the path to the directory of files linked for background backups.
+
+        :return: Full path to the pending directory
+        :rtype: str
+        """
+        return os.path.join(self.backup_path, "pending")
+
+    @property
+    def index_path(self):
+        """Get the path to the file the backup index is kept in, when ``index_file`` is enabled.
+
+        :return: Full path to the index file
+        :rtype: str
+        """
+        return self.backup_path + ".index"
+
     @property
     def list(self):
         """List all backups of the database.
@@ -73,16 +730,7 @@ class Backups:
         :return: List of backup IDs sorted in descending order
         :rtype: list[int]
         """
-        if not os.path.exists(self.backup_path):
-            os.makedirs(self.backup_path)
-            return []
-
-        backups = os.listdir(self.backup_path)
-        backups = [int(i) for i in backups]
-        backups.sort()
-        backups.reverse()
-
-        return backups
+        return sorted(self._refresh(), reverse=True)
 
     @property
     def latest(self):
@@ -112,9 +760,21 @@ class Backups:
     def get_path_of_backup(self, backup_id):
         """Get the full path of a specific backup.
 
+        This is the backup's manifest, or for backups made by older versions, a full copy of the database.
+
         :param backup_id: ID of the backup
         :type backup_id: int
         :return: Full path to the backup file
         :rtype: str
         """
         return os.path.join(self.backup_path, str(backup_id))
+
+    def get_path_of_chunk(self, digest):
+        """Get the full path of a chunk.
+
+        :param digest: SHA-256 digest of the chunk
+        :type digest: bytes
+        :return: Full path to the chunk file
+        :rtype: str
+        """
+        return os.path.join(self.chunk_path, digest.hex())
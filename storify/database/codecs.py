@@ -0,0 +1,193 @@
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_LZMA = "lzma"
+CODEC_ZSTD = "zstd"
+CODEC_LZ4 = "lz4"
+
+class Codec:
+    # Name stored in file headers, and a one-byte ID for places where a name would be too big
+    name = None
+    id = None
+
+    def compress(self, data):
+        """Compress a complete piece of data.
+
+        :param data: The data to compress
+        :type data: bytes-like
+        :rtype: bytes
+        """
+        compressor = self.compressor()
+
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """Decompress a complete piece of data.
+
+        :param data: The compressed data
+        :type data: bytes-like
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def compressor(self):
+        """Get an object to compress a stream of data with.
+
+        :return: An object with ``compress(data)`` and ``flush()`` methods, both returning bytes
+        """
+        raise NotImplementedError
+
+    def compress_chunks(self, chunks):
+        """Compress a stream of data.
+
+        :param chunks: Iterable of bytes
+        :return: Generator of compressed bytes
+        :rtype: generator
+        """
+        compressor = self.compressor()
+
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+
+            if compressed:
+                yield compressed
+
+        yield compressor.flush()
+
+class NoCodec(Codec):
+    name = CODEC_NONE
+    id = 0
+
+    def compress(self, data):
+        return bytes(data)
+
+    def decompress(self, data):
+        return bytes(data)
+
+    def compress_chunks(self, chunks):
+        return chunks
+
+class ZlibCodec(Codec):
+    name = CODEC_ZLIB
+    id = 1
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+class LzmaCodec(Codec):
+    name = CODEC_LZMA
+    id = 2
+
+    def __init__(self, preset=6):
+        self.preset = preset
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+    def compressor(self):
+        return lzma.LZMACompressor(preset=self.preset)
+
+class ZstdCodec(Codec):
+    name = CODEC_ZSTD
+    id = 3
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def decompress(self, data):
+        # Streamed frames don't record their size, which zstandard's one-shot decompress needs
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+class _LZ4Compressor:
+    # Gives lz4's frame compressor the same interface as zlib's
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._begun = False
+
+    def compress(self, data):
+        if not self._begun:
+            self._begun = True
+            return self._compressor.begin() + self._compressor.compress(data)
+
+        return self._compressor.compress(data)
+
+    def flush(self):
+        if not self._begun:
+            self._begun = True
+            return self._compressor.begin() + self._compressor.flush()
+
+        return self._compressor.flush()
+
+class LZ4Codec(Codec):
+    name = CODEC_LZ4
+    id = 4
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+    def compressor(self):
+        return _LZ4Compressor()
+
+_codecs = [NoCodec(), ZlibCodec(), LzmaCodec()]
+
+if zstandard is not None:
+    _codecs.append(ZstdCodec())
+
+if lz4 is not None:
+    _codecs.append(LZ4Codec())
+
+CODECS = {codec.name: codec for codec in _codecs}
+CODECS_BY_ID = {codec.id: codec for codec in _codecs}
+
+def get_codec(name):
+    """Get a compression codec by name.
+
+    :param name: ``"none"``, ``"zlib"``, ``"lzma"``, or ``"zstd"`` and ``"lz4"`` when their packages are installed
+    :type name: str
+    :rtype: Codec
+    :raises ValueError: If the codec is unknown or its package isn't installed
+    """
+    if name is None:
+        name = CODEC_NONE
+
+    if name not in CODECS:
+        if name in (CODEC_ZSTD, CODEC_LZ4):
+            raise ValueError("Compression codec %r needs the %r package" % (name, "zstandard" if name == CODEC_ZSTD else "lz4"))
+
+        raise ValueError("Unknown compression codec %r, expected one of %s" % (name, ", ".join(CODECS)))
+
+    return CODECS[name]
+
+def get_codec_by_id(codec_id):
+    """Get a compression codec by its one-byte ID.
+
+    :param codec_id: The codec's ID
+    :type codec_id: int
+    :rtype: Codec
+    :raises ValueError: If the codec is unknown or its package isn't installed
+    """
+    if codec_id not in CODECS_BY_ID:
+        raise ValueError("Unknown or unavailable compression codec %d" % codec_id)
+
+    return CODECS_BY_ID[codec_id]
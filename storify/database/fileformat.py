@@ -0,0 +1,135 @@
+import struct
+import threading
+import msgpack
+
+from ..model import Model
+
+# Files with a header start with MAGIC. 0xc1 is never used by msgpack, so a plain
+# msgpack file (the original format, still written by default) can't be mistaken for one.
+MAGIC = b"\xc1STORIFY"
+VERSION = 1
+
+# Models are stored as {"__Keyname__": {field: value, ...}}
+MODEL_ENCODING_DICT = "dict"
+# Models are stored as ExtType(EXT_MODEL, [layout_id, value, ...]), with layouts in the header
+MODEL_ENCODING_EXT = "ext"
+
+MODEL_ENCODINGS = (MODEL_ENCODING_DICT, MODEL_ENCODING_EXT)
+
+EXT_MODEL = 1
+
+_header_length = struct.Struct(">I")
+
+def pack_header(header):
+    """Encode a file header.
+
+    :param header: Header fields
+    :type header: dict
+    :return: The bytes that go in front of the body
+    :rtype: bytes
+    """
+    header = dict(header, version=VERSION)
+    blob = msgpack.packb(header)
+
+    return MAGIC + _header_length.pack(len(blob)) + blob
+
+def read_header(buffer):
+    """Decode the header at the start of a file, if it has one.
+
+    :param buffer: The file's contents, or at least its beginning
+    :type buffer: bytes-like
+    :return: The header fields (or None for a plain msgpack file) and the offset of the body
+    :rtype: tuple
+    :raises ValueError: If the file was written by a newer, unsupported version of the format
+    """
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        return None, 0
+
+    start = len(MAGIC) + _header_length.size
+    length, = _header_length.unpack(bytes(buffer[len(MAGIC):start]))
+    header = msgpack.unpackb(bytes(buffer[start:start + length]))
+
+    if header.get("version", 0) > VERSION:
+        raise ValueError("Unsupported file format version %s" % header.get("version"))
+
+    return header, start + length
+
+def read_file_header(path):
+    """Read the header of a database file, without reading the rest of it.
+
+    :param path: Path of the file
+    :type path: str
+    :return: The header fields, or None for a plain msgpack file
+    :rtype: dict
+    :raises ValueError: If the file was written by a newer, unsupported version of the format
+    """
+    with open(path, "rb") as f:
+        start = f.read(len(MAGIC) + _header_length.size)
+
+        if start[:len(MAGIC)] != MAGIC or len(start) < len(MAGIC) + _header_length.size:
+            return None
+
+        length, = _header_length.unpack(start[len(MAGIC):])
+
+        return read_header(start + f.read(length))[0]
+
+class ModelSchema:
+    def __init__(self, models, layouts=()):
+        """Initialize the ModelSchema instance.
+
+        The schema of one file written with the ``"ext"`` model encoding. Each distinct
+        combination of model keyname and field names gets a numeric layout id, so that
+        models can be stored as a layout id followed by their values, without repeating
+        the keyname and field names for every instance.
+
+        :param models: Registry used to find model keynames
+        :type models: ModelRegistry
+        :param layouts: Layouts read from a file header, as ``[keyname, [field, ...]]`` pairs
+        :type layouts: list
+        """
+        self.models = models
+        self.layouts = [(keyname, tuple(fields)) for keyname, fields in layouts]
+
+        self._ids = {layout: i for i, layout in enumerate(self.layouts)}
+        self._lock = threading.Lock()
+
+    def encode(self, model):
+        """Encode a model instance as an ExtType.
+
+        Used as the ``default`` function of msgpack packers.
+
+        :param model: The model instance
+        :type model: Model
+        :rtype: msgpack.ExtType
+        """
+        values = model._to_dict()
+        layout = (self.models.keyname(type(model)), tuple(values))
+
+        layout_id = self._ids.get(layout)
+
+        if layout_id is None:
+            with self._lock:
+                layout_id = self._ids.get(layout)
+
+                if layout_id is None:
+                    layout_id = self._ids[layout] = len(self.layouts)
+                    self.layouts.append(layout)
+
+        blob = msgpack.packb([layout_id, *values.values()], default=self.default)
+
+        return msgpack.ExtType(EXT_MODEL, blob)
+
+    def default(self, data):
+        """The ``default`` function for msgpack packers writing this schema."""
+        if isinstance(data, Model):
+            return self.encode(data)
+
+        return data
+
+    def to_header(self):
+        """Get the schema in the form stored in the file header.
+
+        :rtype: list
+        """
+        with self._lock:
+            return [[keyname, list(fields)] for keyname, fields in self.layouts]
@@ -0,0 +1,141 @@
+import os
+import signal
+
+from .storage import write_file, sync_directory
+
+# Serialize and write snapshots on a thread of this process
+SERIALIZER_THREAD = "thread"
+# Serialize and write snapshots in a forked child process, which doesn't hold this process's GIL
+SERIALIZER_FORK = "fork"
+
+SERIALIZERS = (SERIALIZER_THREAD, SERIALIZER_FORK)
+
+# Longest error message a child sends back, which has to fit in the pipe's buffer
+MAX_ERROR_SIZE = 4096
+
+def can_fork():
+    """Whether this platform can fork processes (POSIX only).
+
+    :rtype: bool
+    """
+    return hasattr(os, "fork")
+
+class ForkedWrite:
+    def __init__(self, path, serialize, durability):
+        """Initialize the ForkedWrite instance.
+
+        Forks a child process that calls ``serialize`` and writes the chunks it returns to
+        ``<path>.tmp``. The child has a copy-on-write view of the parent's memory as it was at
+        the fork, so it sees the data exactly as it was when the write started, and the parent
+        can keep changing it. :meth:`wait` moves the finished file into place.
+
+        Must be created while holding the database's lock, so no change is half-made at the
+        fork. The child never logs or takes other locks, since threads that held them at the
+        fork don't exist in the child.
+
+        :param path: Path of the file to write
+        :type path: str
+        :param serialize: Function returning an iterable of bytes, called in the child
+        :type serialize: callable
+        :param durability: Durability level
+        :type durability: str
+        :raises OSError: If the process can't be forked
+        """
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.durability = durability
+
+        read_fd, write_fd = os.pipe()
+
+        try:
+            pid = os.fork()
+        except OSError:
+            os.close(read_fd)
+            os.close(write_fd)
+            raise
+
+        if pid == 0:
+            os.close(read_fd)
+            self._child(serialize, write_fd)
+
+        os.close(write_fd)
+
+        self.pid = pid
+        self._read_fd = read_fd
+
+    def _child(self, serialize, error_fd):
+        code = 1
+
+        try:
+            write_file(self.tmp_path, serialize(), self.durability)
+            code = 0
+        except BaseException as e:
+            try:
+                os.write(error_fd, repr(e).encode("utf8", "replace")[:MAX_ERROR_SIZE])
+            except BaseException:
+                pass
+        finally:
+            # Skip atexit handlers and the parent's buffered output
+            os._exit(code)
+
+    def wait(self):
+        """Wait for the child to finish writing, then move the file into place.
+
+        :raises IOError: If the child failed. The temporary file is removed.
+        """
+        if self.pid is None:
+            return
+
+        try:
+            _, status = os.waitpid(self.pid, 0)
+            code = os.waitstatus_to_exitcode(status)
+
+            error = self._read_error() if code != 0 else ""
+        finally:
+            self.pid = None
+            os.close(self._read_fd)
+
+        if code != 0:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+            raise IOError("Writing %s in a child process failed with exit code %d: %s" % (self.path, code, error or "no error reported"))
+
+        os.replace(self.tmp_path, self.path)
+        sync_directory(self.path, self.durability)
+
+    def _read_error(self):
+        # Children forked by other threads may hold the pipe open too, so it might never
+        # reach EOF. Only read what the child wrote before it exited.
+        os.set_blocking(self._read_fd, False)
+
+        try:
+            return os.read(self._read_fd, MAX_ERROR_SIZE).decode("utf8", "replace")
+        except BlockingIOError:
+            return ""
+
+    def cancel(self):
+        """Stop the child if it's still running, and remove its temporary file.
+
+        Does nothing once :meth:`wait` has been called.
+        """
+        if self.pid is None:
+            return
+
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+        try:
+            os.waitpid(self.pid, 0)
+        finally:
+            self.pid = None
+            os.close(self._read_fd)
+
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
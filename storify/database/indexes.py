@@ -0,0 +1,375 @@
+import bisect
+
+from ..model import Model
+
+# Index types
+INDEX_HASH = "hash"
+INDEX_SORTED = "sorted"
+
+def field_value(row, field, default=None):
+    """Get the value of a field of a row: an attribute of a model, or an item of a dict.
+
+    :param row: The row
+    :param field: Name of the field
+    :type field: str
+    :param default: Value to return if the row doesn't have the field, or isn't a model or dict
+    :return: The field's value
+    """
+    if isinstance(row, Model):
+        return getattr(row, field, default)
+
+    if isinstance(row, dict):
+        return row.get(field, default)
+
+    return default
+
+class Index:
+    def __init__(self, indexes, field):
+        """Initialize the Index instance.
+
+        An index of the rows of a collection by the value of one of their fields. Rows
+        are the :class:`Model` instances and dicts in the collection; anything else is
+        skipped. Rows without the field are indexed under None.
+
+        :param indexes: The indexes of the collection this index belongs to
+        :type indexes: Indexes
+        :param field: Name of the indexed field
+        :type field: str
+        """
+        self.indexes = indexes
+        self.field = field
+
+        self.clear()
+
+    def clear(self):
+        """Remove every row from the index."""
+        raise NotImplementedError
+
+    def add(self, row, value):
+        """Add a row to the index.
+
+        :param row: The row
+        :type row: Model or dict
+        :param value: The row's value of the indexed field
+        """
+        raise NotImplementedError
+
+    def remove(self, row, value):
+        """Remove a row from the index.
+
+        :param row: The row
+        :type row: Model or dict
+        :param value: The row's value of the indexed field when it was added
+        """
+        raise NotImplementedError
+
+    def _find(self, value):
+        raise NotImplementedError
+
+    def lookup(self, value):
+        """Get the rows whose field equals ``value``.
+
+        :param value: The value to look for
+        :return: The matching rows
+        :rtype: list
+        """
+        with self.indexes.db._lock:
+            self.indexes.ensure()
+
+            return self._find(value)
+
+class HashIndex(Index):
+    """An index for equality lookups."""
+
+    def clear(self):
+        # Rows by value, then by id, which keeps them in insertion order and makes removal cheap
+        self._rows = {}
+
+        # Rows whose value can't be hashed are checked one by one
+        self._unhashable = {}
+
+    def add(self, row, value):
+        try:
+            self._rows.setdefault(value, {})[id(row)] = row
+        except TypeError:
+            self._unhashable[id(row)] = row
+
+    def remove(self, row, value):
+        try:
+            bucket = self._rows.get(value)
+        except TypeError:
+            self._unhashable.pop(id(row), None)
+            return
+
+        if bucket is not None:
+            bucket.pop(id(row), None)
+
+            if not bucket:
+                del self._rows[value]
+
+    def _find(self, value):
+        try:
+            rows = list(self._rows.get(value, {}).values())
+        except TypeError:
+            rows = []
+
+        if self._unhashable:
+            rows += [row for row in self._unhashable.values() if field_value(row, self.field) == value]
+
+        return rows
+
+class SortedIndex(Index):
+    """An index for equality and range lookups, which returns rows ordered by value."""
+
+    def clear(self):
+        # Values in ascending order, and the row each one belongs to
+        self._values = []
+        self._rows = []
+
+        # Rows whose value is None or can't be compared with the others are left out of ranges
+        self._unordered = {}
+
+    def add(self, row, value):
+        if value is None:
+            self._unordered[id(row)] = row
+            return
+
+        try:
+            i = bisect.bisect_right(self._values, value)
+        except TypeError:
+            self._unordered[id(row)] = row
+            return
+
+        self._values.insert(i, value)
+        self._rows.insert(i, row)
+
+    def add_many(self, rows, values):
+        """Add many rows at once, which is faster than adding them one by one.
+
+        :param rows: The rows
+        :type rows: list
+        :param values: Each row's value of the indexed field
+        :type values: list
+        """
+        if self._values or any(value is None for value in values):
+            for row, value in zip(rows, values):
+                self.add(row, value)
+
+            return
+
+        try:
+            order = sorted(range(len(values)), key=values.__getitem__)
+        except TypeError:
+            for row, value in zip(rows, values):
+                self.add(row, value)
+
+            return
+
+        self._values = [values[i] for i in order]
+        self._rows = [rows[i] for i in order]
+
+    def remove(self, row, value):
+        if self._unordered.pop(id(row), None) is not None:
+            return
+
+        try:
+            start = bisect.bisect_left(self._values, value)
+            end = bisect.bisect_right(self._values, value)
+        except TypeError:
+            return
+
+        for i in range(start, end):
+            if self._rows[i] is row:
+                del self._values[i]
+                del self._rows[i]
+                return
+
+    def _find(self, value):
+        try:
+            rows = self._rows[bisect.bisect_left(self._values, value):bisect.bisect_right(self._values, value)]
+        except TypeError:
+            rows = []
+
+        if self._unordered:
+            rows += [row for row in self._unordered.values() if field_value(row, self.field) == value]
+
+        return rows
+
+    def range(self, low=None, high=None, include_low=True, include_high=True):
+        """Get the rows whose field is between ``low`` and ``high``, ordered by value.
+
+        Rows whose value is None, or can't be compared with the other values, are never included.
+
+        :param low: Lower bound, or None for no lower bound
+        :param high: Upper bound, or None for no upper bound
+        :param include_low: Whether rows equal to ``low`` are included
+        :type include_low: bool
+        :default include_low: True
+        :param include_high: Whether rows equal to ``high`` are included
+        :type include_high: bool
+        :default include_high: True
+        :return: The matching rows
+        :rtype: list
+        :raises TypeError: If a bound can't be compared with the indexed values
+        """
+        with self.indexes.db._lock:
+            self.indexes.ensure()
+
+            start, end = self._bounds(low, high, include_low, include_high)
+
+            return self._rows[start:end]
+
+    def _bounds(self, low, high, include_low, include_high):
+        # Positions of the first matching value and just past the last one
+        start = 0
+        end = len(self._values)
+
+        if low is not None:
+            start = (bisect.bisect_left if include_low else bisect.bisect_right)(self._values, low)
+
+        if high is not None:
+            end = (bisect.bisect_right if include_high else bisect.bisect_left)(self._values, high)
+
+        return start, max(start, end)
+
+INDEX_TYPES = {
+    INDEX_HASH: HashIndex,
+    INDEX_SORTED: SortedIndex
+}
+
+class Indexes:
+    def __init__(self, db, key):
+        """Initialize the Indexes instance.
+
+        The indexes of one collection: a top-level list or dict of models or dicts in a database.
+        Indexes are built from the collection the first time they're used, and kept up to
+        date as rows are added, removed or have an indexed field assigned. Replacing the
+        whole collection, or reloading the database, rebuilds them on next use.
+
+        :param db: Database holding the collection
+        :type db: Database
+        :param key: Top-level key of the collection
+        :type key: str
+        """
+        self.db = db
+        self.key = key
+
+        # Indexes by field name
+        self.fields = {}
+
+        # Set when the indexes no longer match the collection and have to be rebuilt
+        self.stale = True
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def get(self, field):
+        """Get the index of a field.
+
+        :param field: Name of the field
+        :type field: str
+        :return: The index, or None if the field isn't indexed
+        :rtype: Index
+        """
+        return self.fields.get(field)
+
+    def add(self, field, kind):
+        """Add an index on a field.
+
+        :param field: Name of the field
+        :type field: str
+        :param kind: ``"hash"`` or ``"sorted"``
+        :type kind: str
+        :return: The index
+        :rtype: Index
+        """
+        index = self.fields[field] = INDEX_TYPES[kind](self, field)
+
+        # Built with the others on next use
+        self.stale = True
+
+        return index
+
+    def invalidate(self):
+        """Mark the indexes for rebuilding on next use."""
+        self.stale = True
+
+        for index in self.fields.values():
+            index.clear()
+
+    def ensure(self):
+        """Rebuild the indexes if they're stale. Called with the database's lock held."""
+        if not self.stale:
+            return
+
+        rows = self.rows()
+
+        for field, index in self.fields.items():
+            index.clear()
+            values = [field_value(row, field) for row in rows]
+
+            if isinstance(index, SortedIndex):
+                index.add_many(rows, values)
+            else:
+                for row, value in zip(rows, values):
+                    index.add(row, value)
+
+        self.stale = False
+
+    def rows(self):
+        """Get the rows of the collection.
+
+        :return: The models and dicts in the collection, or an empty list if it doesn't exist
+        :rtype: list
+        """
+        if self.key not in self.db:
+            return []
+
+        collection = self.db[self.key]
+
+        if isinstance(collection, dict):
+            collection = collection.values()
+        elif not isinstance(collection, list):
+            return []
+
+        return [row for row in collection if isinstance(row, (Model, dict))]
+
+    def rows_changed(self, added, removed):
+        """Update the indexes after rows were added to or removed from the collection.
+
+        :param added: Rows that were added
+        :param removed: Rows that were removed
+        """
+        if self.stale:
+            return
+
+        for row in removed:
+            if isinstance(row, (Model, dict)):
+                for field, index in self.fields.items():
+                    index.remove(row, field_value(row, field))
+
+        for row in added:
+            if isinstance(row, (Model, dict)):
+                for field, index in self.fields.items():
+                    index.add(row, field_value(row, field))
+
+    def field_changed(self, row, field, old, new):
+        """Update the indexes after a field of a row was assigned or removed.
+
+        :param row: The row
+        :type row: Model or dict
+        :param field: Name of the field
+        :type field: str
+        :param old: The field's previous value
+        :param new: The field's new value, None if it was removed
+        """
+        index = self.fields.get(field)
+
+        if index is None or self.stale:
+            return
+
+        index.remove(row, old)
+        index.add(row, new)
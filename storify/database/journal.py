@@ -0,0 +1,357 @@
+import os
+import msgpack
+
+from .storage import sync_file, sync_directory
+from .locking import ACCESS_READER
+from .lazy import LazyValue
+from ..model import Model
+from ..tracking import Trackable, Binding, adopt, SET, DELETE, APPEND, EXTEND, INSERT, REPLACE
+
+_MISSING = object()
+
+# Positions of children in their containers are remembered, up to this many
+MAX_POSITIONS = 1 << 20
+
+class Journal:
+    def __init__(self, db, max_size=16 * 1024 * 1024):
+        """Initialize the Journal instance.
+
+        The journal is an append-only log of changes made since the last full snapshot
+        of the database. Each flush appends one record: a list of ``[op, path, *args]``
+        entries, see :class:`Changes`. A record that was only partially written (e.g.
+        because of a crash) is discarded as a whole when replaying.
+
+        :param db: Database instance to keep a journal for
+        :type db: Database
+        :param max_size: Size in bytes after which the database should be snapshotted instead
+        :type max_size: int
+        :default max_size: 16 MiB
+        """
+        self.db = db
+        self.max_size = max_size
+
+    @property
+    def path(self):
+        """Get the path to the journal file.
+
+        :return: Full path to the journal file
+        :rtype: str
+        """
+        return self.db.path + ".wal"
+
+    @property
+    def size(self):
+        """Get the size of the journal file.
+
+        :return: Size in bytes, or 0 if there is no journal
+        :rtype: int
+        """
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    @property
+    def full(self):
+        """Whether the journal has grown past ``max_size``.
+
+        :rtype: bool
+        """
+        return self.size >= self.max_size
+
+    def append(self, snapshot, entries, keys):
+        """Append a record of changes to the journal.
+
+        :param snapshot: Snapshot of the database to take the values of ``keys`` from
+        :type snapshot: Snapshot
+        :param entries: Serialized changes, from :meth:`Changes.take`
+        :type entries: list
+        :param keys: Top-level keys whose whole value is written, or deleted if they no longer exist
+        :type keys: set
+        """
+        if not entries and not keys:
+            return
+
+        packer = snapshot.packer
+        chunks = [packer.pack_array_header(len(entries) + len(keys))]
+        chunks.extend(entries)
+
+        for key in keys:
+            if key in snapshot.data:
+                chunks.append(packer.pack_array_header(4))
+                chunks.append(packer.pack(SET))
+                chunks.append(packer.pack([]))
+                chunks.append(packer.pack(key))
+                chunks.append(snapshot.pack_value(key))
+            else:
+                chunks.append(packer.pack([DELETE, [], key]))
+
+        created = not os.path.exists(self.path)
+
+        with open(self.path, "ab") as f:
+            f.write(b"".join(chunks))
+            sync_file(f, self.db.durability)
+
+        if created:
+            sync_directory(self.path, self.db.durability)
+
+    def replay(self, data, legacy=False):
+        """Apply the journal on top of ``data``.
+
+        If the journal ends in a partial or corrupted record, the journal is truncated
+        to the last good record so that new records can be appended after it. Databases
+        opened with ``access="reader"`` leave that to the writer.
+
+        :param data: The top-level data loaded from the last snapshot
+        :type data: dict
+        :param legacy: Whether the snapshot has no header, so bytes are decoded to str where they can be
+        :type legacy: bool
+        :return: The number of records that were replayed
+        :rtype: int
+        """
+        if not os.path.exists(self.path):
+            return 0
+
+        records = 0
+        good_offset = 0
+
+        with open(self.path, "rb") as f:
+            unpacker = msgpack.Unpacker(f, **self.db._unpack_options(legacy=legacy))
+
+            try:
+                for record in unpacker:
+                    for entry in record:
+                        self._apply(data, entry)
+
+                    records += 1
+                    good_offset = unpacker.tell()
+            except Exception:
+                self.db.log.traceback("Journal for db `%s` is corrupted after record %d" % (self.db.name, records))
+
+        if good_offset < self.size and self.db.access != ACCESS_READER:
+            self.db.log.warning("Discarding incomplete journal record for db `%s`" % self.db.name)
+
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+
+        return records
+
+    def _apply(self, data, entry):
+        op, path = entry[0], entry[1]
+
+        # Records of earlier versions only had [op, key, value] entries for top-level keys
+        if not isinstance(path, list):
+            path, entry = [], [op, [], *entry[1:]]
+
+        container = data
+
+        for key in path:
+            container = self._child(container, key)
+
+        args = entry[2:]
+
+        # Applied to the containers directly; nothing is bound to the database while it's loading
+        if op == SET:
+            key, value = args
+
+            if isinstance(container, Model):
+                object.__setattr__(container, key, value)
+            elif isinstance(container, dict):
+                dict.__setitem__(container, key, value)
+            else:
+                list.__setitem__(container, key, value)
+
+            values = (value,)
+        elif op == DELETE:
+            if isinstance(container, Model):
+                if hasattr(container, args[0]):
+                    object.__delattr__(container, args[0])
+            elif isinstance(container, dict):
+                dict.pop(container, args[0], None)
+            else:
+                list.__delitem__(container, args[0])
+
+            values = ()
+        elif op == APPEND:
+            list.append(container, args[0])
+            values = args
+        elif op == EXTEND:
+            list.extend(container, args[0])
+            values = args[0]
+        elif op == INSERT:
+            list.insert(container, args[0], args[1])
+            values = args[1:]
+        elif op == REPLACE:
+            if isinstance(container, dict):
+                dict.clear(container)
+                dict.update(container, args[0])
+                values = dict.values(args[0])
+            else:
+                list.__setitem__(container, slice(None), args[0])
+                values = args[0]
+        else:
+            raise ValueError("Unknown journal operation %r" % op)
+
+        if path:
+            adopt(container, values)
+        else:
+            # Top-level values are bound to the database when they're accessed
+            for value in values:
+                if isinstance(value, Trackable):
+                    object.__setattr__(value, "_storify_parent", None)
+
+    def _child(self, container, key):
+        if isinstance(container, Model):
+            return getattr(container, key)
+
+        value = container[key]
+
+        # A top-level value of a lazily loaded database is decoded before it's changed
+        if type(value) is LazyValue:
+            value = container[key] = self.db._decode_lazy(value)
+
+        return value
+
+    def reset(self):
+        """Remove the journal, after its changes have been written to a snapshot."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+            sync_directory(self.path, self.db.durability)
+
+class Changes:
+    def __init__(self, db):
+        """Initialize the Changes instance.
+
+        The changes made to a journaled database since its last flush, recorded as they're
+        made, so that a journal record holds only what changed instead of whole top-level
+        values. Tracked containers and models describe each change once it's applied, and
+        it's kept as an entry ``[op, path, *args]``, where ``path`` leads from the top level
+        to the container (list indexes, dict keys and model attribute names). Entries are
+        serialized straight away, since their values can change afterwards.
+
+        Keys that were replaced, deleted or changed in a way that isn't described, such as
+        by a rolled back transaction, are written whole by the next flush instead.
+
+        :param db: The journaled database
+        :type db: Database
+        """
+        self.db = db
+
+        # (top-level key, serialized entry) in the order the changes were made
+        self.entries = []
+
+        # Top-level keys written whole on the next flush
+        self.whole = set()
+
+        # Recording happens with the database's lock held, so one packer is enough
+        self._packer = msgpack.Packer(default=db.encode_type)
+
+        # Last known key or index of each tracked value in its container, by id
+        self._positions = {}
+
+    def record(self, key, container, op, args):
+        """Record a change to a container or model stored under a top-level key.
+
+        Called with the database's lock held.
+
+        :param key: The top-level key
+        :param container: The tracked container or model that changed
+        :param op: The operation, see :mod:`storify.tracking`
+        :param args: The operation's arguments
+        :type args: tuple
+        """
+        if key in self.whole:
+            return
+
+        try:
+            path = self._path(container)
+
+            if op == REPLACE and len(path) == 1:
+                # A top-level value replaced in place is as big as the whole value, which is only written once
+                self.whole.add(key)
+                return
+
+            entry = self._packer.pack([op, path, *args])
+        except Exception:
+            # Such as a value msgpack can't serialize, which the flush reports when it writes the whole value
+            self.whole.add(key)
+            return
+
+        self.entries.append((key, entry))
+
+    def take(self, keys):
+        """Get the changes to write in a journal record, and start recording anew.
+
+        :param keys: Top-level keys that changed since the last flush
+        :type keys: set
+        :return: The serialized entries, and the top-level keys to write whole: those marked
+            as such, and changed keys without any recorded entries
+        :rtype: tuple
+        """
+        recorded = set()
+        entries = []
+
+        for key, entry in self.entries:
+            if key not in self.whole:
+                recorded.add(key)
+                entries.append(entry)
+
+        whole = self.whole | (keys - recorded)
+        self.clear()
+
+        return entries, whole
+
+    def clear(self):
+        """Forget the recorded changes, once a snapshot holds them."""
+        self.entries = []
+        self.whole = set()
+
+    def _path(self, node):
+        path = []
+        parent = node._storify_parent
+
+        while type(parent) is not Binding:
+            path.append(self._position(parent, node))
+            node = parent
+            parent = node._storify_parent
+
+        path.append(parent.key)
+        path.reverse()
+
+        return path
+
+    def _position(self, parent, child):
+        # The key or index of child in parent, checked against what was found last time
+        known = self._positions.get(id(child), _MISSING)
+
+        if isinstance(parent, list):
+            if type(known) is int and known < len(parent) and list.__getitem__(parent, known) is child:
+                return known
+        elif isinstance(parent, dict):
+            if known is not _MISSING and dict.get(parent, known, _MISSING) is child:
+                return known
+        else:
+            # A model, with just a few attributes
+            for name, value in parent._storify_items():
+                if value is child:
+                    return name
+
+            raise LookupError("Value not found in its parent")
+
+        # Remember where everything in the container is, so changing other values finds them straight away
+        if len(self._positions) > MAX_POSITIONS:
+            self._positions.clear()
+
+        found = _MISSING
+
+        for position, value in parent._storify_items():
+            if isinstance(value, Trackable):
+                self._positions[id(value)] = position
+
+                if value is child:
+                    found = position
+
+        if found is _MISSING:
+            raise LookupError("Value not found in its parent")
+
+        return found
@@ -0,0 +1,156 @@
+import mmap
+import msgpack
+
+class LazyValue:
+    __slots__ = ("buffer", "start", "end", "schema", "legacy")
+
+    def __init__(self, buffer, start, end, schema=None, legacy=False):
+        """Initialize the LazyValue instance.
+
+        A top-level value of a lazily loaded database that hasn't been decoded yet.
+        It refers to the value's msgpack encoding in the memory-mapped database file.
+
+        :param buffer: The memory-mapped file
+        :type buffer: mmap.mmap
+        :param start: Offset of the encoded value
+        :type start: int
+        :param end: Offset just past the end of the encoded value
+        :type end: int
+        :param schema: Schema from the file header, for models stored with the ``"ext"`` encoding
+        :type schema: ModelSchema, optional
+        :param legacy: Whether the file has no header, so bytes are decoded to str where they can be
+        :type legacy: bool
+        """
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.schema = schema
+        self.legacy = legacy
+
+    def raw(self):
+        """Get the value's msgpack encoding.
+
+        :rtype: bytes
+        """
+        return self.buffer[self.start:self.end]
+
+    def splices_into(self, schema):
+        """Whether the encoding can be copied as-is into a file written with ``schema``.
+
+        Models stored with the ``"ext"`` encoding refer to layouts by id, so they can
+        only be copied into a file whose schema starts with the same layouts.
+
+        :param schema: Schema of the file being written, or None if it has no schema
+        :type schema: ModelSchema
+        :rtype: bool
+        """
+        if self.schema is None or not self.schema.layouts:
+            return True
+
+        return schema is not None and schema.layouts[:len(self.schema.layouts)] == self.schema.layouts
+
+def map_file(path):
+    """Memory-map a file for reading.
+
+    :param path: Path of the file
+    :type path: str
+    :return: The memory-mapped file, or None if the file is empty
+    :rtype: mmap.mmap
+    """
+    with open(path, "rb") as f:
+        if not f.seek(0, 2):
+            return None
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def index_map(buffer, offset=0, schema=None, legacy=False):
+    """Build an index of the top-level map in a memory-mapped database file.
+
+    Keys are decoded, and values are skipped over without being decoded.
+
+    :param buffer: The memory-mapped file
+    :type buffer: mmap.mmap
+    :param offset: Offset of the top-level map, after any file header
+    :type offset: int
+    :param schema: Schema from the file header
+    :type schema: ModelSchema, optional
+    :param legacy: Whether the file has no header
+    :type legacy: bool
+    :return: Mapping of each top-level key to a LazyValue
+    :rtype: dict
+    :raises ValueError: If the top level isn't a map
+    """
+    buffer.seek(offset)
+    unpacker = msgpack.Unpacker(buffer, max_buffer_size=max(len(buffer), 1024 * 1024))
+
+    data = {}
+
+    for i in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+
+        if isinstance(key, bytes):
+            key = key.decode("utf8")
+
+        start = offset + unpacker.tell()
+
+        unpacker.skip()
+        data[key] = LazyValue(buffer, start, offset + unpacker.tell(), schema, legacy)
+
+    return data
+
+class _BufferReader:
+    # A file-like view of part of a buffer, so an Unpacker can stream it a piece at a time
+    def __init__(self, buffer, start, end):
+        self.view = memoryview(buffer)[start:end]
+        self.position = 0
+
+    def read(self, size):
+        chunk = self.view[self.position:self.position + size]
+        self.position += len(chunk)
+
+        return bytes(chunk)
+
+    def release(self):
+        self.view.release()
+
+def iter_container(buffer, start, end, options):
+    """Decode the entries of an encoded map or array one at a time.
+
+    Only one entry is decoded at once, and nothing is kept, so large collections can be
+    read without building all of them in memory.
+
+    :param buffer: Buffer holding the encoding, such as a memory-mapped file
+    :param start: Offset of the encoded map or array
+    :type start: int
+    :param end: Offset just past its end
+    :type end: int
+    :param options: Keyword arguments for the msgpack Unpacker
+    :type options: dict
+    :return: Generator of ``(key, value)`` pairs; keys of an array are the positions of its items
+    :rtype: generator
+    :raises ValueError: If the encoding isn't a map or an array
+    """
+    reader = _BufferReader(buffer, start, end)
+
+    try:
+        if not len(reader.view):
+            return
+
+        unpacker = msgpack.Unpacker(reader, read_size=1024 * 1024, max_buffer_size=max(end - start, 1024 * 1024), **options)
+        kind = reader.view[0]
+
+        if 0x80 <= kind <= 0x8f or kind in (0xde, 0xdf):
+            for i in range(unpacker.read_map_header()):
+                key = unpacker.unpack()
+
+                if isinstance(key, bytes):
+                    key = key.decode("utf8")
+
+                yield key, unpacker.unpack()
+        elif 0x90 <= kind <= 0x9f or kind in (0xdc, 0xdd):
+            for i in range(unpacker.read_array_header()):
+                yield i, unpacker.unpack()
+        else:
+            raise ValueError("Expected an encoded map or array")
+    finally:
+        reader.release()
@@ -0,0 +1,102 @@
+import os
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ..exceptions import DatabaseLockedError
+
+# Only this process uses the database's files, so nothing is locked
+ACCESS_PRIVATE = "private"
+# This process is the only one writing the database; other processes may read it
+ACCESS_WRITER = "writer"
+# This process only reads the database, and reloads it when the writer changes it
+ACCESS_READER = "reader"
+
+ACCESS_MODES = (ACCESS_PRIVATE, ACCESS_WRITER, ACCESS_READER)
+
+def can_lock():
+    """Whether this platform has advisory file locks (POSIX only).
+
+    :rtype: bool
+    """
+    return fcntl is not None
+
+def file_signature(path):
+    """Get a cheap fingerprint of a file, which changes whenever the file is replaced or appended to.
+
+    :param path: Path of the file
+    :type path: str
+    :return: The file's inode, size and modification time, or None if it doesn't exist
+    :rtype: tuple
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+class FileLock:
+    def __init__(self, path):
+        """Initialize the FileLock instance.
+
+        An advisory lock shared between processes, held on ``path`` with ``flock``. The
+        database files themselves are replaced on every flush, so locks are taken on a
+        separate file next to them, which is created when first needed and never removed.
+
+        Each acquisition opens its own file descriptor, so threads of one process wait for
+        each other the same way processes do.
+
+        :param path: Path of the lock file
+        :type path: str
+        """
+        self.path = path
+
+    def _open(self):
+        return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextlib.contextmanager
+    def shared(self):
+        """Hold the lock together with other readers, for as long as the context lasts."""
+        with self._hold(fcntl.LOCK_SH):
+            yield
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Hold the lock alone, for as long as the context lasts."""
+        with self._hold(fcntl.LOCK_EX):
+            yield
+
+    @contextlib.contextmanager
+    def _hold(self, operation):
+        fd = self._open()
+
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def claim(self):
+        """Take the lock alone without waiting for it, until the returned descriptor is closed.
+
+        :return: The file descriptor holding the lock
+        :rtype: int
+        :raises DatabaseLockedError: If another process, or another database in this one, holds the lock
+        """
+        fd = self._open()
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise DatabaseLockedError("%s is locked by another writer" % self.path)
+        except:
+            os.close(fd)
+            raise
+
+        return fd
@@ -0,0 +1,63 @@
+import sys
+import itertools
+
+from ..model import Model, SlotModel
+
+# Number of items of a container that are measured; the size of the rest is extrapolated from them
+DEFAULT_SAMPLE = 64
+
+_SCALARS = (str, bytes, bytearray, int, float, bool, type(None))
+
+def estimate_size(value, sample=DEFAULT_SAMPLE):
+    """Estimate the memory held by a value and everything it contains, in bytes.
+
+    Containers with more than ``sample`` items are sized from an evenly spaced sample of
+    their items, so the cost stays bounded for large values. Objects shared between
+    values are counted each time they appear, and values of a lazily loaded database
+    that haven't been decoded only count the small object that refers to the file.
+
+    :param value: The value to measure
+    :param sample: Maximum number of items of each container to measure
+    :type sample: int
+    :default sample: 64
+    :return: Estimated size in bytes
+    :rtype: int
+    """
+    size = sys.getsizeof(value)
+
+    if isinstance(value, _SCALARS):
+        return size
+
+    if isinstance(value, dict):
+        return size + _estimate_items(value.items(), len(value), sample, pairs=True)
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + _estimate_items(value, len(value), sample)
+
+    if isinstance(value, SlotModel):
+        return size + _estimate_items(value._field_values(), len(value._fields), sample)
+
+    if isinstance(value, Model) and hasattr(value, "__dict__"):
+        fields = value.__dict__
+        return size + sys.getsizeof(fields) + _estimate_items(fields.items(), len(fields), sample, pairs=True)
+
+    return size
+
+def _estimate_items(items, count, sample, pairs=False):
+    if not count:
+        return 0
+
+    step = max(count // sample, 1)
+    measured = 0
+    total = 0
+
+    for item in itertools.islice(items, 0, None, step):
+        if pairs:
+            # The key and value of a dict item; the tuple itself isn't stored
+            total += estimate_size(item[0], sample) + estimate_size(item[1], sample)
+        else:
+            total += estimate_size(item, sample)
+
+        measured += 1
+
+    return total * count // measured
@@ -0,0 +1,252 @@
+import operator
+
+from .indexes import SortedIndex, field_value
+
+_MISSING = object()
+
+def _contains(container, value):
+    return value in container
+
+def _within(value, container):
+    return value in container
+
+OPERATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": _within,
+    "contains": _contains
+}
+
+def _field(row, field):
+    # The value of a field of a row, or _MISSING
+    return field_value(row, field, _MISSING)
+
+class Query:
+    def __init__(self, db, key=None):
+        """Initialize the Query instance.
+
+        A query over the rows of a collection: the models or dicts in the top-level list
+        or dict stored under ``key``, or the top-level values of the database if ``key`` is
+        None. Queries are built by chaining :meth:`where`, :meth:`only` and :meth:`limit`,
+        which each return a new query, and are run by iterating over them. Rows are
+        produced one at a time as they're found.
+
+        Equality, ``in`` and range conditions on indexed fields are answered from the
+        index, in the index's order. Otherwise rows come in collection order, and a
+        collection that a lazily loaded database hasn't decoded yet, or a shard that hasn't
+        been read, is decoded one row at a time without keeping it in memory. Such rows are
+        copies, so changes made to them aren't saved.
+
+        :param db: The database to query
+        :type db: Database
+        :param key: Top-level key of the collection, or None for the whole database
+        :type key: str
+        """
+        self.db = db
+        self.key = key
+
+        self.conditions = ()
+        self.fields = None
+        self.count = None
+
+    def _copy(self, **changes):
+        query = Query(self.db, self.key)
+        query.conditions = self.conditions
+        query.fields = self.fields
+        query.count = self.count
+        query.__dict__.update(changes)
+
+        return query
+
+    def where(self, **conditions):
+        """Only include rows matching all of the conditions.
+
+        Conditions are written ``field=value`` for equality, or ``field__op=value`` with an
+        operator: ``eq``, ``ne``, ``gt``, ``gte``, ``lt``, ``lte``, ``in`` (the field's value is
+        in ``value``) or ``contains`` (``value`` is in the field's value). Rows without the
+        field, or whose value can't be compared with ``value``, don't match.
+
+        :param conditions: The conditions
+        :return: A new query
+        :rtype: Query
+        :raises ValueError: If an operator is unknown
+        """
+        parsed = []
+
+        for name, value in conditions.items():
+            field, _, op = name.partition("__")
+            op = op or "eq"
+
+            if op not in OPERATORS:
+                raise ValueError("Unknown query operator %r in %r, expected one of %s" % (op, name, ", ".join(OPERATORS)))
+
+            # Values of an "in" condition are read more than once
+            if op == "in" and hasattr(value, "__next__"):
+                value = tuple(value)
+
+            parsed.append((field, op, value))
+
+        return self._copy(conditions=self.conditions + tuple(parsed))
+
+    def only(self, *fields):
+        """Produce dicts of just these fields of each row, instead of the rows themselves.
+
+        Fields a row doesn't have are None.
+
+        :param fields: Names of the fields
+        :return: A new query
+        :rtype: Query
+        """
+        return self._copy(fields=fields)
+
+    def limit(self, count):
+        """Stop after ``count`` rows.
+
+        :param count: Maximum number of rows
+        :type count: int
+        :return: A new query
+        :rtype: Query
+        """
+        return self._copy(count=count)
+
+    def first(self):
+        """Get the first matching row.
+
+        :return: The row, or None if no row matches
+        """
+        for row in self.limit(1):
+            return row
+
+        return None
+
+    def explain(self):
+        """Describe how the query finds its rows.
+
+        :return: ``"index <field> (<op>)"`` when an index is used, otherwise ``"scan"``
+        :rtype: str
+        """
+        plan = self._plan()
+
+        if plan is None:
+            return "scan"
+
+        return "index %s (%s)" % (plan[0], plan[1])
+
+    def __iter__(self):
+        if self.count is not None and self.count <= 0:
+            return
+
+        produced = 0
+
+        for row in self._candidates():
+            if not self._matches(row):
+                continue
+
+            if self.fields is not None:
+                yield {field: self._value(row, field) for field in self.fields}
+            else:
+                yield row
+
+            produced += 1
+
+            if self.count is not None and produced >= self.count:
+                return
+
+    def _value(self, row, field):
+        value = _field(row, field)
+
+        return None if value is _MISSING else value
+
+    def _matches(self, row):
+        for field, op, expected in self.conditions:
+            value = _field(row, field)
+
+            if value is _MISSING:
+                return False
+
+            try:
+                if not OPERATORS[op](value, expected):
+                    return False
+            except TypeError:
+                return False
+
+        return True
+
+    def _plan(self):
+        # Pick an index that narrows down the rows: the field, the operator and a function getting the rows
+        indexes = self.db.indexes.get(self.key) if self.key is not None else None
+
+        if not indexes:
+            return None
+
+        # Equality narrows down the rows the most, so it's tried first
+        for field, op, value in self.conditions:
+            index = indexes.get(field)
+
+            if index is None:
+                continue
+
+            if op == "eq":
+                return field, op, lambda: index.lookup(value)
+
+            if op == "in":
+                return field, op, lambda: self._lookup_many(index, value)
+
+        for field, op, value in self.conditions:
+            index = indexes.get(field)
+
+            if isinstance(index, SortedIndex) and op in ("gt", "gte", "lt", "lte"):
+                return field, "range", lambda: self._range(index, field)
+
+        return None
+
+    def _lookup_many(self, index, values):
+        rows = {}
+
+        for value in values:
+            for row in index.lookup(value):
+                rows[id(row)] = row
+
+        return list(rows.values())
+
+    def _range(self, index, field):
+        # Combine every range condition on the field into one lookup
+        low = high = None
+        include_low = include_high = True
+
+        for name, op, value in self.conditions:
+            if name != field:
+                continue
+
+            if op in ("gt", "gte"):
+                if low is None or value > low:
+                    low, include_low = value, op == "gte"
+                elif value == low:
+                    include_low = include_low and op == "gte"
+            elif op in ("lt", "lte"):
+                if high is None or value < high:
+                    high, include_high = value, op == "lte"
+                elif value == high:
+                    include_high = include_high and op == "lte"
+
+        return index.range(low, high, include_low, include_high)
+
+    def _candidates(self):
+        plan = self._plan()
+
+        if plan is not None:
+            try:
+                # Every condition is still checked against the rows the index returns
+                return iter(plan[2]())
+            except TypeError:
+                # A bound that can't be compared with the indexed values
+                pass
+
+        if self.key is None:
+            return self.db._iter_values()
+
+        return self.db._iter_collection(self.key)
@@ -0,0 +1,177 @@
+import os
+import zlib
+import msgpack
+
+from ..exceptions import DatabaseLoadError
+from .snapshot import Snapshot
+from .storage import atomic_write
+
+class Shards:
+    def __init__(self, db, count):
+        """Initialize the Shards instance.
+
+        A sharded database spreads its top-level keys over ``count`` files in the
+        ``<root>/<name>/`` directory, by a hash of the key. Shards are read the first
+        time one of their keys is accessed, and a flush only rewrites the shards that
+        contain changed keys.
+
+        :param db: Database instance to store in shards
+        :type db: Database
+        :param count: Number of shards. Can't be changed once the database has been written.
+        :type count: int
+        :raises ValueError: If count is not a positive integer
+        """
+        if not isinstance(count, int) or count < 1:
+            raise ValueError("The number of shards must be a positive integer, got %r" % (count,))
+
+        self.db = db
+        self.count = count
+
+        # Shards that have been read into db.data, and the top-level keys in each of them
+        self.loaded = set()
+        self.keys = [set() for i in range(count)]
+
+    @property
+    def directory(self):
+        """Get the path to the directory holding the shard files.
+
+        :return: Full path to the shard directory
+        :rtype: str
+        """
+        return os.path.splitext(self.db.path)[0]
+
+    @property
+    def manifest_path(self):
+        """Get the path to the manifest, which records the number of shards.
+
+        :return: Full path to the manifest file
+        :rtype: str
+        """
+        return os.path.join(self.directory, "manifest")
+
+    def path(self, index):
+        """Get the path to a shard file.
+
+        :param index: Index of the shard
+        :type index: int
+        :return: Full path to the shard file
+        :rtype: str
+        """
+        return os.path.join(self.directory, "%d.mpack" % index)
+
+    def index_of(self, key):
+        """Get the index of the shard that holds ``key``.
+
+        :param key: A top-level key
+        :type key: str or bytes
+        :rtype: int
+        """
+        if isinstance(key, str):
+            key = key.encode("utf8")
+
+        return zlib.crc32(key) % self.count
+
+    def open(self, rootdata):
+        """Open the shard directory, or create it for a new database.
+
+        :param rootdata: Initial data for a new database
+        :type rootdata: dict
+        :raises ValueError: If the database was written with a different number of shards
+        """
+        db = self.db
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "rb") as f:
+                manifest = msgpack.unpackb(f.read())
+
+            if manifest["shards"] != self.count:
+                raise ValueError("Database '%s' has %d shards, not %d" % (db.name, manifest["shards"], self.count))
+
+            db.data = {}
+            return
+
+        if not isinstance(rootdata, dict):
+            raise ValueError("The root of a sharded database must be a dict")
+
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(self.manifest_path, [msgpack.packb({"shards": self.count})], db.durability)
+
+        # Every shard of a new database is empty, so they all count as loaded
+        db.data = dict(rootdata)
+        self.loaded = set(range(self.count))
+
+        for key in db.data:
+            self.keys[self.index_of(key)].add(key)
+
+    def load(self, index):
+        """Read a shard into the database, unless it has already been read.
+
+        Called by the database with its lock held.
+
+        :param index: Index of the shard
+        :type index: int
+        :raises DatabaseLoadError: If the shard file can't be read
+        """
+        if index in self.loaded:
+            return
+
+        path = self.path(index)
+
+        if os.path.exists(path):
+            try:
+                data = self.db.unpack(path)
+            except Exception:
+                self.db.log.traceback("Shard %d of database '%s' is corrupted" % (index, self.db.name))
+                raise DatabaseLoadError("Could not load shard %d of db:%s" % (index, self.db.name))
+
+            self.db.data.update(data)
+            self.keys[index] = set(data)
+
+        self.loaded.add(index)
+
+    def load_key(self, key):
+        """Read the shard that holds ``key``.
+
+        :param key: A top-level key
+        :type key: str or bytes
+        :return: Index of the shard
+        :rtype: int
+        """
+        index = self.index_of(key)
+        self.load(index)
+
+        return index
+
+    def load_all(self):
+        """Read every shard that hasn't been read yet."""
+        for index in range(self.count):
+            self.load(index)
+
+    def write(self, index, schema=None):
+        """Write a shard to disk.
+
+        :param index: Index of the shard
+        :type index: int
+        :param schema: Schema to write models with, for the ``"ext"`` model encoding
+        :type schema: ModelSchema, optional
+        """
+        db = self.db
+
+        with db._lock:
+            snapshot = Snapshot(db, self.keys[index], schema)
+            forked = db._fork_write(self.path(index), snapshot, schema)
+
+            if forked is None:
+                db._snapshot = snapshot
+
+        try:
+            if forked is not None:
+                forked.wait()
+            else:
+                atomic_write(self.path(index), db._serialize(snapshot, schema), db.durability)
+        finally:
+            if forked is not None:
+                forked.cancel()
+
+            with db._lock:
+                db._snapshot = None
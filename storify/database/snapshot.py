@@ -0,0 +1,110 @@
+import threading
+import msgpack
+
+from .lazy import LazyValue
+
+class Snapshot:
+    def __init__(self, db, keys=None, schema=None):
+        """Initialize the Snapshot instance.
+
+        A snapshot is a point-in-time view of a database's top-level data that can be
+        serialized while other threads keep writing to the database. Taking it only copies
+        the top level. Values are serialized one top-level key at a time; when a writer is
+        about to change a value that hasn't been serialized yet, the database calls
+        :meth:`preserve` first, which serializes the old value on the writer's thread.
+
+        Must be created while holding the database's lock.
+
+        :param db: Database instance to take a snapshot of
+        :type db: Database
+        :param keys: Top-level keys to serialize, defaults to all of them. Only these keys are copied.
+        :type keys: iterable, optional
+        :param schema: Schema to write models with, for the ``"ext"`` model encoding
+        :type schema: ModelSchema, optional
+        """
+        self.db = db
+        self.generation = db.generation
+
+        if not isinstance(db.data, dict):
+            self.data = list(db.data)
+        elif keys is None:
+            self.data = dict(db.data)
+        else:
+            self.data = {key: db.data[key] for key in keys if key in db.data}
+
+        self.pending = set(self.data) if isinstance(self.data, dict) else set()
+        self.preserved = {}
+        self.current = None
+        self.schema = schema
+
+        self._cond = threading.Condition(db._lock)
+
+        # Packers aren't thread-safe: one for the serializing thread, one for writers
+        default = schema.default if schema is not None else db.encode_type
+
+        self.packer = msgpack.Packer(default=default)
+        self._preserve_packer = msgpack.Packer(default=default)
+
+    def preserve(self, key):
+        """Serialize the current value of ``key`` before a writer changes it.
+
+        Called by the database with its lock held.
+
+        :param key: The top-level key that is about to change
+        """
+        while self.current == key:
+            self._cond.wait()
+
+        if key in self.pending:
+            self.pending.discard(key)
+            self.preserved[key] = self._pack(self._preserve_packer, self.data[key])
+
+    def _pack(self, packer, value):
+        # Values of a lazily loaded database that were never decoded are copied as they are
+        if isinstance(value, LazyValue):
+            if value.splices_into(self.schema):
+                return value.raw()
+
+            value = self.db._decode_lazy(value)
+
+        return packer.pack(value)
+
+    def pack_value(self, key):
+        """Serialize the value of ``key`` as it was when the snapshot was taken.
+
+        :param key: The top-level key to serialize
+        :return: The msgpack encoded value
+        :rtype: bytes
+        """
+        with self._cond:
+            if key in self.preserved:
+                return self.preserved.pop(key)
+
+            self.current = key
+
+        try:
+            return self._pack(self.packer, self.data[key])
+        finally:
+            with self._cond:
+                self.current = None
+                self.pending.discard(key)
+                self._cond.notify_all()
+
+    def chunks(self):
+        """Serialize the whole snapshot.
+
+        :return: Generator of msgpack encoded chunks that together form the top-level object
+        :rtype: generator
+        """
+        if not isinstance(self.data, dict):
+            with self._cond:
+                blob = self.packer.pack(self.data)
+
+            yield blob
+            return
+
+        yield self.packer.pack_map_header(len(self.data))
+
+        for key in self.data:
+            yield self.packer.pack(key)
+            yield self.pack_value(key)
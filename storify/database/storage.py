@@ -0,0 +1,106 @@
+import os
+
+# Don't sync anything; files are flushed to the OS when they're closed, so a completed flush
+# survives the process crashing, but not necessarily a power loss. The default.
+DURABILITY_NONE = "none"
+# Also fsync written files before they're moved into place, so after a power loss a database
+# file holds either the old or the new data in full, though the latest flush may be undone
+DURABILITY_FLUSH = "flush"
+# Also fsync the directory after the move, so a completed flush survives a power loss too
+DURABILITY_FSYNC = "fsync"
+
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC)
+
+def check_durability(durability):
+    """Validate a durability level.
+
+    :param durability: One of ``"none"``, ``"flush"`` or ``"fsync"``
+    :type durability: str
+    :raises ValueError: If the durability level is unknown
+    """
+    if durability not in DURABILITY_LEVELS:
+        raise ValueError("Unknown durability level %r, expected one of %s" % (durability, ", ".join(DURABILITY_LEVELS)))
+
+def sync_file(f, durability):
+    """Make sure data written to an open file reaches the disk, according to ``durability``.
+
+    :param f: File object opened for writing
+    :param durability: Durability level
+    :type durability: str
+    """
+    if durability == DURABILITY_NONE:
+        return
+
+    f.flush()
+    os.fsync(f.fileno())
+
+def sync_directory(path, durability):
+    """Make sure a rename or new file in the directory of ``path`` reaches the disk.
+
+    Only done for the ``"fsync"`` level, and only where directories can be opened (not on Windows).
+
+    :param path: Path of a file in the directory
+    :type path: str
+    :param durability: Durability level
+    :type durability: str
+    """
+    if durability != DURABILITY_FSYNC:
+        return
+
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_file(path, chunks, durability=DURABILITY_NONE):
+    """Write a file and sync it according to ``durability``.
+
+    :param path: Path of the file to write
+    :type path: str
+    :param chunks: Iterable of bytes to write
+    :param durability: Durability level
+    :type durability: str
+    :default durability: "none"
+    """
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+        sync_file(f, durability)
+
+def atomic_write(path, chunks, durability=DURABILITY_NONE):
+    """Write a file atomically.
+
+    The data is written to ``<path>.tmp``, synced according to ``durability``, then moved
+    over ``path`` with :func:`os.replace`. Readers, and a crash at any point, will only ever
+    see the complete old file or the complete new one.
+
+    :param path: Path of the file to write
+    :type path: str
+    :param chunks: Iterable of bytes to write
+    :param durability: Durability level
+    :type durability: str
+    :default durability: "none"
+    :raises IOError: If the file can't be written. The temporary file is removed.
+    """
+    tmp_path = path + ".tmp"
+
+    try:
+        write_file(tmp_path, chunks, durability)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+    sync_directory(path, durability)
@@ -0,0 +1,178 @@
+import copy
+import functools
+import threading
+import msgpack
+
+from .lazy import LazyValue
+from ..model import Model
+
+# Marks a top-level key that didn't exist when the transaction started
+_ABSENT = object()
+_ABSENT_ENTRY = (_ABSENT, False)
+
+# Models in serialized copies are stored as ExtType(_EXT_COPY, index into Transaction.copies)
+_EXT_COPY = 100
+
+class Transaction:
+    def __init__(self, db):
+        """Initialize the Transaction instance.
+
+        A group of changes to a database that either all stay or are all undone. Used as
+        a context manager: the database's lock is held for the whole block, so other
+        writers, and flushes, wait until it's over. A flush can therefore never capture
+        the block half-applied, and its changes are written out together by the next one.
+
+        Before a top-level key first changes in the block, its value is kept: the value
+        itself when it's being replaced or deleted, otherwise a serialized copy, which keeps
+        models as copied instances so they come back as the same class. If the
+        block raises, every changed key is put back the way it was and the exception
+        propagates. Transactions can be nested; an inner one that raises only undoes its
+        own changes.
+
+        :param db: The database the changes are made to
+        :type db: Database
+        """
+        self.db = db
+        self.parent = None
+        self.thread = None
+
+        # Values of the keys changed so far, as they were when the transaction started.
+        # Each is (value, packed), where packed means value is a serialized copy.
+        # The key None holds the whole data of a database whose root is a list.
+        self.undo = {}
+
+        # Copies of the models in serialized values, kept as instances so that they come back
+        # as the same class, even if it isn't registered with the database
+        self.copies = []
+
+        self._packer = msgpack.Packer(default=self._encode)
+
+    def __enter__(self):
+        self.db._lock.acquire()
+
+        self.thread = threading.get_ident()
+        self.parent = self.db._transaction
+        self.db._transaction = self
+
+        # Kept values that a nested transaction hands over still refer to the same copies
+        if self.parent is not None:
+            self.copies = self.parent.copies
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            # Changes made while rolling back aren't recorded by any transaction
+            self.db._transaction = None
+
+            if exc_type is not None:
+                self.rollback()
+            elif self.parent is not None:
+                self.parent.merge(self)
+        finally:
+            self.db._transaction = self.parent
+            self.db._lock.release()
+
+        return False
+
+    def record(self, key, replace=False):
+        """Keep the value of ``key`` before it changes for the first time in the transaction.
+
+        Called by the database with its lock held.
+
+        :param key: The top-level key that is about to change, or None if the whole data is.
+            Only the data of a database whose root is a list is kept for None; changes made
+            to ``db.data`` directly are reported after the fact, so they can't be undone.
+        :param replace: Whether the value is about to be replaced or deleted, rather than changed in place
+        :type replace: bool
+        """
+        if key in self.undo:
+            return
+
+        data = self.db.data
+
+        if key is None:
+            if not isinstance(data, dict):
+                self.undo[None] = (self._packer.pack(data), True)
+
+            return
+
+        if key not in data:
+            self.undo[key] = _ABSENT_ENTRY
+            return
+
+        value = data[key]
+
+        # A value that's replaced isn't changed any further, and undecoded values never change
+        if replace or isinstance(value, LazyValue):
+            self.undo[key] = (value, False)
+        else:
+            self.undo[key] = (self._packer.pack(value), True)
+
+    def merge(self, child):
+        """Take over the kept values of a nested transaction that finished without an error.
+
+        :param child: The nested transaction
+        :type child: Transaction
+        """
+        for key, entry in child.undo.items():
+            self.undo.setdefault(key, entry)
+
+    def _encode(self, value):
+        if isinstance(value, Model):
+            self.copies.append(copy.deepcopy(value))
+            return msgpack.ExtType(_EXT_COPY, msgpack.packb(len(self.copies) - 1))
+
+        return self.db.encode_type(value)
+
+    def _decode(self, options, code, data):
+        if code != _EXT_COPY:
+            return options["ext_hook"](code, data)
+
+        # A copy is restored once at most, so it can be handed back as it is
+        model = self.copies[msgpack.unpackb(data)]
+        model._storify_adopt()
+
+        return model
+
+    def _restore(self, value, packed):
+        if packed:
+            options = self.db._unpack_options()
+
+            return msgpack.unpackb(value, **dict(options, ext_hook=functools.partial(self._decode, options)))
+
+        return value
+
+    def rollback(self):
+        """Put every key changed in the transaction back the way it was.
+
+        Called with the database's lock held.
+        """
+        db = self.db
+
+        if None in self.undo:
+            db._touch()
+            db.data = self._restore(*self.undo[None])
+            db._invalidate_indexes()
+            return
+
+        for key, (value, packed) in self.undo.items():
+            db._touch(key, replace=True)
+
+            if key in db.data:
+                db._release(db.data[key])
+
+            if value is _ABSENT:
+                db.data.pop(key, None)
+
+                if db.shards is not None:
+                    db.shards.keys[db.shards.index_of(key)].discard(key)
+            else:
+                db.data[key] = self._restore(value, packed)
+
+                if db.shards is not None:
+                    db.shards.keys[db.shards.index_of(key)].add(key)
+
+            db._invalidate_indexes(key)
+
+        db.log.debug(f"Rolled back {len(self.undo)} change(s) to db `{db.name}`")
@@ -1 +1,13 @@
 class DatabaseLoadError(Exception): pass
+
+class ModelRegistrationError(Exception): pass
+
+class BackupError(Exception): pass
+
+class DatabaseLockedError(Exception): pass
+
+class DatabaseReadOnlyError(Exception): pass
+
+class DatabaseClosedError(Exception): pass
+
+class DatabaseNotLoadedError(Exception): pass
@@ -1,4 +1,94 @@
-class Model:
+import typing
+import operator
+
+from .tracking import Trackable, track, detach, observer, SET, DELETE
+from .exceptions import ModelRegistrationError
+
+try:
+    import annotationlib
+except ImportError:
+    annotationlib = None
+
+class Model(Trackable):
+    # The parent is kept in a slot, so it isn't one of the model's attributes. Subclasses
+    # get a __dict__ as usual, unless they declare __slots__ (see SlotModel).
+    __slots__ = ("_storify_parent",)
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls)
+        object.__setattr__(self, "_storify_parent", None)
+
+        return self
+
+    def __getstate__(self):
+        # Copies and pickles are detached from the database the model is stored in
+        state = dict(self.__dict__) if hasattr(self, "__dict__") else None
+        slots = {}
+
+        for cls in type(self).__mro__:
+            names = cls.__dict__.get("__slots__", ())
+
+            for name in ((names,) if isinstance(names, str) else names):
+                if name not in ("_storify_parent", "__dict__", "__weakref__") and hasattr(self, name):
+                    slots[name] = getattr(self, name)
+
+        return (state, slots) if slots else state
+
+    def __setstate__(self, state):
+        object.__setattr__(self, "_storify_parent", None)
+
+        slots = None
+
+        if isinstance(state, tuple):
+            state, slots = state
+
+        if state:
+            # Pickles of older versions kept the parent with the attributes
+            self.__dict__.update({k: v for k, v in state.items() if k != "_storify_parent"})
+
+        for name, value in (slots or {}).items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        # Report changes to public attributes when the model is stored in a database
+        if self._storify_parent is not None and not name.startswith('_'):
+            with self._storify_change() as binding:
+                # Models that are rows of an indexed collection keep its indexes up to date
+                indexes = observer(self._storify_parent)
+
+                if indexes is not None and name in indexes:
+                    old = getattr(self, name, None)
+                    value = track(value, self)
+
+                    object.__setattr__(self, name, value)
+                    indexes.field_changed(self, name, old, value)
+                else:
+                    value = track(value, self)
+                    object.__setattr__(self, name, value)
+
+                if binding is not None:
+                    binding.record(self, SET, name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        # Deleting a public attribute is a change too, which the journal replays as a DELETE
+        if self._storify_parent is not None and not name.startswith('_'):
+            with self._storify_change() as binding:
+                old = getattr(self, name)
+                object.__delattr__(self, name)
+                detach(old, self)
+
+                if binding is not None:
+                    binding.record(self, DELETE, name)
+
+                indexes = observer(self._storify_parent)
+
+                if indexes is not None and name in indexes:
+                    indexes.field_changed(self, name, old, None)
+        else:
+            object.__delattr__(self, name)
+
     @classmethod
     def _keyname(cls):
         """
@@ -33,3 +123,268 @@ class Model:
         By default, it uses the _from_dict method to convert the dictionary to an instance.
         """
         return cls._from_dict(data)
+
+    def _storify_children(self):
+        """
+        This method is used to get the attribute values that are stored with the model,
+        so that changes to nested lists and dicts can be tracked.
+        """
+        return [v for k, v in self.__dict__.items() if not k.startswith('_')]
+
+    def _storify_items(self):
+        return [(k, v) for k, v in self.__dict__.items() if not k.startswith('_')]
+
+    def _storify_adopt(self):
+        """
+        This method is used when the model is stored in a database. It converts
+        the model's public list and dict attributes into tracked containers.
+        """
+        for k, v in list(self.__dict__.items()):
+            if not k.startswith('_'):
+                self.__dict__[k] = track(v, self)
+
+def _namespace_annotations(namespace):
+    if "__annotations__" in namespace:
+        return namespace["__annotations__"]
+
+    # Python 3.14+ evaluates class annotations lazily
+    annotate = namespace.get("__annotate__") or namespace.get("__annotate_func__")
+
+    if annotate is not None and annotationlib is not None:
+        return annotationlib.call_annotate_function(annotate, annotationlib.Format.FORWARDREF)
+
+    return {}
+
+def _is_classvar(annotation):
+    return annotation is typing.ClassVar or getattr(annotation, "__origin__", None) is typing.ClassVar \
+        or (isinstance(annotation, str) and annotation.startswith(("ClassVar", "typing.ClassVar")))
+
+class SlotModelMeta(type):
+    def __new__(mcls, name, bases, namespace, **kwargs):
+        # Fields come from public class annotations; a class-level value is the field's default
+        inherited = []
+        defaults = {}
+
+        for base in reversed(bases):
+            for field in getattr(base, "_fields", ()):
+                if field not in inherited:
+                    inherited.append(field)
+
+            defaults.update(getattr(base, "_defaults", {}))
+
+        fields = []
+
+        for field, annotation in _namespace_annotations(namespace).items():
+            if field.startswith("_") or _is_classvar(annotation) or field in inherited:
+                continue
+
+            fields.append(field)
+
+            if field in namespace:
+                defaults[field] = namespace.pop(field)
+
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(fields)
+        namespace["_fields"] = tuple(inherited + fields)
+        namespace["_defaults"] = defaults
+        namespace["_initial"] = tuple(
+            (field, defaults.get(field), isinstance(defaults.get(field), (list, dict, set)))
+            for field in namespace["_fields"]
+        )
+
+        # attrgetter isn't a descriptor, so it's called as self._field_getter(self)
+        if namespace["_fields"]:
+            namespace["_field_getter"] = operator.attrgetter(*namespace["_fields"])
+
+        return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+class SlotModel(Model, metaclass=SlotModelMeta):
+    """
+    A model with declared fields, stored in __slots__ instead of a per-instance __dict__.
+
+    Fields are declared with class annotations. A value assigned in the class body is the
+    field's default (mutable defaults are copied for every instance); fields without a
+    default start out as None. Only declared fields can be set on instances.
+
+        class Book(SlotModel):
+            title: str
+            author: str
+            year: int = 0
+            tags: list = []
+
+        book = Book(title="1984", author="George Orwell", year=1949)
+    """
+    __slots__ = ()
+
+    _fields = ()
+    _defaults = {}
+    _initial = ()
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls)
+        setter = object.__setattr__
+
+        # Defaults are set here, so that subclasses can define their own __init__
+        for field, default, mutable in cls._initial:
+            setter(self, field, default.copy() if mutable else default)
+
+        return self
+
+    def __init__(self, **kwargs):
+        for field, value in kwargs.items():
+            if field not in self._defaults and field not in self._fields:
+                raise TypeError(f"{type(self).__name__} has no field '{field}'")
+
+            setattr(self, field, value)
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+    def _field_values(self):
+        if len(self._fields) == 1:
+            return (self._field_getter(self),)
+
+        return self._field_getter(self) if self._fields else ()
+
+    def _to_dict(self):
+        """
+        This method is used to convert the model instance to a dictionary of its fields.
+        """
+        return dict(zip(self._fields, self._field_values()))
+
+    def _from_dict(self, data):
+        """
+        This method is used to convert a dictionary to a model instance.
+        Keys that aren't declared fields are ignored.
+        """
+        setter = object.__setattr__ if self._storify_parent is None else setattr
+
+        for field in self._fields:
+            if field in data:
+                setter(self, field, data[field])
+
+        return self
+
+    def _storify_children(self):
+        return list(self._field_values())
+
+    def _storify_items(self):
+        return list(zip(self._fields, self._field_values()))
+
+    def _storify_adopt(self):
+        for field in self._fields:
+            object.__setattr__(self, field, track(getattr(self, field), self))
+
+class ModelRegistry:
+    def __init__(self, models=()):
+        """Initialize the ModelRegistry instance.
+
+        Maps model keynames to model classes, so that encoded models can be recognized with
+        a single dict lookup when decoding, and caches each class's keyname for encoding.
+
+        :param models: Model classes to register
+        :type models: iterable
+        :raises ModelRegistrationError: If two models share the same keyname
+        """
+        self._by_keyname = {}
+        self._keynames = {}
+
+        for model in models:
+            self.register(model)
+
+    def register(self, model):
+        """Register a model class.
+
+        :param model: The model class to register
+        :type model: type
+        :return: The model class, so this can be used as a class decorator
+        :rtype: type
+        :raises ModelRegistrationError: If another model is already registered with the same keyname
+        """
+        if not (isinstance(model, type) and issubclass(model, Model)):
+            raise ModelRegistrationError(f"{model!r} is not a Model subclass")
+
+        keyname = model._keyname()
+        existing = self._by_keyname.get(keyname)
+
+        if existing is not None and existing is not model:
+            raise ModelRegistrationError(
+                f"Models {existing.__qualname__} and {model.__qualname__} both use the keyname '{keyname}'"
+            )
+
+        self._by_keyname[keyname] = model
+        self._keynames[model] = keyname
+
+        return model
+
+    def keyname(self, model):
+        """Get the keyname of a model class, registered or not.
+
+        :param model: The model class
+        :type model: type
+        :rtype: str
+        """
+        keyname = self._keynames.get(model)
+
+        if keyname is None:
+            keyname = self._keynames[model] = model._keyname()
+
+        return keyname
+
+    def get(self, keyname):
+        """Get the model class registered under ``keyname``.
+
+        :rtype: type or None
+        """
+        return self._by_keyname.get(keyname)
+
+    def lookup(self, data):
+        """Find the model class that an encoded dict represents.
+
+        Encoded models are dicts with a single key, the model's keyname.
+
+        :param data: A decoded dict
+        :type data: dict
+        :return: The model class, or None if ``data`` isn't an encoded model
+        :rtype: type or None
+        """
+        if len(data) != 1:
+            return None
+
+        for keyname in data:
+            return self._by_keyname.get(keyname)
+
+    def append(self, model):
+        """Register a model class, like :meth:`register`.
+
+        Models used to be kept in a plain list, so code that adds models with
+        ``storify.models.append(Model)`` keeps working.
+
+        :param model: The model class to register
+        :type model: type
+        :raises ModelRegistrationError: If another model is already registered with the same keyname
+        """
+        self.register(model)
+
+    def extend(self, models):
+        """Register several model classes.
+
+        :param models: Model classes to register
+        :type models: iterable
+        :raises ModelRegistrationError: If two models share the same keyname
+        """
+        for model in models:
+            self.register(model)
+
+    def __getitem__(self, index):
+        # Models in the order they were registered, like the list they used to be kept in
+        return list(self._by_keyname.values())[index]
+
+    def __iter__(self):
+        return iter(list(self._by_keyname.values()))
+
+    def __len__(self):
+        return len(self._by_keyname)
+
+    def __contains__(self, model):
+        return model in self._by_keyname.values()
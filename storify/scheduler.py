@@ -0,0 +1,101 @@
+import time
+import random
+import threading
+
+class Scheduler:
+    def __init__(self, storify, resolution=1.0):
+        """Initialize the Scheduler instance.
+
+        The scheduler flushes each database of a Storify instance on a background thread,
+        once per save interval. A database's first flush is scheduled at a random point
+        within its interval, so that databases opened together don't all flush at once.
+        Databases opened with ``access="reader"`` are checked for changes by other
+        processes on the same schedule.
+
+        :param storify: Storify instance whose databases should be flushed
+        :type storify: Storify
+        :param resolution: Maximum time in seconds the scheduler sleeps between checks
+        :type resolution: float
+        :default resolution: 1.0
+        """
+        self.storify = storify
+        self.resolution = resolution
+
+        self._due = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        """Whether the scheduler thread is running.
+
+        :rtype: bool
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the scheduler thread. Does nothing if it's already running."""
+        if self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storify-autosave", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the scheduler thread, waiting for any flush in progress to finish.
+
+        :param timeout: Maximum time in seconds to wait for the thread to stop
+        :type timeout: float
+        :default timeout: None
+        """
+        self._stop.set()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self.tick()
+            self._stop.wait(min(max(wait, 0.01), self.resolution))
+
+    def tick(self):
+        """Flush every database that is due.
+
+        :return: Time in seconds until the next database is due
+        :rtype: float
+        """
+        now = time.time()
+        next_due = now + self.resolution
+
+        for db in self.storify.active_databases():
+            if self._stop.is_set():
+                break
+
+            interval = db.save_interval if db.save_interval is not None else self.storify.save_interval
+
+            if db not in self._due:
+                self._due[db] = now + random.uniform(0, interval)
+
+            if self._due[db] <= now:
+                try:
+                    db.flush()
+                    db.refresh()
+                except Exception:
+                    self.storify.log.traceback(f"Autosave failed for db `{db.name}`")
+
+                now = time.time()
+                self._due[db] = now + interval
+
+            next_due = min(next_due, self._due[db])
+
+        # Forget databases that have been closed
+        for db in [db for db in self._due if db.defunct]:
+            del self._due[db]
+
+        # Data grows between calls to get_db(), so the memory budget is checked here too
+        self.storify._enforce_memory()
+
+        return next_due - time.time()
@@ -0,0 +1,483 @@
+# Changes recorded for the journal, as [op, path, *args] where path leads to the changed container
+SET = 0        # key, value: container[key] = value (an attribute, for models)
+DELETE = 1     # key: del container[key]
+APPEND = 2     # value
+EXTEND = 3     # values
+INSERT = 4     # index, value
+REPLACE = 5    # contents: the container's contents are replaced
+
+class Trackable:
+    """Base for objects that report changes to the database they are stored in.
+
+    Every trackable object keeps a reference to its parent in ``_storify_parent``.
+    Mutations are made inside ``with self._storify_change() as binding:``, which walks
+    up the parent chain to the :class:`Binding` that ties the value to a key in a
+    database, and lets the database know about the change while it is being applied.
+    Once applied, the change is described with ``binding.record()`` for the journal.
+    """
+    __slots__ = ()
+
+    _storify_parent = None
+
+    def _storify_adopt(self):
+        pass
+
+    def _storify_items(self):
+        # The (key, value) pairs of the object, to find a child's position in it
+        return ()
+
+    def _storify_change(self):
+        parent = self._storify_parent
+
+        while parent is not None:
+            if type(parent) is Binding:
+                return parent
+
+            parent = parent._storify_parent
+
+        return UNBOUND
+
+class Binding:
+    """Ties a top-level value to the key it is stored under in a database.
+
+    Used as a context manager around changes to the value.
+    """
+    __slots__ = ("db", "key")
+
+    def __init__(self, db, key):
+        self.db = db
+        self.key = key
+
+    def __enter__(self):
+        self.db._begin_change(self.key)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.db._end_change(self.key)
+
+    def record(self, container, op, *args):
+        """Describe a change that was just made to a container or model under this key.
+
+        :param container: The tracked container or model that changed
+        :param op: What changed, ``SET``, ``DELETE``, ``APPEND``, ``EXTEND``, ``INSERT`` or ``REPLACE``
+        :param args: The arguments of the change
+        """
+        changes = self.db._changes
+
+        if changes is not None:
+            changes.record(self.key, container, op, args)
+
+class _Unbound:
+    # Changes to values that aren't stored in a database don't need to be reported
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        pass
+
+UNBOUND = _Unbound()
+
+def observer(container):
+    """Get the indexes kept over ``container``, if it is an indexed top-level collection.
+
+    :param container: A tracked container, or the parent of a model
+    :return: The collection's :class:`~storify.database.indexes.Indexes`, or None
+    """
+    parent = getattr(container, "_storify_parent", None)
+
+    if type(parent) is Binding:
+        return parent.db.indexes.get(parent.key)
+
+    return None
+
+def track(value, parent):
+    """Prepare a value for insertion into a tracked container.
+
+    Plain dicts and lists are converted into their tracked counterparts, recursively.
+    Tracked containers that already belong to another parent are copied, so that a
+    value only ever lives in one place (just like it will after a round-trip to disk).
+    Models are re-parented in place. Anything else is returned unchanged.
+
+    :param value: The value being inserted
+    :param parent: The container, model or :class:`Binding` receiving the value
+    :return: The value to store
+    """
+    cls = type(value)
+
+    if cls is dict or cls is list:
+        return _convert(value, parent)
+
+    if cls is TrackedDict or cls is TrackedList:
+        owner = value._storify_parent
+
+        if owner is None or owner is parent:
+            value._storify_parent = parent
+            return value
+
+        return _convert(value, parent)
+
+    if isinstance(value, Trackable):
+        object.__setattr__(value, "_storify_parent", parent)
+        value._storify_adopt()
+
+    return value
+
+def adopt(parent, values):
+    """Point already tracked ``values`` at ``parent``.
+
+    Used while decoding, where children are built before the container holding them.
+    """
+    for value in values:
+        if isinstance(value, Trackable):
+            object.__setattr__(value, "_storify_parent", parent)
+
+def detach(value, parent):
+    """Forget ``parent`` as the owner of ``value`` once it has been removed from it."""
+    if isinstance(value, Trackable) and value._storify_parent is parent:
+        object.__setattr__(value, "_storify_parent", None)
+
+def _convert(value, parent):
+    if isinstance(value, dict):
+        new = TrackedDict()
+        new._storify_parent = parent
+
+        for key, item in value.items():
+            dict.__setitem__(new, key, track(item, new))
+
+        return new
+
+    new = TrackedList()
+    new._storify_parent = parent
+
+    list.extend(new, [track(item, new) for item in value])
+
+    return new
+
+class TrackedDict(Trackable, dict):
+    """A dict that reports changes to the database it is stored in."""
+    __slots__ = ("_storify_parent",)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._storify_parent = None
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are plain dicts, detached from any database
+        return (dict, (dict(self),))
+
+    def _storify_items(self):
+        return dict.items(self)
+
+    def _field_changed(self, key, old, new):
+        # Dicts that are rows of an indexed collection keep its indexes up to date
+        indexes = observer(self._storify_parent)
+
+        if indexes is not None and key in indexes:
+            indexes.field_changed(self, key, old, new)
+
+    def __setitem__(self, key, value):
+        with self._storify_change() as binding:
+            old = ()
+
+            if key in self:
+                old = (dict.__getitem__(self, key),)
+                detach(old[0], self)
+
+            value = track(value, self)
+            dict.__setitem__(self, key, value)
+
+            if binding is not None:
+                binding.record(self, SET, key, value)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((value,), old)
+
+            self._field_changed(key, old[0] if old else None, value)
+
+    def __delitem__(self, key):
+        with self._storify_change() as binding:
+            value = dict.pop(self, key)
+            detach(value, self)
+
+            if binding is not None:
+                binding.record(self, DELETE, key)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((), (value,))
+
+            self._field_changed(key, value, None)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        with self._storify_change() as binding:
+            removed = list(dict.items(self))
+
+            for key, value in removed:
+                detach(value, self)
+
+            dict.clear(self)
+
+            if binding is not None:
+                binding.record(self, REPLACE, self)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.invalidate()
+
+            for key, value in removed:
+                self._field_changed(key, value, None)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+
+        with self._storify_change() as binding:
+            value = dict.pop(self, key)
+            detach(value, self)
+
+            if binding is not None:
+                binding.record(self, DELETE, key)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((), (value,))
+
+            self._field_changed(key, value, None)
+
+        return value
+
+    def popitem(self):
+        with self._storify_change() as binding:
+            key, value = dict.popitem(self)
+            detach(value, self)
+
+            if binding is not None:
+                binding.record(self, DELETE, key)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((), (value,))
+
+            self._field_changed(key, value, None)
+
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return dict.__getitem__(self, key)
+
+        self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        with self._storify_change():
+            for key, value in dict(*args, **kwargs).items():
+                self[key] = value
+
+class TrackedList(Trackable, list):
+    """A list that reports changes to the database it is stored in."""
+    __slots__ = ("_storify_parent",)
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._storify_parent = None
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are plain lists, detached from any database
+        return (list, (list(self),))
+
+    def _storify_items(self):
+        return enumerate(list.__iter__(self))
+
+    def __setitem__(self, index, value):
+        with self._storify_change() as binding:
+            if isinstance(index, slice):
+                removed = list.__getitem__(self, index)
+                added = [track(item, self) for item in value]
+
+                for old in removed:
+                    detach(old, self)
+
+                list.__setitem__(self, index, added)
+
+                if binding is not None:
+                    binding.record(self, REPLACE, self)
+            else:
+                removed = (list.__getitem__(self, index),)
+                added = (track(value, self),)
+
+                detach(removed[0], self)
+                list.__setitem__(self, index, added[0])
+
+                if binding is not None:
+                    binding.record(self, SET, index if index >= 0 else index + len(self), added[0])
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed(added, removed)
+
+    def __delitem__(self, index):
+        with self._storify_change() as binding:
+            removed = list.__getitem__(self, index)
+
+            if not isinstance(index, slice):
+                removed = (removed,)
+
+                if index < 0:
+                    index += len(self)
+
+            for old in removed:
+                detach(old, self)
+
+            list.__delitem__(self, index)
+
+            if binding is not None:
+                if isinstance(index, slice):
+                    binding.record(self, REPLACE, self)
+                else:
+                    binding.record(self, DELETE, index)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((), removed)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, count):
+        with self._storify_change() as binding:
+            items = list(list.__iter__(self))
+
+            if count <= 0:
+                self.clear()
+
+            for _ in range(count - 1):
+                # Repeated containers are copied so each one has a single parent
+                list.extend(self, [_convert(item, self) if isinstance(item, (TrackedDict, TrackedList)) else item for item in items])
+
+            if binding is not None:
+                binding.record(self, REPLACE, self)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.invalidate()
+
+        return self
+
+    def append(self, value):
+        with self._storify_change() as binding:
+            value = track(value, self)
+            list.append(self, value)
+
+            if binding is not None:
+                binding.record(self, APPEND, value)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((value,), ())
+
+    def extend(self, values):
+        with self._storify_change() as binding:
+            added = [track(item, self) for item in values]
+            list.extend(self, added)
+
+            if binding is not None:
+                binding.record(self, EXTEND, added)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed(added, ())
+
+    def insert(self, index, value):
+        with self._storify_change() as binding:
+            value = track(value, self)
+            list.insert(self, index, value)
+
+            if binding is not None:
+                binding.record(self, INSERT, index, value)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((value,), ())
+
+    def pop(self, index=-1):
+        with self._storify_change() as binding:
+            if index < 0:
+                index += len(self)
+
+            value = list.pop(self, index)
+            detach(value, self)
+
+            if binding is not None:
+                binding.record(self, DELETE, index)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((), (value,))
+
+        return value
+
+    def remove(self, value):
+        with self._storify_change() as binding:
+            index = list.index(self, value)
+            removed = list.__getitem__(self, index)
+
+            detach(removed, self)
+            list.__delitem__(self, index)
+
+            if binding is not None:
+                binding.record(self, DELETE, index)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.rows_changed((), (removed,))
+
+    def clear(self):
+        with self._storify_change() as binding:
+            for value in list.__iter__(self):
+                detach(value, self)
+
+            list.clear(self)
+
+            if binding is not None:
+                binding.record(self, REPLACE, self)
+
+            indexes = observer(self)
+
+            if indexes is not None:
+                indexes.invalidate()
+
+    def sort(self, *args, **kwargs):
+        with self._storify_change() as binding:
+            list.sort(self, *args, **kwargs)
+
+            if binding is not None:
+                binding.record(self, REPLACE, self)
+
+    def reverse(self):
+        with self._storify_change() as binding:
+            list.reverse(self)
+
+            if binding is not None:
+                binding.record(self, REPLACE, self)
@@ -0,0 +1,22 @@
+import logging
+
+import pytest
+
+from storify import Storify
+from storify.logger import Logger
+
+@pytest.fixture
+def log():
+    return Logger(level=logging.ERROR)
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / "data")
+
+@pytest.fixture
+def storify(root, log):
+    sf = Storify(root=root, log=log)
+
+    yield sf
+
+    sf.close()
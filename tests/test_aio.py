@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from storify.aio import AsyncStorify
+from storify.exceptions import DatabaseNotLoadedError
+
+def test_lazy_values_are_read_on_the_executor(root, log):
+    async def main():
+        async with AsyncStorify(root=root, log=log) as sf:
+            db = await sf.get_db("lazy", lazy=True)
+            db["value"] = {"a": 1}
+            await db.close()
+
+            db = await sf.get_db("lazy", lazy=True)
+
+            with pytest.raises(DatabaseNotLoadedError):
+                db["value"]
+
+            assert "value" in db
+            assert await db.get("value") == {"a": 1}
+            assert db["value"] == {"a": 1}
+
+    asyncio.run(main())
+
+def test_tick_enforces_max_memory(root, log):
+    async def main():
+        async with AsyncStorify(root=root, log=log) as sf:
+            first = await sf.get_db("first")
+            first["items"] = list(range(1000))
+
+            second = await sf.get_db("second")
+            second["items"] = list(range(1000))
+
+            sf.storify.max_memory = 1
+            await sf.tick()
+
+            assert first.unloaded and not first.dirty
+
+            with pytest.raises(DatabaseNotLoadedError):
+                first["items"]
+
+            await first.ensure_loaded()
+            assert first["items"] == list(range(1000))
+
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+import os
+
+from storify import Storify
+
+def fill(db):
+    for i in range(50):
+        db["key%d" % i] = "%d" % i * 1000
+
+def test_backups_are_deduplicated_and_restore(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("events")
+
+    fill(db)
+    db.flush()
+    first = db.unpack(db.path)
+
+    db["key0"] = "changed"
+    db.flush()
+
+    db["key1"] = "changed"
+    db.flush()
+
+    # Only the chunks of the values that changed are stored again
+    assert db.backups.list == [2, 1]
+    assert 0 < db.backups.last_backup["new_chunks"] <= 2
+
+    stats = db.backups.stats()
+    assert stats["backups"] == 2
+    assert stats["stored"] < stats["size"] * 0.75
+
+    restored = os.path.join(root, "restored.mpack")
+    db.backups.restore(1, restored)
+
+    assert db.unpack(restored) == first
+
+    storify.close()
+
+def test_backup_index_is_cached_and_rotated(root, log, monkeypatch):
+    options = {"max_backups": 2, "index_file": True}
+
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("events", backup_options=options)
+
+    fill(db)
+    db.flush()
+    assert db.backups.list == []
+
+    listed = []
+    listdir = os.listdir
+
+    def counting_listdir(path):
+        listed.append(path)
+        return listdir(path)
+
+    monkeypatch.setattr(os, "listdir", counting_listdir)
+
+    for i in range(4):
+        db["key0"] = "change %d" % i
+        db.flush()
+        assert db.backups.list == list(range(i + 1, max(i - 1, 0), -1))
+
+    # The backup directory is only listed again when something else changes it
+    assert db.backups.backup_path not in listed
+
+    storify.close()
+
+    # The index is read from its file on startup
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("events", backup_options=options)
+
+    assert db.backups.list == [4, 3]
+    assert db.backups.backup_path not in listed
+
+    open(os.path.join(db.backups.backup_path, "junk"), "w").close()
+    assert db.backups.list == [4, 3]
+    assert db.backups.backup_path in listed
+
+    storify.close()
+
+def test_background_backups_keep_the_flushed_over_file(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("events", backup_options={"background": True})
+
+    fill(db)
+    db.flush()
+    first = db.unpack(db.path)
+
+    db["key0"] = "changed"
+    db.flush()
+    second = db.unpack(db.path)
+
+    db["key1"] = "changed"
+    db.flush()
+    db.backups.wait()
+
+    assert db.backups.list == [2, 1]
+    assert os.listdir(db.backups.pending_path) == []
+
+    # Each backup holds the file as it was before the flush that made it
+    for backup_id, expected in ((1, first), (2, second)):
+        restored = os.path.join(root, "restored-%d.mpack" % backup_id)
+        db.backups.restore(backup_id, restored)
+
+        assert db.unpack(restored) == expected
+
+    storify.close()
+
+def test_pending_backup_is_stored_after_a_crash(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("events", backup_options={"background": True})
+
+    fill(db)
+    db.flush()
+    first = db.unpack(db.path)
+
+    # As if the process died before the worker thread stored the linked file
+    db.backups._link()
+
+    other = Storify(root=root, log=log)
+    db = other.get_db("events", backup_options={"background": True})
+    db.backups.wait()
+
+    assert db.backups.list == [1]
+
+    restored = os.path.join(root, "restored.mpack")
+    db.backups.restore(1, restored)
+    assert db.unpack(restored) == first
+
+    other.close()
+    storify.close()
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from storify import Storify
+from storify.database.codecs import CODECS
+
+DATA = {"articles": ["Some text that compresses well. " * 20 for _ in range(100)], "count": 100}
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_round_trip(root, log, codec):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("articles", compression=codec)
+    db.update_many(DATA)
+    db.flush()
+
+    size = os.path.getsize(db.path)
+    storify.close()
+
+    if codec != "none":
+        assert size < len(DATA["articles"][0]) * len(DATA["articles"]) / 2
+
+    # The file is read with the codec it was written with, whatever the setting is now
+    for compression, lazy in (("none", False), (codec, True)):
+        storify = Storify(root=root, log=log)
+        db = storify.get_db("articles", compression=compression, lazy=lazy)
+
+        assert {key: db[key] for key in db} == DATA
+
+        storify.close()
+
+def test_compressed_backups_restore_uncompressed(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("articles", compression="zlib")
+    db.update_many(DATA)
+    db.flush()
+
+    db["count"] = 101
+    db.flush()
+
+    restored = os.path.join(root, "restored.mpack")
+    db.backups.restore(db.backups.latest, restored)
+
+    assert storify.get_db_by_path(restored).data == DATA
+
+    storify.close()
+
+def test_unknown_codec(root, log):
+    storify = Storify(root=root, log=log)
+
+    with pytest.raises(ValueError):
+        storify.get_db("articles", compression="rot13")
+
+    storify.close()
@@ -0,0 +1,107 @@
+import time
+import threading
+
+import pytest
+
+from storify import Storify
+from storify.model import Model
+
+class Counter(Model):
+    def __init__(self, name=""):
+        self.name = name
+        self.count = 0
+        self.history = []
+
+WRITERS = 4
+CHANGES = 500
+
+def write(db, writer):
+    for i in range(CHANGES):
+        db["lists"][writer].append(i)
+        db["counters"][writer].count += 1
+        db["counters"][writer].history.append(i)
+
+        # Changed together, so every flush must see both or neither
+        with db.transaction():
+            db["totals"]["a"] += 1
+            db["totals"]["b"] += 1
+
+@pytest.mark.parametrize("options", [{}, {"journal": True}, {"serializer": "fork"}], ids=["snapshot", "journal", "fork"])
+def test_writers_during_flush_async(root, log, options):
+    storify = Storify(root=root, log=log, models=[Counter])
+    db = storify.get_db("concurrent", **options)
+
+    db["lists"] = [[] for _ in range(WRITERS)]
+    db["counters"] = [Counter(str(writer)) for writer in range(WRITERS)]
+    db["totals"] = {"a": 0, "b": 0}
+    db.flush()
+
+    threads = [threading.Thread(target=write, args=(db, writer)) for writer in range(WRITERS)]
+
+    for thread in threads:
+        thread.start()
+
+    while any(thread.is_alive() for thread in threads):
+        db.flush_async().result()
+
+        if not options.get("journal"):
+            # What's on disk is always a consistent state
+            totals = db.unpack(db.path)["totals"]
+            assert totals["a"] == totals["b"]
+
+    for thread in threads:
+        thread.join()
+
+    assert db.flush()
+    storify.close()
+
+    storify = Storify(root=root, log=log, models=[Counter])
+    db = storify.get_db("concurrent", **options)
+
+    assert db["lists"] == [list(range(CHANGES))] * WRITERS
+    assert [(counter.count, counter.history) for counter in db["counters"]] == [(CHANGES, list(range(CHANGES)))] * WRITERS
+    assert db["totals"] == {"a": WRITERS * CHANGES, "b": WRITERS * CHANGES}
+
+    storify.close()
+
+def test_autosave_never_writes_torn_data(root, log):
+    storify = Storify(root=root, log=log, models=[Counter], save_interval=0.01, autosave=True)
+    db = storify.get_db("autosaved")
+
+    db["counters"] = [Counter(str(writer)) for writer in range(WRITERS)]
+    db["totals"] = {"a": 0, "b": 0}
+    db.flush()
+
+    stop = threading.Event()
+
+    def keep_writing(writer):
+        while not stop.is_set():
+            with db.transaction():
+                db["counters"][writer].count += 1
+                db["counters"][writer].history.append(db["counters"][writer].count)
+                db["totals"]["a"] += 1
+                db["totals"]["b"] += 1
+
+    threads = [threading.Thread(target=keep_writing, args=(writer,)) for writer in range(WRITERS)]
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        deadline = time.time() + 10
+
+        # The autosave thread writes while the writers run; what's on disk is always consistent
+        while db.flush_count < 10 and time.time() < deadline:
+            written = db.unpack(db.path)
+            assert written["totals"]["a"] == written["totals"]["b"]
+
+            for counter in written["counters"]:
+                assert counter.history == list(range(1, counter.count + 1))
+    finally:
+        stop.set()
+
+        for thread in threads:
+            thread.join()
+
+    assert db.flush_count >= 10
+    storify.close()
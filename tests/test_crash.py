@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import signal
+import stat
+import subprocess
+
+import pytest
+
+from storify import Storify
+
+WRITER = """
+import sys
+from storify import Storify
+
+storify = Storify(root=sys.argv[1], save_interval=0)
+db = storify.get_db("crash", journal=sys.argv[2] == "journal", journal_max_size=64 * 1024)
+
+for i in range(1000000):
+    # Each flush writes a consistent state: n items, each one holding its index
+    db["items"].append({"index": len(db["items"]), "payload": "x" * 100})
+    db["n"] = len(db["items"])
+    db.flush()
+
+    if i == 0:
+        print("ready", flush=True)
+"""
+
+def check_consistent(db):
+    items = db["items"]
+
+    assert db["n"] == len(items)
+    assert [item["index"] for item in items] == list(range(len(items)))
+
+@pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs SIGKILL")
+@pytest.mark.parametrize("mode", ["snapshot", "journal"])
+def test_killed_while_writing(root, log, mode):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("crash", journal=mode == "journal")
+    db["items"] = []
+    db["n"] = 0
+    storify.close()
+
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    for delay in (0.05, 0.2, 0.5):
+        process = subprocess.Popen([sys.executable, "-c", WRITER, root, mode], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        assert process.stdout.readline().strip() == b"ready"
+        time.sleep(delay)
+
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+
+        storify = Storify(root=root, log=log)
+        db = storify.get_db("crash", journal=mode == "journal")
+
+        check_consistent(db)
+        assert db["n"] > 0
+
+        storify.close()
+
+def test_leftover_temporary_file(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("tmp")
+    db["value"] = 1
+    db.flush()
+
+    # A crash part way through writing the next file
+    with open(db.path, "rb") as f:
+        partial = f.read()[:-3]
+
+    with open(db.path + ".tmp", "wb") as f:
+        f.write(partial)
+
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("tmp")
+
+    assert db["value"] == 1
+
+    db["value"] = 2
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    assert storify.get_db("tmp")["value"] == 2
+    assert not os.path.exists(os.path.join(root, "tmp.mpack.tmp"))
+
+    storify.close()
+
+def test_truncated_journal(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("wal", journal=True)
+    db["items"] = [0]
+    db.flush()
+
+    db["items"].append(1)
+    db.flush()
+
+    size = db.journal.size
+    wal = db.journal.path
+
+    db["items"].append(2)
+    db["items"][0] = "zero"
+    db.flush()
+
+    storify.close()
+
+    with open(wal, "rb") as f:
+        journal = f.read()
+
+    # A crash at any point while the last record was being appended
+    for end in range(size, len(journal)):
+        with open(wal, "wb") as f:
+            f.write(journal[:end])
+
+        storify = Storify(root=root, log=log)
+        db = storify.get_db("wal", journal=True)
+
+        assert db["items"] == [0, 1]
+        assert os.path.getsize(wal) == size
+
+        # Records appended after the truncated one are replayed
+        db["items"].append(3)
+        storify.close()
+
+        storify = Storify(root=root, log=log)
+        assert storify.get_db("wal", journal=True)["items"] == [0, 1, 3]
+        storify.close()
+
+@pytest.mark.parametrize("durability, expected", [
+    ("none", {"file": 0, "directory": 0}),
+    ("flush", {"file": 1, "directory": 0}),
+    ("fsync", {"file": 1, "directory": 1}),
+])
+def test_durability_levels_sync(root, log, monkeypatch, durability, expected):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("durable", durability=durability)
+    db["value"] = 1
+
+    synced = {"file": 0, "directory": 0}
+    fsync = os.fsync
+
+    def counting_fsync(fd):
+        synced["directory" if stat.S_ISDIR(os.fstat(fd).st_mode) else "file"] += 1
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", counting_fsync)
+
+    # No earlier file, so there's nothing to back up and only the database file is written
+    assert db.flush()
+    assert synced == expected
+
+    monkeypatch.undo()
+    storify.close()
@@ -0,0 +1,59 @@
+import os
+import logging
+
+import msgpack
+import pytest
+
+from storify import Storify
+
+def write_plain(root, name, data):
+    os.makedirs(root, exist_ok=True)
+
+    with open(os.path.join(root, name + ".mpack"), "wb") as f:
+        f.write(msgpack.packb(data))
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_files_without_header_decode_bytes_to_str(root, log, lazy):
+    write_plain(root, "old", {
+        "name": "caf\xe9".encode("utf8"),
+        "binary": b"\xff\x00",
+        "items": [b"a", {"key": b"value"}],
+        "top": b"x",
+    })
+
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("old", lazy=lazy)
+
+    assert db["name"] == "caf\xe9"
+    assert db["binary"] == b"\xff\x00"
+    assert db["items"] == ["a", {"key": "value"}]
+    assert db["top"] == "x"
+
+    storify.close()
+
+def test_files_with_header_keep_bytes(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("new", compression="zlib")
+    db["value"] = b"bytes"
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    assert storify.get_db("new", compression="zlib")["value"] == b"bytes"
+    storify.close()
+
+def test_conflicting_empty_key_is_logged(root, log, caplog):
+    # "key" and b"key" both decode to "key"
+    os.makedirs(root, exist_ok=True)
+    packer = msgpack.Packer()
+
+    with open(os.path.join(root, "conflict.mpack"), "wb") as f:
+        f.write(packer.pack_map_header(2) + packer.pack("key") + packer.pack("value") + packer.pack(b"key") + packer.pack(""))
+
+    with caplog.at_level(logging.WARNING, logger="storify"):
+        storify = Storify(root=root, log=log)
+        db = storify.get_db("conflict")
+
+    assert db["key"] == "value"
+    assert "Skipping conflicting key key" in caplog.text
+
+    storify.close()
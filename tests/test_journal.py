@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from storify import Storify
+from storify.model import Model
+
+class Car(Model):
+    def __init__(self, make="", tags=None):
+        self.make = make
+        self.tags = tags or []
+
+def reopen(storify, root, log):
+    storify.close()
+    return Storify(root=root, log=log, models=[Car])
+
+def test_nested_changes_replay(root, log):
+    storify = Storify(root=root, log=log, models=[Car])
+    db = storify.get_db("garage", journal=True)
+
+    db["cars"] = [Car("Volvo"), Car("Saab")]
+    db["owners"] = {"anna": {"cars": [0]}, "bo": {"cars": [1]}}
+    db["log"] = list(range(10))
+    db.flush()
+
+    db["cars"][1].make = "Scania"
+    db["cars"][0].tags.append("red")
+    db["cars"].insert(1, Car("Audi", ["new"]))
+    db["owners"]["anna"]["cars"].append(2)
+    db["owners"]["cecilia"] = {"cars": []}
+    del db["owners"]["bo"]
+    db["log"].pop()
+    db["log"].pop(0)
+    db["log"][-1] = "last"
+    db["log"].sort(key=str)
+    db["counter"] = 1
+    db.flush()
+
+    db["owners"]["cecilia"]["cars"].extend([1, 2])
+    db["cars"][2].tags.insert(0, "old")
+    db["log"] = ["replaced"]
+    db.flush()
+
+    assert os.path.exists(db.journal.path)
+
+    expected = (
+        [(car.make, list(car.tags)) for car in db["cars"]],
+        db["owners"], db["log"], db["counter"],
+    )
+
+    storify = reopen(storify, root, log)
+    db = storify.get_db("garage", journal=True)
+
+    assert [(car.make, list(car.tags)) for car in db["cars"]] == expected[0]
+    assert (db["owners"], db["log"], db["counter"]) == expected[1:]
+
+    storify.close()
+
+def test_rolled_back_changes_are_journaled_whole(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("rollback", journal=True)
+
+    db["items"] = [1, 2, 3]
+    db.flush()
+
+    try:
+        with db.transaction():
+            db["items"].append(4)
+            db["items"][0] = 0
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    db["items"].append(5)
+    db.flush()
+
+    storify = reopen(storify, root, log)
+    assert storify.get_db("rollback", journal=True)["items"] == [1, 2, 3, 5]
+
+    storify.close()
+
+def test_small_change_to_a_large_value(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("large", journal=True)
+
+    db["rows"] = [{"id": i, "name": "row %d" % i} for i in range(10000)]
+    db.flush()
+
+    db["rows"][5000]["name"] = "changed"
+    db.flush()
+
+    # The record holds the changed field, not the whole list
+    assert db.journal.size < 100
+
+    storify = reopen(storify, root, log)
+    assert storify.get_db("large", journal=True)["rows"][5000] == {"id": 5000, "name": "changed"}
+
+    storify.close()
+
+@pytest.mark.parametrize("journal", [False, True], ids=["snapshot", "journal"])
+def test_deleted_model_attributes_stay_deleted(root, log, journal):
+    storify = Storify(root=root, log=log, models=[Car])
+    db = storify.get_db("garage", journal=journal)
+
+    db["cars"] = [Car("Volvo")]
+    db["cars"][0].nick = "Blue"
+    db.flush()
+
+    del db["cars"][0].nick
+    assert db.dirty
+
+    db.flush()
+
+    if journal:
+        assert os.path.exists(db.journal.path)
+
+    storify = reopen(storify, root, log)
+    db = storify.get_db("garage", journal=journal)
+
+    assert not hasattr(db["cars"][0], "nick")
+    assert db["cars"][0].make == "Volvo"
+
+    storify.close()
@@ -0,0 +1,40 @@
+from storify import Storify
+from storify.model import Model
+from storify.database.lazy import LazyValue
+
+class Item(Model):
+    def __init__(self, name=""):
+        self.name = name
+        self.tags = []
+
+def test_values_are_decoded_on_access_and_kept_when_flushed(root, log):
+    storify = Storify(root=root, log=log, models=[Item])
+    db = storify.get_db("catalog")
+    db["items"] = [Item("a"), Item("b")]
+    db["counts"] = {"a": 1}
+    db["untouched"] = list(range(100))
+    storify.close()
+
+    storify = Storify(root=root, log=log, models=[Item])
+    db = storify.get_db("catalog", lazy=True)
+
+    assert all(type(value) is LazyValue for value in db.data.values())
+
+    db["items"][0].tags.append("new")
+    db["counts"]["b"] = 2
+
+    assert type(db.data["items"]) is not LazyValue
+    assert type(db.data["untouched"]) is LazyValue
+
+    # Values that were never accessed are copied into the new file as they are
+    db.flush()
+    storify.close()
+
+    storify = Storify(root=root, log=log, models=[Item])
+    db = storify.get_db("catalog", lazy=True)
+
+    assert [(item.name, item.tags) for item in db["items"]] == [("a", ["new"]), ("b", [])]
+    assert db["counts"] == {"a": 1, "b": 2}
+    assert db["untouched"] == list(range(100))
+
+    storify.close()
@@ -0,0 +1,77 @@
+import copy
+import pickle
+
+import pytest
+
+from storify.model import Model, SlotModel
+
+class Person(Model):
+    def __init__(self, name="Greg"):
+        self.name = name
+        self.tags = ["a"]
+
+class Book(SlotModel):
+    title: str
+    tags: list = []
+
+class Raw(Model):
+    def __init__(self):
+        self.value = 1
+
+    def _to_dict(self):
+        return self.__dict__
+
+@pytest.fixture
+def db(storify):
+    for model in (Person, Book, Raw):
+        storify.register_model(model)
+
+    db = storify.get_db("models")
+    db["rows"] = [Person(), Book(title="1984"), Raw()]
+    db.flush()
+
+    return db
+
+def test_parent_is_not_an_attribute(db):
+    person, book, raw = db["rows"]
+
+    assert vars(person) == {"name": "Greg", "tags": ["a"]}
+    assert raw._to_dict() == {"value": 1}
+
+@pytest.mark.parametrize("position", [0, 1])
+def test_copy_is_detached(db, position):
+    model = db["rows"][position]
+    name = "name" if position == 0 else "title"
+    original = getattr(model, name)
+
+    duplicate = copy.copy(model)
+    setattr(duplicate, name, "changed")
+
+    assert getattr(model, name) == original
+    assert not db.dirty
+
+@pytest.mark.parametrize("position", [0, 1])
+@pytest.mark.parametrize("duplicate", [
+    copy.deepcopy,
+    lambda model: pickle.loads(pickle.dumps(model)),
+    lambda model: pickle.loads(pickle.dumps(model, protocol=0)),
+])
+def test_deep_copy_and_pickle_are_detached(db, position, duplicate):
+    model = db["rows"][position]
+    name = "name" if position == 0 else "title"
+
+    other = duplicate(model)
+    setattr(other, name, "changed")
+    other.tags.append("b")
+
+    assert other._storify_parent is None
+    assert type(other.tags) is list
+    assert getattr(model, name) != "changed"
+    assert model.tags == ["a"] if position == 0 else model.tags == []
+    assert not db.dirty
+
+def test_stored_model_still_tracks_changes(db):
+    person = db["rows"][0]
+    person.name = "Jane"
+
+    assert db.dirty
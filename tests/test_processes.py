@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+from storify import Storify
+from storify.database.locking import can_lock
+from storify.exceptions import DatabaseLockedError
+
+pytestmark = pytest.mark.skipif(not can_lock(), reason="needs file locking")
+
+# Keeps writing consistent states, n items each holding its index, until it's killed
+WRITER = """
+import sys
+from storify import Storify
+
+storify = Storify(root=sys.argv[1])
+db = storify.get_db("shared", access="writer", journal=sys.argv[2] == "journal", journal_max_size=16 * 1024)
+print("ready", flush=True)
+
+while True:
+    with db.transaction():
+        db["items"].append({"index": len(db["items"]), "payload": "x" * 100})
+        db["n"] = len(db["items"])
+
+    db.flush()
+"""
+
+OPEN_WRITER = """
+import sys
+from storify import Storify
+from storify.exceptions import DatabaseLockedError
+
+try:
+    Storify(root=sys.argv[1]).get_db("shared", access="writer")
+except DatabaseLockedError:
+    print("locked")
+else:
+    print("opened")
+"""
+
+def run(script, *args, **kwargs):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return subprocess.Popen([sys.executable, "-c", script, *args], env=env, stdout=subprocess.PIPE, **kwargs)
+
+def create(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("shared")
+    db["items"] = []
+    db["n"] = 0
+    storify.close()
+
+def test_second_writer_is_refused(root, log):
+    create(root, log)
+
+    storify = Storify(root=root, log=log)
+    storify.get_db("shared", access="writer")
+
+    assert run(OPEN_WRITER, root).communicate()[0].strip() == b"locked"
+
+    # Another Storify instance in the same process is refused too
+    other = Storify(root=root, log=log)
+
+    with pytest.raises(DatabaseLockedError):
+        other.get_db("shared", access="writer")
+
+    other.close()
+    storify.close()
+
+    assert run(OPEN_WRITER, root).communicate()[0].strip() == b"opened"
+
+@pytest.mark.parametrize("mode", ["snapshot", "journal"])
+def test_readers_never_see_torn_writes(root, log, mode):
+    create(root, log)
+
+    writer = run(WRITER, root, mode, stderr=subprocess.DEVNULL)
+
+    try:
+        assert writer.stdout.readline().strip() == b"ready"
+
+        storify = Storify(root=root, log=log)
+        db = storify.get_db("shared", access="reader")
+
+        reloads = 0
+        deadline = time.time() + 2
+
+        while time.time() < deadline:
+            if db.refresh():
+                reloads += 1
+
+            items = db["items"]
+
+            assert db["n"] == len(items)
+            assert [item["index"] for item in items] == list(range(len(items)))
+
+        assert reloads > 0
+        storify.close()
+    finally:
+        writer.kill()
+        writer.wait()
+
+def test_reader_reloads_only_when_the_data_changes(root, log):
+    create(root, log)
+
+    writer_storify = Storify(root=root, log=log)
+    writer = writer_storify.get_db("shared", access="writer")
+
+    storify = Storify(root=root, log=log)
+    reader = storify.get_db("shared", access="reader")
+
+    assert not reader.refresh()
+
+    writer["n"] = 1
+    writer.flush()
+
+    assert reader.refresh()
+    assert reader["n"] == 1
+
+    # Rewritten without changes, so the stamp is the same
+    writer.flush(force=True)
+    assert not reader.refresh()
+
+    writer_storify.close()
+    storify.close()
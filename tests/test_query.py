@@ -0,0 +1,107 @@
+import pytest
+
+from storify import Storify
+from storify.model import Model
+from storify.database.lazy import LazyValue
+
+class Person(Model):
+    def __init__(self, name=None, age=None):
+        self.name = name
+        self.age = age
+
+QUERIES = [
+    {"age": 30},
+    {"age": None},
+    {"age__in": [25, 30, 99]},
+    {"age__gte": 25},
+    {"age__gt": 25, "age__lte": 40},
+    {"age__lt": 30, "name__ne": "bo"},
+]
+
+def rows():
+    return [
+        Person("anna", 30),
+        {"name": "bo", "age": 25},
+        {"name": "cecilia", "age": 30},
+        {"name": "dan"},
+        Person("erik", 41),
+        {"name": "frida", "age": "thirty"},
+        "not a row",
+    ]
+
+def results(db, conditions):
+    # Indexes produce rows in the index's order, so only which rows match is compared
+    return sorted(repr(row) if isinstance(row, dict) else "Person %s" % row.name for row in db.query("people").where(**conditions))
+
+@pytest.mark.parametrize("kind", ["hash", "sorted"])
+def test_index_matches_scan(storify, kind):
+    indexed = storify.get_db("indexed", indexes={"people": {"age": kind}})
+    scanned = storify.get_db("scanned")
+
+    for db in (indexed, scanned):
+        db["people"] = rows()
+
+    def check():
+        for conditions in QUERIES:
+            if kind == "hash" and any("__g" in name or "__l" in name for name in conditions):
+                continue
+
+            assert indexed.query("people").where(**conditions).explain().startswith("index")
+            assert results(indexed, conditions) == results(scanned, conditions), conditions
+
+    check()
+
+    # Changes to dict rows keep the index up to date
+    for db in (indexed, scanned):
+        people = db["people"]
+        people[1]["age"] = 30
+        people[2].pop("age")
+        people[3]["age"] = 25
+        people[5].clear()
+        people.append({"name": "gun", "age": 40})
+        del people[0]
+
+    check()
+
+def test_where_only_limit(storify):
+    db = storify.get_db("people")
+    db["people"] = rows()
+
+    query = db.query("people").where(age__gte=25)
+
+    assert query.explain().startswith("scan")
+    assert [row["name"] for row in query.only("name")] == ["anna", "bo", "cecilia", "erik"]
+    assert list(query.where(name__contains="e").only("name", "age").limit(1)) == [{"name": "cecilia", "age": 30}]
+    assert query.where(name="erik").first().age == 41
+    assert db.query("people").where(name="nobody").first() is None
+
+    # Extending a query doesn't change it
+    assert len(list(query)) == 4
+
+@pytest.mark.parametrize("options", [{"lazy": True}, {"shards": 4}], ids=["lazy", "sharded"])
+def test_rows_are_streamed_without_loading(root, log, options):
+    storify = Storify(root=root, log=log, models=[Person])
+    db = storify.get_db("people", **options)
+    db["people"] = rows()
+
+    for i in range(20):
+        db["person%d" % i] = {"name": "p%d" % i, "age": i}
+
+    storify.close()
+
+    storify = Storify(root=root, log=log, models=[Person])
+    db = storify.get_db("people", **options)
+
+    assert sorted(row["name"] for row in db.query().where(age__lt=2).only("name")) == ["p0", "p1"]
+
+    if "lazy" in options:
+        assert [row.name for row in db.query("people").where(age__gt=30) if isinstance(row, Person)] == ["erik"]
+
+        # Nothing was kept in memory
+        assert all(type(value) is LazyValue for value in db.data.values())
+    else:
+        assert db.shards.loaded == set()
+
+    assert db["people"][4].age == 41
+
+    storify.close()
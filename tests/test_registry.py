@@ -0,0 +1,33 @@
+import pytest
+
+from storify import Storify
+from storify.model import Model, ModelRegistry
+from storify.exceptions import ModelRegistrationError
+
+class User(Model):
+    pass
+
+class Product(Model):
+    pass
+
+def test_list_compatible_registration(root, log):
+    storify = Storify(root=root, log=log, models=[User])
+
+    storify.models.append(Product)
+
+    assert list(storify.models) == [User, Product]
+    assert storify.models[-1] is Product
+    assert Product in storify.get_db("shop").models
+
+    storify.close()
+
+def test_extend_rejects_duplicate_keynames():
+    class Other(Model):
+        @classmethod
+        def _keyname(cls):
+            return "__User__"
+
+    registry = ModelRegistry()
+
+    with pytest.raises(ModelRegistrationError):
+        registry.extend([User, Other])
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from storify import Storify
+
+def test_round_trip_loads_and_writes_only_what_is_needed(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("sharded", shards=8)
+
+    for i in range(100):
+        db["key%d" % i] = {"index": i}
+
+    db.flush()
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("sharded", shards=8)
+
+    # Nothing but the manifest is read until a key is accessed
+    assert db.shards.loaded == set()
+    assert db["key7"] == {"index": 7}
+    assert db.shards.loaded == {db.shards.index_of("key7")}
+
+    changed = db.shards.index_of("key7")
+    written = {index: os.path.getmtime(db.shards.path(index)) for index in range(8)}
+    os.utime(db.shards.path(changed), (0, 0))
+
+    db["key7"]["index"] = -7
+    db.flush()
+
+    # Only the shard holding the changed key is rewritten
+    assert os.path.getmtime(db.shards.path(changed)) != 0
+    assert all(os.path.getmtime(db.shards.path(index)) == written[index] for index in range(8) if index != changed)
+
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("sharded", shards=8)
+
+    assert len(db) == 100
+    assert db["key7"] == {"index": -7}
+    assert db["key99"] == {"index": 99}
+
+    storify.close()
+
+def test_shard_count_is_fixed(root, log):
+    storify = Storify(root=root, log=log)
+    storify.get_db("sharded", shards=4)["value"] = 1
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+
+    with pytest.raises(ValueError):
+        storify.get_db("sharded", shards=8)
+
+    storify.close()
@@ -0,0 +1,139 @@
+import time
+import threading
+
+import pytest
+
+from storify import Storify
+from storify.exceptions import DatabaseClosedError
+
+def test_max_open_closes_least_recently_used(root, log):
+    storify = Storify(root=root, log=log, max_open=2)
+
+    first = storify.get_db("first")
+    second = storify.get_db("second")
+
+    # Used after second was opened, so second is the least recently used
+    first["items"] = []
+
+    third = storify.get_db("third")
+
+    assert second.defunct and not first.defunct
+    assert [db.name for db in storify.active_databases()] == ["first", "third"]
+
+    first["items"].append(1)
+    assert first["items"] == [1]
+
+    storify.close()
+
+def test_closed_database_raises(root, log):
+    storify = Storify(root=root, log=log, max_open=1)
+
+    db = storify.get_db("first")
+    db["items"] = []
+    items = db["items"]
+
+    storify.get_db("second")
+
+    with pytest.raises(DatabaseClosedError):
+        db["items"]
+
+    with pytest.raises(DatabaseClosedError):
+        items.append(1)
+
+    storify.close()
+
+def test_autosave_flushes_without_tick(root, log):
+    storify = Storify(root=root, log=log, save_interval=0.01, autosave=True)
+    db = storify.get_db("autosaved")
+    db["value"] = 1
+
+    deadline = time.time() + 5
+
+    while db.dirty and time.time() < deadline:
+        time.sleep(0.01)
+
+    # Written by the autosave thread; nothing was flushed or closed here
+    assert db.flush_count > 0
+    assert db.unpack(db.path) == {"value": 1}
+
+    storify.close()
+    assert not storify.scheduler.running
+
+def test_flush_reports_each_database(root, log, monkeypatch):
+    storify = Storify(root=root, log=log)
+
+    for name in ("small", "large", "clean", "broken"):
+        storify.get_db(name)["items"] = []
+
+    storify.flush()
+
+    storify.get_db("small")["items"].append(1)
+    storify.get_db("large")["items"].extend(range(3))
+    storify.get_db("large")["more"] = 1
+
+    broken = storify.get_db("broken")
+    broken["items"].append(1)
+    monkeypatch.setattr(broken, "flush", lambda: 1 / 0)
+
+    report = storify.flush(workers=2)
+
+    assert {name: result["status"] for name, result in report.items()} == {
+        "small": "flushed", "large": "flushed", "clean": "clean", "broken": "failed"}
+    assert report["large"]["changes"] > report["small"]["changes"] > 0
+    assert "ZeroDivisionError" in report["broken"]["error"]
+
+    other = Storify(root=root, log=log)
+    assert other.get_db("large")["items"] == [0, 1, 2]
+    other.close()
+
+    monkeypatch.undo()
+    storify.close()
+
+def test_flush_deadline(root, log, monkeypatch):
+    storify = Storify(root=root, log=log)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_flush():
+        started.set()
+        release.wait()
+        return True
+
+    for name in ("slow", "waiting"):
+        db = storify.get_db(name)
+        db["value"] = 1
+
+    # The slow database has more changes, so it's flushed first
+    storify.get_db("slow")["other"] = 1
+    monkeypatch.setattr(storify.get_db("slow"), "flush", slow_flush)
+
+    report = storify.flush(workers=1, deadline=0.2)
+
+    assert started.is_set()
+    assert report["slow"]["status"] == "timeout"
+    assert report["waiting"]["status"] == "not_started"
+
+    release.set()
+    monkeypatch.undo()
+    storify.close()
+
+def test_max_memory_unloads_least_recently_used(root, log):
+    storify = Storify(root=root, log=log)
+
+    first = storify.get_db("first")
+    first["items"] = list(range(1000))
+    storify.get_db("second")["items"] = list(range(1000))
+
+    storify.max_memory = first.memory_usage() * 1.5
+    third = storify.get_db("third")
+
+    # Unloaded rather than closed: changes were written, and using it reads them back
+    assert first.unloaded and not first.dirty and not first.defunct
+    assert not third.unloaded
+    assert storify.memory_usage() <= storify.max_memory
+
+    first["items"].append(1000)
+    assert not first.unloaded
+    assert first["items"] == list(range(1001))
+
+    storify.close()
@@ -0,0 +1,15 @@
+from storify.tracking import TrackedList
+
+def test_assignment_stores_a_tracked_copy(storify):
+    db = storify.get_db("tracking")
+
+    original = []
+    db["people"] = original
+    original.append("Lost")
+
+    people = db["people"]
+    people.append("Greg")
+
+    assert type(people) is TrackedList
+    assert db["people"] == ["Greg"]
+    assert db.dirty
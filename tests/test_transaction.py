@@ -0,0 +1,103 @@
+import pytest
+
+from storify import Storify
+from storify.model import Model
+
+class Pet(Model):
+    def __init__(self, name=""):
+        self.name = name
+        self.toys = []
+
+def test_rollback_restores_models(root, log):
+    # Pet isn't registered, so it can't be decoded from its dict form
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("pets")
+
+    db["pets"] = [Pet("Rex")]
+    db["pet"] = Pet("Tom")
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db["pets"][0].name = "Fido"
+            db["pets"][0].toys.append("ball")
+            db["pet"].toys.append("mouse")
+            raise RuntimeError
+
+    pets = db["pets"]
+
+    assert type(pets[0]) is Pet and type(db["pet"]) is Pet
+    assert (pets[0].name, pets[0].toys, db["pet"].toys) == ("Rex", [], [])
+
+    # The restored models are tracked like any other value
+    db.flush()
+    pets[0].toys.append("bone")
+    assert db.dirty
+
+    storify.close()
+
+def test_nested_rollback_restores_models(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("pets")
+    db["pets"] = [Pet("Rex")]
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            with db.transaction():
+                db["pets"][0].name = "Fido"
+
+            db["pets"].append(Pet("Tom"))
+            raise RuntimeError
+
+    assert [(type(pet), pet.name) for pet in db["pets"]] == [(Pet, "Rex")]
+
+    storify.close()
+
+def test_rollback_undoes_every_key(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("bank")
+    db["accounts"] = {"anna": 100, "bo": 0}
+    db["log"] = ["opened"]
+    db.flush()
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db["accounts"]["anna"] -= 50
+            db["accounts"]["bo"] += 50
+            db["log"].append("transfer")
+            db["new"] = 1
+            del db["log"]
+            raise RuntimeError
+
+    assert (db["accounts"], db["log"], "new" in db) == ({"anna": 100, "bo": 0}, ["opened"], False)
+
+    with db.transaction():
+        db["accounts"]["anna"] -= 50
+        db["accounts"]["bo"] += 50
+
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    assert storify.get_db("bank")["accounts"] == {"anna": 50, "bo": 50}
+    storify.close()
+
+def test_update_many_stores_all_or_nothing(root, log):
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("users")
+    db["0"] = {"name": "old"}
+
+    db.update_many(("%d" % i, {"name": "user %d" % i}) for i in range(100))
+
+    with pytest.raises(ValueError):
+        db.update_many([("100", {"name": "user 100"}), (100, "not a key")])
+
+    assert "100" not in db
+    storify.close()
+
+    storify = Storify(root=root, log=log)
+    db = storify.get_db("users")
+
+    assert len(db) == 100
+    assert db["0"] == {"name": "user 0"}
+    assert db["99"] == {"name": "user 99"}
+
+    storify.close()